@@ -0,0 +1,51 @@
+"""
+Finds the fastest batch size, thread count and decode pool size for each classifier on this host
+"""
+
+import click
+from osxphotos import PhotosDB
+
+from lib.autotune import TuningProfile, default_profile_path, tune_all
+from lib.classify.barcode import BarcodeClassifier
+from lib.classify.meme import MemeClassifier
+from lib.classify.qr import QRClassifier
+from lib.classify.rotation import RotatedClassifier
+from lib.common_options import library_path, verbose_mode, DEFAULT_CONFIDENCE_THRESHOLD
+from lib.osxphotos_utils import sample_preview_paths
+
+
+@click.command()
+@library_path
+@verbose_mode
+@click.option(
+    "--samples",
+    default=64,
+    help="Number of previews each calibration run classifies.",
+)
+@click.option(
+    "--profile",
+    "profile_path",
+    default=None,
+    help="Where to save the tuned settings. Defaults to a per-host file that flag_multi.py loads automatically.",
+)
+def autotune(library_path, verbose_mode, samples, profile_path):
+    classifiers = [
+        MemeClassifier(confidence_threshold=DEFAULT_CONFIDENCE_THRESHOLD),
+        QRClassifier(confidence_threshold=DEFAULT_CONFIDENCE_THRESHOLD),
+        BarcodeClassifier(confidence_threshold=DEFAULT_CONFIDENCE_THRESHOLD),
+        RotatedClassifier(confidence_threshold=DEFAULT_CONFIDENCE_THRESHOLD)
+    ]
+
+    image_paths = sample_preview_paths(PhotosDB(dbfile=library_path), samples)
+    if not image_paths:
+        raise click.ClickException("No previews found to calibrate with")
+    print(f"Calibrating with {len(image_paths)} previews")
+
+    profile = TuningProfile(profile_path or default_profile_path())
+    tune_all(classifiers, image_paths, profile, log=print, verbose_log=print if verbose_mode else None)
+    profile.save()
+    print(f"Saved profile to {profile.path}")
+
+
+if __name__ == "__main__":
+    autotune()
@@ -0,0 +1,63 @@
+"""
+Distills the flagging classifiers into one small multi-head student that's fast enough for CPU-only hosts
+"""
+
+import click
+
+from lib.classify.distilled import DEFAULT_BACKBONE
+from lib.classify.document import DocumentClassifier
+from lib.classify.meme import MemeClassifier
+from lib.classify.nsfw import NsfwClassifier
+from lib.classify.rotation import RotatedClassifier
+from lib.classify.screenshot import ScreenshotClassifier
+from lib.common_options import library_path, verbose_mode, DEFAULT_CONFIDENCE_THRESHOLD
+from lib.train.distill import DistillationTuner
+
+TEACHERS = {
+    "meme": lambda threshold: MemeClassifier(confidence_threshold=threshold),
+    "nsfw": lambda threshold: NsfwClassifier(confidence_threshold=threshold, enabled=True),
+    "screenshot": lambda threshold: ScreenshotClassifier(confidence_threshold=threshold, enabled=True),
+    "document": lambda threshold: DocumentClassifier(confidence_threshold=threshold, enabled=True),
+    "rotated": lambda threshold: RotatedClassifier(confidence_threshold=threshold),
+}
+
+
+@click.command()
+@library_path
+@verbose_mode
+@click.option(
+    "--teachers",
+    default="meme,rotated",
+    help=f"Comma-separated classifiers to distill, from: {', '.join(TEACHERS)}. "
+         f"Defaults to the model-based ones flag_multi.py runs.",
+)
+@click.option(
+    "--confidence_threshold",
+    "-C",
+    default=DEFAULT_CONFIDENCE_THRESHOLD,
+    help="Confidence threshold of the teachers; the student learns their thresholded decisions.",
+)
+@click.option("--output", "output_path", default="~/code/student", help="Where to save the student.")
+@click.option("--backbone", default=DEFAULT_BACKBONE, help="timm model to use as the student's backbone.")
+@click.option("--samples", default=5000, help="Number of library previews to distill over.")
+@click.option("--epochs", default=10, help="Maximum training epochs.")
+@click.option("--num-workers", default=0, help="DataLoader worker processes.")
+def distill(library_path, verbose_mode, teachers, confidence_threshold, output_path, backbone, samples, epochs, num_workers):
+    names = [name.strip() for name in teachers.split(",") if name.strip()]
+    unknown = [name for name in names if name not in TEACHERS]
+    if unknown:
+        raise click.BadParameter(f"Unknown teachers: {', '.join(unknown)}", param_hint="--teachers")
+
+    tuner = DistillationTuner(
+        verbose_mode=verbose_mode,
+        library_path=library_path,
+        output_path=output_path,
+        backbone=backbone,
+        num_workers=num_workers,
+        early_stopping_patience=3
+    )
+    tuner.distill([TEACHERS[name](confidence_threshold) for name in names], num_samples=samples, epochs=epochs)
+
+
+if __name__ == "__main__":
+    distill()
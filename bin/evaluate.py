@@ -0,0 +1,143 @@
+"""
+Compares classifier variants on labeled albums: precision and recall against photos/sec and peak memory
+"""
+
+import os
+
+import click
+from rich.console import Console
+from rich.table import Table
+
+from lib.classify import PipelineClassifier
+from lib.classify.barcode import BarcodeClassifier
+from lib.classify.distilled import DistilledClassifier
+from lib.classify.document import DocumentClassifier
+from lib.classify.meme import MemeClassifier
+from lib.classify.nsfw import NsfwClassifier
+from lib.classify.qr import QRClassifier
+from lib.classify.quantize import QUANTIZATION_MODES, VariantStore
+from lib.classify.rotation import RotatedClassifier
+from lib.classify.screenshot import ScreenshotClassifier
+from lib.common_options import library_path, verbose_mode, config_path
+from lib.config import parse_evaluations, EvaluationVariant
+from lib.evaluate import collect_labeled_photos, default_results_dir, evaluate_variant, read_ahead, save_report
+from lib.photoflagger import PhotoFlagger
+
+CLASSIFIERS = {
+    "meme": lambda threshold: MemeClassifier(confidence_threshold=threshold),
+    "nsfw": lambda threshold: NsfwClassifier(confidence_threshold=threshold, enabled=True),
+    "screenshot": lambda threshold: ScreenshotClassifier(confidence_threshold=threshold, enabled=True),
+    "document": lambda threshold: DocumentClassifier(confidence_threshold=threshold, enabled=True),
+    "rotated": lambda threshold: RotatedClassifier(confidence_threshold=threshold),
+    "qr": lambda threshold: QRClassifier(confidence_threshold=threshold),
+    "barcode": lambda threshold: BarcodeClassifier(confidence_threshold=threshold),
+}
+
+
+def build_classifier(variant: EvaluationVariant, positive_label):
+    if variant.student:
+        heads = {head.name: head for head in DistilledClassifier(variant.student).classifiers()}
+        if variant.classifier not in heads:
+            raise click.ClickException(f"{variant.name}: the student has no '{variant.classifier}' head; "
+                                       f"it has {', '.join(heads)}")
+        classifier = heads[variant.classifier]
+    elif variant.model:
+        classifier = PipelineClassifier(
+            model_name=os.path.expanduser(variant.model),
+            confidence_threshold=variant.confidence_threshold,
+            name=variant.name,
+            allowed_classes=[positive_label]
+        )
+    elif variant.classifier in CLASSIFIERS:
+        classifier = CLASSIFIERS[variant.classifier](variant.confidence_threshold)
+    else:
+        raise click.ClickException(f"{variant.name}: set model, student, or classifier to one of {', '.join(CLASSIFIERS)}")
+
+    if variant.quantization:
+        if variant.quantization not in QUANTIZATION_MODES or not classifier.quantizable_modules():
+            raise click.ClickException(f"{variant.name}: can't quantize {classifier.name} as '{variant.quantization}'")
+        if VariantStore.default().report(classifier, variant.quantization) is None:
+            raise click.ClickException(f"{variant.name}: no {variant.quantization} int8 variant of {classifier.name} "
+                                       f"built yet. Run bin/quantize.py")
+        classifier.quantization = variant.quantization
+        # Evaluated whatever its agreement with fp32; that's what's being measured
+        classifier.min_agreement = 0.0
+    classifier.apply_settings(variant.settings)
+    return classifier
+
+
+def _format_bytes(size):
+    return f"{size / 1024 ** 2:.0f} MB" if size else "-"
+
+
+@click.command()
+@library_path
+@verbose_mode
+@config_path
+@click.option("--evaluation", "evaluation_names", multiple=True, help="Evaluations to run. Defaults to all of them.")
+@click.option("--curves", is_flag=True, help="Print each variant's precision and recall across thresholds.")
+def evaluate(library_path, verbose_mode, config_path, evaluation_names, curves):
+    evaluations = parse_evaluations(config_path)
+    if evaluation_names:
+        evaluations = [evaluation for evaluation in evaluations if evaluation.name in evaluation_names]
+    if not evaluations:
+        raise click.ClickException(f"No evaluations to run; add an evaluation section to {config_path}")
+
+    console = Console()
+    flagger = PhotoFlagger(
+        keystore_name="evaluation",
+        verbose_mode=verbose_mode,
+        library_path=library_path,
+        classifiers=[]
+    )
+    for evaluation in evaluations:
+        if len(evaluation.label_album_mapping) < 2:
+            raise click.ClickException(f"{evaluation.name}: label_album_mapping needs a positive and a negative album")
+        positive_label = evaluation.label_album_mapping[0][0]
+        photos = collect_labeled_photos(flagger, evaluation.label_album_mapping)
+        positives = sum(photo.positive for photo in photos)
+        console.print(f"{evaluation.name}: {positives} '{positive_label}' and {len(photos) - positives} other photos")
+        read_ahead([photo.preview_path for photo in photos])
+
+        results_dir = default_results_dir(evaluation.name)
+        reports = []
+        for variant in evaluation.variants:
+            classifier = build_classifier(variant, positive_label)
+            reports.append(evaluate_variant(variant.name, vars(variant), classifier, photos, results_dir, log=console.print))
+
+        table = Table(title=evaluation.name)
+        for column in ("Variant", "Threshold", "Precision", "Recall", "F1", "Best F1 (at)", "Photos/sec",
+                       "Peak memory", "Model"):
+            table.add_column(column, justify="left" if column == "Variant" else "right")
+        for report in reports:
+            table.add_row(
+                report.name,
+                f"{report.threshold:.2f}",
+                f"{report.precision:.3f}",
+                f"{report.recall:.3f}",
+                f"{report.f1:.3f}",
+                f"{report.best_f1:.3f} ({report.best_threshold:.2f})",
+                f"{report.photos_per_second:.1f}" if report.photos_per_second else "-",
+                _format_bytes(report.peak_memory),
+                _format_bytes(report.model_bytes)
+            )
+        console.print(table)
+
+        if curves:
+            for report in reports:
+                curve = Table(title=f"{report.name} by threshold")
+                for column in ("Threshold", "Precision", "Recall", "F1"):
+                    curve.add_column(column, justify="right")
+                for point in report.curve:
+                    curve.add_row(*(f"{point[key]:.2f}" if key == "threshold" else f"{point[key]:.3f}"
+                                    for key in ("threshold", "precision", "recall", "f1")))
+                console.print(curve)
+
+        unreadable = max((report.unreadable for report in reports), default=0)
+        if unreadable:
+            console.print(f"{unreadable} previews couldn't be scored and were left out")
+        console.print(f"Saved results to {save_report(results_dir, reports)}")
+
+
+if __name__ == "__main__":
+    evaluate()
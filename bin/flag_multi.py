@@ -5,16 +5,39 @@ Runs multiple classifiers on photos simultaneously
 import click
 
 from lib.classify.barcode import BarcodeClassifier
+from lib.classify.quantize import apply_quantization
+from lib.classify.distilled import DistilledClassifier
 from lib.classify.meme import MemeClassifier
 from lib.classify.qr import QRClassifier
 from lib.classify.rotation import RotatedClassifier
-from lib.common_options import common_options, env
+from lib.common_options import common_options, env, memory_budget, time_budget, time_limit, priority, config_path, movies, \
+    work_queue, worker_id, staging_size, staging_dir
+from lib.config import parse_priority_albums, parse_quantization, parse_governor
+from lib.governor import ResourceGovernor
 from lib.photoflagger import PhotoFlagger
+from lib.staging import StagingCache
+from lib.workqueue import SQLiteWorkQueue
 
 
 @click.command()
 @common_options
 @env
+@memory_budget
+@time_budget
+@time_limit
+@priority
+@config_path
+@movies
+@work_queue
+@worker_id
+@staging_size
+@staging_dir
+@click.option(
+    "--student",
+    "student_path",
+    default=None,
+    help="Distilled student from bin/distill.py; its heads replace the classifiers of the same name.",
+)
 def flag_photos(
     verbose_mode,
     dry_run,
@@ -22,7 +45,18 @@ def flag_photos(
     library_path,
     selected,
     confidence_threshold,
-    env
+    env,
+    memory_budget,
+    time_budget,
+    time_limit,
+    priority,
+    config_path,
+    movies,
+    work_queue,
+    worker_id,
+    staging_size,
+    staging_dir,
+    student_path
 ):
     classifiers = [
         MemeClassifier(confidence_threshold=confidence_threshold),
@@ -31,17 +65,34 @@ def flag_photos(
         RotatedClassifier(confidence_threshold=confidence_threshold)
     ]
 
+    if student_path:
+        heads = DistilledClassifier(student_path).classifiers()
+        distilled = {head.name for head in heads}
+        classifiers = [classifier for classifier in classifiers if classifier.name not in distilled] + heads
+
     enabled_classifiers = [classifier for classifier in classifiers if classifier.enabled]
+    apply_quantization(enabled_classifiers, parse_quantization(config_path))
+    governor_config = parse_governor(config_path)
 
     PhotoFlagger(
         verbose_mode=verbose_mode,
         library_path=library_path,
         classifiers=enabled_classifiers,
-        keystore_name=f"{env}_flag_multi.db"
+        keystore_name=f"{env}_flag_multi.db",
+        memory_budget=memory_budget,
+        time_limits={classifier.name: time_limit for classifier in enabled_classifiers} if time_limit else None,
+        work_queue=SQLiteWorkQueue(work_queue) if work_queue else None,
+        worker_id=worker_id,
+        governor=ResourceGovernor.from_config(governor_config) if governor_config else None,
+        staging=StagingCache(staging_dir, staging_size) if staging_size else None
     ).process_photos(
         dry_run=dry_run,
         reset=reset,
-        selected=selected
+        selected=selected,
+        movies=movies,
+        time_budget=time_budget,
+        priority=priority,
+        priority_albums=parse_priority_albums(config_path) if priority == "albums" else None
     )
 
 
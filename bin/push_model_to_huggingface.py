@@ -1,33 +1,40 @@
 import os
-import shutil
+import tempfile
 from pathlib import Path
 
 import click
-import torch
 import yaml
-from huggingface_hub import Repository
+
+from lib.common_options import _parse_size
+from lib.publish import GitRemote, publish
+from lib.publish.convert import load_state_dict, write_safetensors, DEFAULT_SHARD_SIZE, LEGACY_FILENAME
 
 
 @click.command()
-@click.option("--token", "-t", required=True)
+@click.option("--token", "-t", default=None, help="Hugging Face authentication token. Required unless using --git-remote.")
 @click.option("--model_path", "-m", required=True, default="/Users/davidmerrick/code/meme_classifier/model.pth")
 @click.option("--config_path", "-c", required=True, default="/Users/davidmerrick/code/meme_classifier/preprocessor_config.json")
 @click.option("--repo_id", "-r", required=True, default="davidmerrick/meme_classifier")
-def push_pytorch_model_to_hub(model_path, config_path, repo_id, token):
+@click.option("--git-remote", default=None, help="Push to this git repository instead of the Hub, e.g. a local bare repository.")
+@click.option("--shard-size", default=str(DEFAULT_SHARD_SIZE), callback=_parse_size, help="Maximum size of a safetensors shard, e.g. 1G.")
+@click.option("--message", default="Upload custom PyTorch model and config", help="Commit message.")
+def push_pytorch_model_to_hub(model_path, config_path, repo_id, token, git_remote, shard_size, message):
     """
     Push a PyTorch model and its configuration to Hugging Face Hub.
 
+    The model is converted to sharded safetensors and only the files whose content changed since the
+    last push are uploaded; if nothing changed, nothing is committed. A model.pth left from before
+    safetensors is deleted, so consumers load the new weights.
+
     Args:
         model_path (str): Path to the model file (.pth).
         config_path (str): Path to the config file (.yaml).
         repo_id (str): Hugging Face repository ID (e.g., "username/repo_name").
         token (str): Hugging Face authentication token.
     """
-    # Load the model state dictionary
     model_path = Path(model_path)
     if not model_path.exists():
         raise FileNotFoundError(f"Model file not found at {model_path}")
-    state_dict = torch.load(model_path, map_location="cpu")
 
     # Load the configuration
     config_path = Path(config_path)
@@ -36,48 +43,35 @@ def push_pytorch_model_to_hub(model_path, config_path, repo_id, token):
     with open(config_path, "r") as f:
         config = yaml.safe_load(f)
 
-    # Define repository directory
-    repo_dir = Path("/tmp/temp_hf_repo")
-
-    # Handle non-empty folders or unrelated Git repositories
-    if repo_dir.exists():
-        if not (repo_dir / ".git").exists():
-            print(f"Non-Git folder '{repo_dir}' detected. Removing it.")
-            shutil.rmtree(repo_dir)
-        else:
-            # Check if the existing repo matches the target repo
-            os.chdir(repo_dir)
-            with os.popen("git remote get-url origin") as remote_check:
-                existing_remote = remote_check.read().strip()
-            os.chdir("..")
-            target_repo_url = f"https://huggingface.co/{repo_id}"
-            if existing_remote != target_repo_url:
-                print(f"Unrelated Git repository detected at '{repo_dir}'. Removing it.")
-                shutil.rmtree(repo_dir)
-
-    # Clone or create the Hugging Face repository
-    print(f"Creating or cloning Hugging Face repository: {repo_id}")
-    repo_url = f"https://huggingface.co/{repo_id}"
-    repo = Repository(local_dir=repo_dir, clone_from=repo_url, use_auth_token=token)
+    if git_remote is None and token is None:
+        raise click.UsageError("--token is required to push to the Hub")
 
-    # Change to the repository directory
-    os.chdir(repo_dir)
+    with tempfile.TemporaryDirectory(prefix="harmonia-staging-") as staging_dir:
+        print(f"Converting {model_path} to safetensors...")
+        write_safetensors(load_state_dict(model_path), staging_dir, shard_size)
+        with open(os.path.join(staging_dir, "config.yaml"), "w") as f:
+            yaml.dump(config, f)
 
-    # Save the model and config in the repository directory
-    print(f"Saving model and config to {repo_dir}...")
-    torch.save(state_dict, "model.pth")
-    with open("config.yaml", "w") as f:
-        yaml.dump(config, f)
+        if git_remote is not None:
+            remote = GitRemote(git_remote)
+            destination = git_remote
+        else:
+            # Only needed for the Hub, and slow to import
+            from lib.publish.huggingface import HuggingFaceRemote
+            remote = HuggingFaceRemote(repo_id, token)
+            destination = f"https://huggingface.co/{repo_id}"
 
-    # Add and commit the changes
-    print("Adding and committing changes...")
-    repo.git_add(".")
-    repo.git_commit("Upload custom PyTorch model and config")
+        with remote:
+            result = publish(staging_dir, remote, message, replaces=[LEGACY_FILENAME])
 
-    # Push to the Hugging Face Hub
-    print("Pushing to Hugging Face Hub...")
-    repo.git_push()
-    print(f"Model and config pushed to Hugging Face Hub: {repo_url}")
+    if not result.changed:
+        print(f"{destination} is already up to date; nothing to push")
+        return
+    print(
+        f"Uploaded {len(result.uploaded)} files ({result.bytes_uploaded / 2 ** 20:.1f} MB), "
+        f"deleted {len(result.deleted)}, {len(result.unchanged)} unchanged"
+    )
+    print(f"Model and config pushed to {destination}")
 
 
 if __name__ == "__main__":
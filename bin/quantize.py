@@ -0,0 +1,82 @@
+"""
+Builds the int8 variants selected in the config's quantization section, and checks each against its fp32 model
+"""
+
+import click
+from osxphotos import PhotosDB
+
+from lib.classify.document import DocumentClassifier
+from lib.classify.meme import MemeClassifier
+from lib.classify.nsfw import NsfwClassifier
+from lib.classify.quantize import VariantStore, apply_quantization, build_variant, rejection_reason
+from lib.classify.rotation import RotatedClassifier
+from lib.classify.screenshot import ScreenshotClassifier
+from lib.common_options import library_path, verbose_mode, config_path, DEFAULT_CONFIDENCE_THRESHOLD
+from lib.config import parse_quantization
+from lib.osxphotos_utils import sample_preview_paths
+
+CLASSIFIERS = {
+    "meme": lambda threshold: MemeClassifier(confidence_threshold=threshold),
+    "nsfw": lambda threshold: NsfwClassifier(confidence_threshold=threshold, enabled=True),
+    "screenshot": lambda threshold: ScreenshotClassifier(confidence_threshold=threshold, enabled=True),
+    "document": lambda threshold: DocumentClassifier(confidence_threshold=threshold, enabled=True),
+    "rotated": lambda threshold: RotatedClassifier(confidence_threshold=threshold),
+}
+
+
+@click.command()
+@library_path
+@verbose_mode
+@config_path
+@click.option(
+    "--confidence_threshold",
+    "-C",
+    default=DEFAULT_CONFIDENCE_THRESHOLD,
+    help="Confidence threshold the classifiers flag with; variants are checked on their thresholded decisions.",
+)
+def quantize(library_path, verbose_mode, config_path, confidence_threshold):
+    config = parse_quantization(config_path)
+    unknown = [name for name in config.classifiers if name not in CLASSIFIERS]
+    if unknown:
+        raise click.ClickException(f"Can't quantize {', '.join(unknown)}; expected any of {', '.join(CLASSIFIERS)}")
+    if not config.classifiers:
+        raise click.ClickException(f"No classifiers to quantize; add a quantization section to {config_path}")
+
+    classifiers = [CLASSIFIERS[name](confidence_threshold) for name in config.classifiers]
+    apply_quantization(classifiers, config)
+
+    # Calibration and agreement are measured on different photos, so a variant isn't checked on what it was fit to
+    image_paths = sample_preview_paths(PhotosDB(dbfile=library_path), config.calibration_samples + config.check_samples)
+    if len(image_paths) < 2:
+        raise click.ClickException("Not enough previews found to calibrate with")
+    split = len(image_paths) * config.calibration_samples // (config.calibration_samples + config.check_samples)
+    split = min(max(split, 1), len(image_paths) - 1)
+    calibration_paths = image_paths[:split]
+    check_paths = image_paths[split:]
+    print(f"Calibrating with {len(calibration_paths)} previews and checking agreement on {len(check_paths)}")
+
+    store = VariantStore.default()
+    for classifier in classifiers:
+        mode = classifier.quantization
+        print(f"Quantizing {classifier.name} ({mode})...")
+        report = build_variant(classifier, mode, calibration_paths, check_paths, store)
+        reason = rejection_reason(report, classifier.min_agreement)
+        flagged_agreement = (
+            f"{report['flagged_agreement'] * 100:.1f}% on the {report['flagged_photos']} photos fp32 flags"
+            if report["flagged_agreement"] is not None else "fp32 flagged none of the check photos"
+        )
+        print(
+            f"{classifier.name}: {report['agreement'] * 100:.1f}% agreement with fp32, {flagged_agreement}; "
+            f"{report['gained']} newly flagged, {report['lost']} no longer flagged, {report['changed']} flagged differently; "
+            f"{report['fp32_seconds'] / report['int8_seconds']:.2f}x faster, "
+            f"{report['int8_bytes'] / report['fp32_bytes'] * 100:.0f}% of the memory"
+            f" - {'accepted' if reason is None else f'rejected, as {reason}; flag_multi.py keeps using fp32'}"
+        )
+        if verbose_mode:
+            print(report)
+
+    print(f"Saved variants to {store.path}")
+
+
+if __name__ == "__main__":
+    quantize()
@@ -7,20 +7,71 @@ import click
 from lib.common_options import library_path, verbose_mode, config_path
 from lib.config import parse_training_config
 from lib.train import ModelTuner
+from lib.train.multitask import MultiTaskModelTuner
+
+
+def _loader_options(config):
+    return dict(
+        cache_dir=config.cache_dir,
+        num_workers=config.num_workers,
+        pin_memory=config.pin_memory,
+        checkpoint_every=config.checkpoint_every,
+        resume=config.resume,
+        early_stopping_patience=config.early_stopping_patience,
+        mixed_precision=config.mixed_precision
+    )
+
+
+def _train_multitask(configs, library_path, verbose_mode, output_path):
+    base_models = {config.base_model for config in configs}
+    if len(base_models) > 1:
+        raise click.UsageError(f"Multi-task training needs a single base model, got: {', '.join(base_models)}")
+
+    trainer = MultiTaskModelTuner(
+        verbose_mode=verbose_mode,
+        library_path=library_path,
+        output_path=output_path,
+        base_model=base_models.pop(),
+        **_loader_options(configs[0])
+    )
+    trainer.train(configs, epochs=max(config.epochs for config in configs))
 
 
 @click.command()
 @library_path
 @verbose_mode
 @config_path
-def train_models(library_path, verbose_mode, config_path):
+@click.option(
+    "--multi-task",
+    "multi_task",
+    is_flag=True,
+    help="Train one shared backbone with a head per training config, in a single pass over the library.",
+)
+@click.option(
+    "--multi-task-output",
+    "multi_task_output",
+    default="~/code/multitask",
+    help="Where to save the multi-task model.",
+)
+def train_models(library_path, verbose_mode, config_path, multi_task, multi_task_output):
     configs = parse_training_config(config_path)
+    if multi_task:
+        _train_multitask(configs, library_path, verbose_mode, multi_task_output)
+        return
+
     for config in configs:
         trainer = ModelTuner(
             verbose_mode=verbose_mode,
             library_path=library_path,
             base_model=config.base_model,
-            output_path=config.output_path
+            output_path=config.output_path,
+            mode=config.mode,
+            compare_model=config.compare_model,
+            incremental=config.incremental,
+            replay_ratio=config.replay_ratio,
+            incremental_tolerance=config.incremental_tolerance,
+            processes=config.processes,
+            **_loader_options(config)
         )
         trainer.train(config.label_album_mapping, epochs=config.epochs)
 
@@ -0,0 +1,209 @@
+import datetime
+import json
+import logging
+import os
+import socket
+import time
+
+import torch
+from osxphotos.cli.common import get_data_dir
+
+from lib.classify import Classifier
+
+logger = logging.getLogger("autotune")
+
+# A candidate setting has to beat the current best by this much to replace it, so noise doesn't pick settings
+MIN_IMPROVEMENT = 0.05
+# During a run, a classifier slower than this fraction of its tuned throughput counts as degraded
+DEFAULT_DROP_FRACTION = 0.6
+# Consecutive degraded batches before a classifier's settings are stepped down
+DEFAULT_PATIENCE = 3
+# Settings stepped down at runtime, in order
+STEP_DOWN_ORDER = ("batch_size", "threads", "decode_workers")
+
+
+def default_profile_path():
+    """
+    Profiles are per host: the best settings depend on the cores, memory and accelerator available.
+    """
+    return os.path.join(get_data_dir(), f"autotune_{socket.gethostname()}.json")
+
+
+class TuningProfile:
+    """
+    The tuned settings and measured throughput of each classifier on one host, kept in a JSON file.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._state = {"classifiers": {}}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self._state = json.load(f)
+
+    @staticmethod
+    def _key(classifier: Classifier):
+        # A distilled student's heads share their teachers' names but not their performance
+        return f"{type(classifier).__name__}:{classifier.name}"
+
+    def settings_for(self, classifier: Classifier):
+        return self._state["classifiers"].get(self._key(classifier), {}).get("settings", {})
+
+    def photos_per_second(self, classifier: Classifier):
+        return self._state["classifiers"].get(self._key(classifier), {}).get("photos_per_second")
+
+    def update(self, classifier: Classifier, settings, photos_per_second):
+        self._state["classifiers"][self._key(classifier)] = {
+            "settings": settings,
+            "photos_per_second": photos_per_second,
+            "tuned_at": datetime.datetime.now().isoformat(),
+        }
+
+    def apply(self, classifiers):
+        """
+        Applies the profile's settings to the classifiers it has entries for. Returns those classifiers.
+        """
+        tuned = [classifier for classifier in classifiers if self.settings_for(classifier)]
+        for classifier in tuned:
+            classifier.apply_settings(self.settings_for(classifier))
+            logger.debug(f"Using tuned settings for {classifier.name}: {classifier.settings()}")
+        return tuned
+
+    def save(self):
+        self._state["host"] = socket.gethostname()
+        self._state["cpu_count"] = os.cpu_count()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def measure(classifier: Classifier, image_paths):
+    """
+    Returns the classifier's throughput in images per second over image_paths, with its current settings.
+    """
+    classifier.apply_threads()
+    classifier.clear_caches()
+    start = time.perf_counter()
+    classifier.classify_batch(image_paths)
+    return len(image_paths) / (time.perf_counter() - start)
+
+
+def tune(classifier: Classifier, image_paths, log=print):
+    """
+    Finds fast settings for a classifier by sweeping one setting at a time over its candidates,
+    keeping the others at their best value so far.
+
+    :return: The best settings and their throughput in images per second.
+    """
+    classifier.load()
+    # The first call pays for lazy initialization and cold caches
+    classifier.classify_batch(image_paths[:8])
+
+    best = classifier.settings()
+    best_rate = measure(classifier, image_paths)
+    log(f"  {best}: {best_rate:.1f} photos/s")
+    for name, candidates in classifier.tunables().items():
+        for value in candidates:
+            if value == best[name]:
+                continue
+            classifier.apply_settings({**best, name: value})
+            rate = measure(classifier, image_paths)
+            log(f"  {name}={value}: {rate:.1f} photos/s")
+            if rate > best_rate * (1 + MIN_IMPROVEMENT):
+                best = classifier.settings()
+                best_rate = rate
+        classifier.apply_settings(best)
+    return best, best_rate
+
+
+def tune_all(classifiers, image_paths, profile: TuningProfile, log=print, verbose_log=None):
+    """
+    Tunes each enabled classifier and records its settings in the profile. Classifiers sharing a tuning
+    group, like barcode and QR on one detection engine, are tuned once and given the same settings, so
+    one doesn't overwrite the other's. Threads left at torch's default are pinned to that default, so a
+    classifier isn't measured with the thread count the previous one was tuned to.
+    """
+    default_threads = torch.get_num_threads()
+    tuned_groups = {}
+    for classifier in classifiers:
+        if not classifier.enabled or not classifier.tunables():
+            continue
+        if "threads" in classifier.tunables() and classifier.threads is None:
+            classifier.threads = default_threads
+
+        group = classifier.tuning_group()
+        if group is not None and id(group) in tuned_groups:
+            settings, photos_per_second = tuned_groups[id(group)]
+            classifier.apply_settings(settings)
+            log(f"{classifier.name} shares its settings with an already tuned classifier: {settings}")
+        else:
+            log(f"Tuning {classifier.name}...")
+            settings, photos_per_second = tune(classifier, image_paths, log=verbose_log or (lambda message: None))
+            log(f"Best settings for {classifier.name}: {settings} ({photos_per_second:.1f} photos/s)")
+            if group is not None:
+                tuned_groups[id(group)] = (settings, photos_per_second)
+        profile.update(classifier, settings, photos_per_second)
+        classifier.unload()
+
+
+class ThroughputMonitor:
+    """
+    Watches each classifier's throughput during a run. When a classifier stays well below its tuned
+    throughput, e.g. because the machine got busy or is throttling, one of its settings is stepped down
+    to the next smaller candidate. A step that doesn't help is reverted, and that classifier is left alone
+    for the rest of the run.
+    """
+
+    def __init__(self, profile: TuningProfile, drop_fraction=DEFAULT_DROP_FRACTION, patience=DEFAULT_PATIENCE):
+        self.profile = profile
+        self.drop_fraction = drop_fraction
+        self.patience = patience
+        self._slow_batches = {}
+        self._last_step = {}
+        self._settled = set()
+
+    def record(self, classifier: Classifier, num_images, seconds):
+        expected = self.profile.photos_per_second(classifier)
+        # Batches smaller than the classifier's batch size, like deduplicated leftovers, aren't representative
+        if expected is None or classifier.name in self._settled or num_images < classifier.batch_size or seconds <= 0:
+            return
+        rate = num_images / seconds
+
+        if classifier.name in self._last_step:
+            previous_settings, previous_rate = self._last_step.pop(classifier.name)
+            if rate < previous_rate:
+                classifier.apply_settings(previous_settings)
+                self._settled.add(classifier.name)
+                logger.info(
+                    f"{classifier.name}: stepping down didn't help ({rate:.1f} vs {previous_rate:.1f} photos/s); "
+                    f"reverted to {previous_settings}"
+                )
+                return
+
+        if rate >= expected * self.drop_fraction:
+            self._slow_batches[classifier.name] = 0
+            return
+        self._slow_batches[classifier.name] = self._slow_batches.get(classifier.name, 0) + 1
+        if self._slow_batches[classifier.name] >= self.patience:
+            self._slow_batches[classifier.name] = 0
+            self._step_down(classifier, rate, expected)
+
+    def _step_down(self, classifier: Classifier, rate, expected):
+        settings = classifier.settings()
+        tunables = classifier.tunables()
+        for name in STEP_DOWN_ORDER:
+            if settings.get(name) is None:
+                continue
+            smaller = [value for value in tunables[name] if value < settings[name]]
+            if smaller:
+                self._last_step[classifier.name] = (settings, rate)
+                classifier.apply_settings({name: smaller[-1]})
+                logger.info(
+                    f"{classifier.name}: throughput dropped to {rate:.1f} photos/s (tuned {expected:.1f}); "
+                    f"lowering {name} from {settings[name]} to {smaller[-1]}"
+                )
+                return
+        self._settled.add(classifier.name)
+        logger.info(f"{classifier.name}: throughput dropped to {rate:.1f} photos/s, but its settings are already minimal")
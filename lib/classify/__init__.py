@@ -1,10 +1,60 @@
+import gc
+import os
 from abc import abstractmethod, ABC
 
+import torch
 from PIL import Image
-from transformers import pipeline
+from torch import nn
+from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+from lib.classify.preprocess import ProcessorInputs, decode_images
+from lib.classify.quantize import DEFAULT_MIN_AGREEMENT, load_variant
+
+# Predictions per image, like the image-classification pipeline's default top_k
+TOP_K = 5
+
+
+def module_footprint(*modules):
+    """
+    Returns the bytes held by the parameters and buffers of torch modules, including the packed weights of
+    int8-quantized layers, which aren't parameters.
+    """
+    total = 0
+    for module in modules:
+        if module is None:
+            continue
+        for value in module.state_dict().values():
+            # Quantized layers store their weight and bias as a tuple
+            for tensor in value if isinstance(value, tuple) else (value,):
+                if isinstance(tensor, torch.Tensor):
+                    total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def thread_candidates():
+    """
+    Torch intra-op thread counts worth trying on this host: powers of two up to the core count, and the core count.
+    """
+    cpu_count = os.cpu_count() or 1
+    return sorted({2 ** power for power in range(cpu_count.bit_length()) if 2 ** power <= cpu_count} | {cpu_count})
 
 
 class Classifier(ABC):
+    # Seconds allowed per image before the watchdog abandons the call
+    time_limit = 60
+
+    # Performance settings, tuned per host by lib.autotune for the settings listed in tunables()
+    batch_size = 1  # Images per forward pass in classify_batch
+    threads = None  # Torch intra-op threads while this classifier runs; None leaves torch's default
+    decode_workers = 1  # Threads decoding images for classify_batch
+
+    # "dynamic" or "static" to run a cached int8 variant of the model; see lib.classify.quantize
+    quantization = None
+    # A variant is only used if it agreed with the fp32 model on at least this fraction of sample photos
+    min_agreement = DEFAULT_MIN_AGREEMENT
+    # Whether a score equal to the confidence threshold is flagged, rather than only scores above it
+    flags_at_threshold = False
+
     def __init__(
         self,
         confidence_threshold,
@@ -16,13 +66,130 @@ class Classifier(ABC):
         self.name = name
         self.allowed_classes = allowed_classes
         self.enabled = enabled
+        self.loaded = False
+
+    def load(self, quantized=True):
+        """
+        Load the classifier's model. Called on first use, or by a ResidencyManager.
+        :param quantized: Use the cached int8 variant selected by the quantization setting, if it passed its agreement check.
+        """
+        if not self.loaded:
+            self._load()
+            if quantized and self.quantization is not None:
+                load_variant(self)
+            self.loaded = True
+
+    def unload(self):
+        """
+        Release the classifier's model; it's loaded again the next time it's used.
+        """
+        if self.loaded:
+            self._unload()
+            self.loaded = False
+            gc.collect()
+
+    def _load(self):
+        pass
+
+    def _unload(self):
+        pass
+
+    def memory_footprint(self):
+        """
+        Approximate bytes held by the loaded model.
+        """
+        return 0
+
+    def quantizable_modules(self):
+        """
+        Layer types an int8 variant of the model quantizes; empty if the classifier has no quantizable torch model.
+        """
+        return ()
+
+    def signature(self):
+        """
+        Identifies the classifier's configuration. Stored results are only reused for the same signature.
+        """
+        return f"{type(self).__name__}:{self.name}:{self.confidence_threshold}"
+
+    def tunables(self):
+        """
+        Returns {setting: candidate values} for the performance settings this classifier responds to.
+        """
+        return {}
+
+    def settings(self):
+        return {name: getattr(self, name) for name in self.tunables()}
+
+    def tuning_group(self):
+        """
+        An object whose settings this classifier shares with others, like a shared detection engine, or None.
+        Classifiers in the same group are tuned once, together.
+        """
+        return None
+
+    def apply_settings(self, settings):
+        """
+        Applies tuned settings, ignoring any this classifier doesn't have.
+        """
+        for name, value in settings.items():
+            if name in self.tunables():
+                setattr(self, name, value)
+
+    def clear_caches(self):
+        """
+        Forget memoized results, so a benchmark measures real work.
+        """
+        pass
+
+    def apply_threads(self):
+        """
+        Sets torch's intra-op thread count for this classifier; called before each classify_batch, on the
+        thread that runs it, since the count doesn't carry over to threads that already ran torch code.
+        """
+        if self.threads is not None and torch.get_num_threads() != self.threads:
+            torch.set_num_threads(self.threads)
 
     @abstractmethod
     def classify(self, image_path):
         pass
 
+    def classify_batch(self, image_paths):
+        """
+        Classify several images at once. Subclasses that can vectorize or parallelize across images override this.
+        """
+        return [self.classify(image_path) for image_path in image_paths]
+
+    def classify_batch_checked(self, image_paths):
+        """
+        Like classify_batch, but also returns whether each image could be read. A None result alone doesn't
+        say: for some classifiers, like rotated, None is a real result. Classifiers that report unreadable
+        images as None override this; the others raise for them.
+        :return: (results, readable)
+        """
+        return self.classify_batch(image_paths), [True] * len(image_paths)
+
+    def score_batch(self, image_paths):
+        """
+        Returns, per image, the confidence behind flagging it: an image is flagged when its score clears the
+        confidence threshold, so sweeping the threshold over the scores traces precision against recall.
+        Classifiers without a confidence score return 1.0 for images they flag, 0.0 otherwise, and None for
+        images they couldn't read. A None result isn't taken to mean unreadable, since for some it's "not flagged".
+        """
+        results, readable = self.classify_batch_checked(image_paths)
+        return [
+            None if not ok else 1.0 if result else 0.0
+            for result, ok in zip(results, readable)
+        ]
+
 
 class PipelineClassifier(Classifier):
+    """
+    Classifies with a Hugging Face image-classification model, returning predictions in the same
+    format as the image-classification pipeline. Models whose processors share a configuration share
+    one BatchPreprocessor, so each batch is decoded and normalized once for all of them.
+    """
+
     def __init__(
         self,
         model_name: str,
@@ -37,8 +204,39 @@ class PipelineClassifier(Classifier):
             allowed_classes=allowed_classes,
             enabled=enabled
         )
-        if enabled:
-            self.pipeline = pipeline("image-classification", model=model_name, use_fast=True)
+        self.model_name = model_name
+        self.model = None
+        self.inputs = None
+
+    def _load(self):
+        processor = AutoImageProcessor.from_pretrained(self.model_name)
+        self.model = AutoModelForImageClassification.from_pretrained(self.model_name)
+        self.model.eval()
+        self.inputs = ProcessorInputs(processor, self.name)
+
+    def _unload(self):
+        self.model = None
+        self.inputs = None
+
+    def memory_footprint(self):
+        return module_footprint(self.model)
+
+    def quantizable_modules(self):
+        return (nn.Linear,)
+
+    def signature(self):
+        return f"{super().signature()}:{self.model_name}"
+
+    def tunables(self):
+        return {
+            "batch_size": [1, 2, 4, 8, 16, 32],
+            "threads": thread_candidates(),
+            "decode_workers": [1, 2, 4, 8],
+        }
+
+    def clear_caches(self):
+        if self.inputs is not None:
+            self.inputs.clear()
 
     def _load_image(self, image_path):
         try:
@@ -50,15 +248,57 @@ class PipelineClassifier(Classifier):
             return None
 
     def classify(self, image_path):
+        return self.classify_batch([image_path])[0]
+
+    def classify_batch(self, image_paths):
+        return [
+            self._get_predicted_class(predictions) if predictions is not None else None
+            for predictions in self._predictions_batch(image_paths)
+        ]
+
+    def score_batch(self, image_paths):
+        return [
+            self._score(predictions) if predictions is not None else None
+            for predictions in self._predictions_batch(image_paths)
+        ]
+
+    def classify_batch_checked(self, image_paths):
+        predictions = self._predictions_batch(image_paths)
+        return (
+            [self._get_predicted_class(row) if row is not None else None for row in predictions],
+            [row is not None for row in predictions]
+        )
+
+    def _predictions_batch(self, image_paths):
+        """
+        Returns the top predictions per image, or None for images that couldn't be loaded.
+        """
         if not self.enabled:
             raise ValueError("Classifier is not enabled")
 
-        image = self._load_image(image_path)
-        if image is None:
-            return None
-        predictions = self.pipeline(image)  # Pass the image directly to the pipeline
-        return self._get_predicted_class(predictions)
+        self.load()
+        pixel_values, loaded = self.inputs(image_paths, self._load_image, self.decode_workers)
+        predictions = iter(self._predict(pixel_values))
+        return [next(predictions) if ok else None for ok in loaded]
+
+    def _predict(self, pixel_values):
+        """
+        Returns the top predictions per image as [{"label", "score"}, ...], highest score first.
+        """
+        id2label = self.model.config.id2label
+        predictions = []
+        with torch.no_grad():
+            for start in range(0, len(pixel_values), self.batch_size):
+                logits = self.model(pixel_values=pixel_values[start:start + self.batch_size]).logits
+                scores, ids = logits.softmax(dim=-1).topk(min(TOP_K, logits.shape[-1]), dim=-1)
+                predictions.extend(
+                    [{"label": id2label[idx], "score": score} for score, idx in zip(row_scores.tolist(), row_ids.tolist())]
+                    for row_scores, row_ids in zip(scores, ids)
+                )
+        return predictions
+
+    def _score(self, predictions):
+        return next((pred['score'] for pred in predictions if pred['label'] in self.allowed_classes), 0)
 
     def _get_predicted_class(self, predictions):
-        score = next((pred['score'] for pred in predictions if pred['label'] in self.allowed_classes), 0)
-        return score > self.confidence_threshold
+        return self._score(predictions) > self.confidence_threshold
@@ -1,22 +1,44 @@
-import cv2
-
 from lib.classify import Classifier
+from lib.classify.codes import CodeDetectionEngine, worker_candidates
 
 
 class BarcodeClassifier(Classifier):
-    def __init__(self, confidence_threshold, enabled=True):
+    time_limit = 20
+
+    def __init__(self, confidence_threshold, enabled=True, engine: CodeDetectionEngine = None):
         super().__init__(
             confidence_threshold,
             name="barcode",
             allowed_classes=None,
             enabled=enabled
         )
+        self.engine = engine or CodeDetectionEngine.shared()
+        self.decode_workers = self.engine.workers
+        if enabled:
+            self.engine.enable(barcode=True)
+
+    def tunables(self):
+        return {"decode_workers": worker_candidates()}
+
+    def apply_settings(self, settings):
+        super().apply_settings(settings)
+        self.engine.set_workers(self.decode_workers)
+
+    def tuning_group(self):
+        return self.engine
+
+    def clear_caches(self):
+        self.engine.clear_results()
 
     def classify(self, image_path):
-        img = cv2.imread(image_path)
-        barcode_detector = cv2.barcode.BarcodeDetector()
+        return self.classify_batch([image_path])[0]
 
-        # 'retval' is boolean mentioning whether barcode has been detected or not
-        if barcode_detector.detect(img)[0]:
-           return True
-        return False
+    def classify_batch(self, image_paths):
+        return self.classify_batch_checked(image_paths)[0]
+
+    def classify_batch_checked(self, image_paths):
+        detections = self.engine.detect_many(image_paths)
+        return (
+            [detection is not None and detection.barcode for detection in detections],
+            [detection is not None for detection in detections]
+        )
@@ -0,0 +1,136 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import cv2
+
+DEFAULT_MAX_DIMENSION = 1024
+MAX_CACHED_RESULTS = 4096
+
+
+def worker_candidates():
+    """
+    Decode pool sizes worth trying: powers of two up to twice the core count, since part of each
+    image's time is spent waiting on disk.
+    """
+    limit = 2 * (os.cpu_count() or 1)
+    return [2 ** power for power in range(limit.bit_length()) if 2 ** power <= limit]
+
+
+@dataclass
+class CodeDetection:
+    barcode: bool = False
+    qr: bool = False
+
+
+class CodeDetectionEngine:
+    """
+    Detects barcodes and QR codes in one pass per image.
+
+    Each image is decoded once, as grayscale, and downscaled before detection. Detectors are created
+    once per worker thread and reused. OpenCV releases the GIL while decoding and detecting, so a
+    batch of images runs in parallel across a thread pool.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_dimension=DEFAULT_MAX_DIMENSION, workers=None):
+        self.max_dimension = max_dimension
+        self.detect_barcodes = False
+        self.detect_qr = False
+        self._local = threading.local()
+        self.workers = workers or os.cpu_count()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._results = OrderedDict()
+        self._results_lock = threading.Lock()
+
+        # Parallelism comes from the pool; OpenCV's own threads would only oversubscribe the cores
+        cv2.setNumThreads(1)
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns the process-wide engine, so the barcode and QR classifiers share one decode per image.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def enable(self, barcode=False, qr=False):
+        """
+        Turn on a detector. Cached results were computed without it, so they're dropped.
+        """
+        if (barcode and not self.detect_barcodes) or (qr and not self.detect_qr):
+            self.clear_results()
+        self.detect_barcodes = self.detect_barcodes or barcode
+        self.detect_qr = self.detect_qr or qr
+
+    def clear_results(self):
+        with self._results_lock:
+            self._results.clear()
+
+    def set_workers(self, workers):
+        """
+        Resize the decode pool; used when the barcode or QR classifier's decode_workers is tuned.
+        """
+        if workers != self.workers:
+            self._executor.shutdown(wait=True)
+            self.workers = workers
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _detectors(self):
+        local = self._local
+        if not hasattr(local, "barcode"):
+            local.barcode = cv2.barcode.BarcodeDetector()
+            local.qr = cv2.QRCodeDetector()
+        return local.barcode, local.qr
+
+    def _load_image(self, image_path):
+        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            return None
+        height, width = image.shape
+        scale = self.max_dimension / max(height, width)
+        if scale < 1:
+            image = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        return image
+
+    def _detect(self, image_path):
+        image = self._load_image(image_path)
+        if image is None:
+            return None
+
+        barcode_detector, qr_detector = self._detectors()
+        detection = CodeDetection()
+        if self.detect_barcodes:
+            # 'retval' is boolean mentioning whether barcode has been detected or not
+            detection.barcode = bool(barcode_detector.detect(image)[0])
+        if self.detect_qr:
+            detection.qr = bool(qr_detector.detect(image)[0])
+        return detection
+
+    def _remember(self, image_path, detection):
+        with self._results_lock:
+            self._results[image_path] = detection
+            while len(self._results) > MAX_CACHED_RESULTS:
+                self._results.popitem(last=False)
+
+    def detect(self, image_path):
+        return self.detect_many([image_path])[0]
+
+    def detect_many(self, image_paths):
+        """
+        Returns a CodeDetection (or None if the image can't be read) per path, in order.
+        Images detected recently, e.g. by the other code classifier in the same batch, are not decoded again.
+        """
+        with self._results_lock:
+            cached = {path: self._results[path] for path in image_paths if path in self._results}
+        missing = list(dict.fromkeys(path for path in image_paths if path not in cached))
+        for path, detection in zip(missing, self._executor.map(self._detect, missing)):
+            self._remember(path, detection)
+            cached[path] = detection
+        return [cached[path] for path in image_paths]
@@ -0,0 +1,180 @@
+import json
+import os
+
+import timm
+import torch
+from PIL import Image
+from torch import nn
+
+from lib.classify import Classifier, module_footprint, thread_candidates
+from lib.classify.preprocess import BatchPreprocessor, ProcessorConfig
+
+STUDENT_FILENAME = "student.json"
+WEIGHTS_FILENAME = "student.pt"
+DEFAULT_BACKBONE = "mobilenetv3_large_100"
+
+RESAMPLE_FILTERS = {"bilinear": Image.BILINEAR, "bicubic": Image.BICUBIC}
+
+
+def input_config(backbone_name) -> ProcessorConfig:
+    """
+    The preprocessing a timm backbone was pretrained with.
+    """
+    pretrained_cfg = timm.create_model(backbone_name, pretrained=False).pretrained_cfg
+    _, height, width = pretrained_cfg["input_size"]
+    return ProcessorConfig(
+        height=height,
+        width=width,
+        resample=RESAMPLE_FILTERS.get(pretrained_cfg.get("interpolation"), Image.BILINEAR),
+        rescale_factor=1 / 255,
+        mean=tuple(pretrained_cfg["mean"]),
+        std=tuple(pretrained_cfg["std"]),
+    )
+
+
+class StudentModel(nn.Module):
+    """
+    A small timm backbone with one linear head per distilled classifier.
+    A single forward pass returns the logits of every head.
+    """
+
+    def __init__(self, backbone_name, tasks: dict, pretrained=False):
+        """
+        :param tasks: Mapping of classifier name to the outputs its head chooses between, in class order,
+            e.g. {"meme": [false, true], "rotated": [null, 90, 180, 270]}.
+        """
+        super().__init__()
+        self.backbone_name = backbone_name
+        self.tasks = tasks
+        self.backbone = timm.create_model(backbone_name, pretrained=pretrained, num_classes=0)
+        self.heads = nn.ModuleDict({
+            task: nn.Linear(self.backbone.num_features, len(outputs))
+            for task, outputs in tasks.items()
+        })
+
+    @classmethod
+    def from_pretrained(cls, path):
+        with open(os.path.join(path, STUDENT_FILENAME), "r") as f:
+            student = json.load(f)
+        model = cls(student["backbone"], student["tasks"])
+        model.load_state_dict(torch.load(os.path.join(path, WEIGHTS_FILENAME), map_location="cpu"))
+        return model
+
+    def save_pretrained(self, path):
+        os.makedirs(path, exist_ok=True)
+        torch.save(self.state_dict(), os.path.join(path, WEIGHTS_FILENAME))
+        with open(os.path.join(path, STUDENT_FILENAME), "w") as f:
+            json.dump({"backbone": self.backbone_name, "tasks": self.tasks}, f, indent=2)
+
+    def forward(self, pixel_values):
+        features = self.backbone(pixel_values)
+        return {task: head(features) for task, head in self.heads.items()}
+
+
+class DistilledClassifier:
+    """
+    Loads a student trained by lib.train.distill and exposes one Classifier per distilled classifier,
+    under the original classifier's name, so they can replace the originals in PhotoFlagger.
+    The heads share the model, so each batch goes through the backbone only once.
+    """
+
+    def __init__(self, model_path, enabled=True):
+        self.model_path = os.path.expanduser(model_path)
+        self.enabled = enabled
+        self._last_paths = None
+        self._last_outputs = None
+        self._last_loaded = None
+        self.preprocessor = None
+        if enabled:
+            # The student is meant for CPU-only hosts
+            self.model = StudentModel.from_pretrained(self.model_path)
+            self.model.eval()
+            self.preprocessor = BatchPreprocessor.shared(input_config(self.model.backbone_name))
+
+    def classifiers(self):
+        with open(os.path.join(self.model_path, STUDENT_FILENAME), "r") as f:
+            tasks = json.load(f)["tasks"]
+        return [StudentHeadClassifier(self, task, outputs) for task, outputs in tasks.items()]
+
+    def clear_cache(self):
+        self._last_paths = None
+        self._last_outputs = None
+        self._last_loaded = None
+        if self.preprocessor is not None:
+            self.preprocessor.clear()
+
+    def predict(self, image_paths, batch_size=32, workers=1):
+        """
+        Returns ({task: [output per image]}, loaded), where loaded holds a bool per image. Outputs of images
+        that couldn't be loaded are None, which is also a real output of some heads, like rotated; loaded
+        tells them apart. The previous batch is remembered, so every head classifying the same batch shares
+        one forward pass.
+        """
+        key = tuple(image_paths)
+        if key != self._last_paths:
+            pixel_values, loaded = self.preprocessor.preprocess(image_paths, workers)
+            predictions = {task: [] for task in self.model.tasks}
+            with torch.no_grad():
+                for start in range(0, len(pixel_values), batch_size):
+                    logits = self.model(pixel_values[start:start + batch_size])
+                    for task, task_logits in logits.items():
+                        outputs = self.model.tasks[task]
+                        predictions[task].extend(outputs[idx] for idx in task_logits.argmax(dim=-1).tolist())
+
+            self._last_outputs = {}
+            for task, task_predictions in predictions.items():
+                task_predictions = iter(task_predictions)
+                self._last_outputs[task] = [next(task_predictions) if ok else None for ok in loaded]
+            self._last_loaded = list(loaded)
+            self._last_paths = key
+        return self._last_outputs, self._last_loaded
+
+
+class StudentHeadClassifier(Classifier):
+    """
+    One head of a distilled student. It returns the same kind of result as the classifier it was distilled
+    from, with that classifier's confidence threshold already learned into the head.
+    """
+
+    def __init__(self, parent: DistilledClassifier, task, outputs):
+        super().__init__(
+            confidence_threshold=None,
+            name=task,
+            allowed_classes=None,
+            enabled=parent.enabled
+        )
+        self.parent = parent
+        self.outputs = outputs
+        self.batch_size = 32
+
+    def signature(self):
+        # Retraining rewrites the weights, so results from the previous student aren't reused
+        weights_path = os.path.join(self.parent.model_path, WEIGHTS_FILENAME)
+        mtime = os.path.getmtime(weights_path) if os.path.exists(weights_path) else None
+        return f"{super().signature()}:{self.parent.model_path}:{mtime}"
+
+    def memory_footprint(self):
+        # Shared by every head of the student
+        return module_footprint(self.parent.model) if self.enabled else 0
+
+    def tunables(self):
+        return {
+            "batch_size": [8, 16, 32, 64],
+            "threads": thread_candidates(),
+            "decode_workers": [1, 2, 4, 8],
+        }
+
+    def clear_caches(self):
+        self.parent.clear_cache()
+
+    def classify(self, image_path):
+        return self.classify_batch([image_path])[0]
+
+    def classify_batch(self, image_paths):
+        return self.classify_batch_checked(image_paths)[0]
+
+    def classify_batch_checked(self, image_paths):
+        if not self.enabled:
+            raise ValueError("Classifier is not enabled")
+        outputs, loaded = self.parent.predict(image_paths, self.batch_size, self.decode_workers)
+        return outputs[self.name], loaded
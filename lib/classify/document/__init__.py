@@ -1,16 +1,52 @@
 import torch
 from PIL import Image
+from torch import nn
 from transformers import AutoImageProcessor, AutoModelForImageClassification
 
-from lib.classify import Classifier
+from lib.classify import Classifier, module_footprint, thread_candidates
+from lib.classify.preprocess import ProcessorInputs
 
 
 class DocumentClassifier(Classifier):
+    flags_at_threshold = True
+
     def __init__(self, confidence_threshold, enabled):
-        super().__init__(confidence_threshold, name="document", allowed_classes=["handwritten", "presentation"])
-        if enabled:
-            self.processor = AutoImageProcessor.from_pretrained("microsoft/dit-base-finetuned-rvlcdip")
-            self.model = AutoModelForImageClassification.from_pretrained("microsoft/dit-base-finetuned-rvlcdip")
+        super().__init__(
+            confidence_threshold,
+            name="document",
+            allowed_classes=["handwritten", "presentation"],
+            enabled=enabled
+        )
+        self.processor = None
+        self.model = None
+        self.inputs = None
+
+    def _load(self):
+        self.processor = AutoImageProcessor.from_pretrained("microsoft/dit-base-finetuned-rvlcdip")
+        self.model = AutoModelForImageClassification.from_pretrained("microsoft/dit-base-finetuned-rvlcdip")
+        self.inputs = ProcessorInputs(self.processor, self.name)
+
+    def _unload(self):
+        self.processor = None
+        self.model = None
+        self.inputs = None
+
+    def clear_caches(self):
+        if self.inputs is not None:
+            self.inputs.clear()
+
+    def memory_footprint(self):
+        return module_footprint(self.model)
+
+    def quantizable_modules(self):
+        return (nn.Linear,)
+
+    def tunables(self):
+        return {
+            "batch_size": [1, 2, 4, 8, 16],
+            "threads": thread_candidates(),
+            "decode_workers": [1, 2, 4, 8],
+        }
 
     def _load_image(self, image_path):
         return Image.open(image_path).convert('RGB')
@@ -31,6 +67,7 @@ class DocumentClassifier(Classifier):
         return None
 
     def classify(self, image_path):
+        self.load()
         image = self._load_image(image_path)
         inputs = self.processor(images=image, return_tensors="pt")
         outputs = self.model(**inputs)
@@ -40,4 +77,37 @@ class DocumentClassifier(Classifier):
         probabilities = torch.nn.functional.softmax(logits, dim=-1)[0]
         return self._get_predicted_class(probabilities)
 
+    def _score(self, probabilities):
+        # The most confident allowed class is the one a high enough threshold would still return
+        allowed = [
+            probabilities[idx].item() for idx, label in self.model.config.id2label.items()
+            if self.allowed_classes is None or label in self.allowed_classes
+        ]
+        return max(allowed, default=0.0)
+
+    def _probabilities_batch(self, image_paths):
+        """
+        Returns the class probabilities per image, or None for images that couldn't be loaded.
+        """
+        self.load()
+        pixel_values, loaded = self.inputs(image_paths, self._load_image, self.decode_workers)
+        rows = []
+        with torch.no_grad():
+            for start in range(0, len(pixel_values), self.batch_size):
+                logits = self.model(pixel_values=pixel_values[start:start + self.batch_size]).logits
+                rows.extend(torch.nn.functional.softmax(logits, dim=-1))
+        rows = iter(rows)
+        return [next(rows) if ok else None for ok in loaded]
+
+    def classify_batch(self, image_paths):
+        return [
+            self._get_predicted_class(row) if row is not None else None
+            for row in self._probabilities_batch(image_paths)
+        ]
+
+    def classify_batch_checked(self, image_paths):
+        rows = self._probabilities_batch(image_paths)
+        return [self._get_predicted_class(row) if row is not None else None for row in rows], [row is not None for row in rows]
 
+    def score_batch(self, image_paths):
+        return [self._score(row) if row is not None else None for row in self._probabilities_batch(image_paths)]
@@ -11,12 +11,10 @@ class MemeClassifier(PipelineClassifier):
             enabled=enabled
         )
 
-    def _get_predicted_class(self, predictions):
+    def _score(self, predictions):
         # Extract scores for "meme" and "non-meme"
         meme_score = next((pred['score'] for pred in predictions if pred['label'] == "meme"), 0)
         non_meme_score = next((pred['score'] for pred in predictions if pred['label'] == "non-meme"), 0)
 
-        # Check both conditions
-        if meme_score > non_meme_score and meme_score > self.confidence_threshold:
-            return True  # Prediction is "meme"
-        return False  # Otherwise, return "non-meme"
+        # A photo is only a meme if "meme" also beats "non-meme"
+        return meme_score if meme_score > non_meme_score else 0.0
@@ -0,0 +1,151 @@
+import json
+import os
+
+import torch
+from PIL import Image
+from torch import nn
+from transformers import AutoImageProcessor, ViTModel
+
+from lib.classify import Classifier
+
+TASKS_FILENAME = "tasks.json"
+HEADS_FILENAME = "heads.pt"
+
+
+class MultiTaskViT(nn.Module):
+    """
+    A shared ViT backbone with one linear classification head per task.
+    A single forward pass returns the logits of every task.
+    """
+
+    def __init__(self, backbone: ViTModel, tasks: dict):
+        """
+        :param backbone: ViTModel without a pooling layer.
+        :param tasks: Mapping of task name to its label -> id mapping.
+        """
+        super().__init__()
+        self.backbone = backbone
+        self.tasks = tasks
+        self.heads = nn.ModuleDict({
+            task: nn.Linear(backbone.config.hidden_size, len(label_mapping))
+            for task, label_mapping in tasks.items()
+        })
+
+    @classmethod
+    def from_base_model(cls, base_model, tasks):
+        return cls(ViTModel.from_pretrained(base_model, add_pooling_layer=False), tasks)
+
+    @classmethod
+    def from_pretrained(cls, path):
+        with open(os.path.join(path, TASKS_FILENAME), "r") as f:
+            tasks = json.load(f)
+        model = cls(ViTModel.from_pretrained(path, add_pooling_layer=False), tasks)
+        model.heads.load_state_dict(torch.load(os.path.join(path, HEADS_FILENAME), map_location="cpu"))
+        return model
+
+    def save_pretrained(self, path):
+        self.backbone.save_pretrained(path)
+        torch.save(self.heads.state_dict(), os.path.join(path, HEADS_FILENAME))
+        with open(os.path.join(path, TASKS_FILENAME), "w") as f:
+            json.dump(self.tasks, f, indent=2)
+
+    def forward(self, pixel_values):
+        # Same [CLS] representation ViTForImageClassification classifies
+        features = self.backbone(pixel_values=pixel_values).last_hidden_state[:, 0]
+        return {task: head(features) for task, head in self.heads.items()}
+
+
+class MultiTaskClassifier:
+    """
+    Loads a model trained by lib.train.multitask and exposes one Classifier per task.
+    The task classifiers share the model, so each image goes through the backbone only once.
+    """
+
+    def __init__(self, model_path, confidence_threshold, enabled=True):
+        self.model_path = os.path.expanduser(model_path)
+        self.confidence_threshold = confidence_threshold
+        self.enabled = enabled
+        self._last_image_path = None
+        self._last_probabilities = None
+        if enabled:
+            self.device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
+            self.processor = AutoImageProcessor.from_pretrained(self.model_path)
+            self.model = MultiTaskViT.from_pretrained(self.model_path).to(self.device)
+            self.model.eval()
+
+    def task_classifiers(self, positive_labels=None):
+        """
+        :param positive_labels: {task: label} for binary tasks whose flagged label isn't the first in their
+            label_album_mapping.
+        """
+        positive_labels = positive_labels or {}
+        with open(os.path.join(self.model_path, TASKS_FILENAME), "r") as f:
+            tasks = json.load(f)
+        return [
+            TaskHeadClassifier(self, task, label_mapping, positive_labels.get(task))
+            for task, label_mapping in tasks.items()
+        ]
+
+    def clear_cache(self):
+        self._last_image_path = None
+        self._last_probabilities = None
+
+    def probabilities(self, image_path):
+        """
+        Returns the per-task class probabilities for an image, reusing the previous forward pass
+        when the same image is classified by several tasks in a row.
+        """
+        if image_path != self._last_image_path:
+            image = Image.open(image_path).convert('RGB')
+            inputs = self.processor(images=image, return_tensors="pt").to(self.device)
+            with torch.no_grad():
+                logits = self.model(inputs["pixel_values"])
+            self._last_probabilities = {
+                task: torch.nn.functional.softmax(task_logits, dim=-1)[0].cpu()
+                for task, task_logits in logits.items()
+            }
+            self._last_image_path = image_path
+        return self._last_probabilities
+
+
+class TaskHeadClassifier(Classifier):
+    def __init__(self, parent: MultiTaskClassifier, task, label_mapping, positive_label=None):
+        super().__init__(
+            parent.confidence_threshold,
+            name=task,
+            allowed_classes=None,
+            enabled=parent.enabled
+        )
+        self.parent = parent
+        self.label_mapping = label_mapping
+        self.id2label = {idx: label for label, idx in label_mapping.items()}
+        # Binary tasks are trained with the flagged label first, like ["meme", "non-meme"]
+        self.positive_label = positive_label if positive_label is not None else self.id2label[0]
+        if self.positive_label not in label_mapping:
+            raise ValueError(f"Task '{task}' has no label '{self.positive_label}', "
+                             f"expected one of {', '.join(label_mapping)}")
+        # Binary tasks flag above the threshold, the others at it
+        self.flags_at_threshold = len(label_mapping) != 2
+
+    def signature(self):
+        # The heads file changes with every retrain, so results from the previous model aren't reused
+        heads_path = os.path.join(self.parent.model_path, HEADS_FILENAME)
+        mtime = os.path.getmtime(heads_path) if os.path.exists(heads_path) else None
+        return f"{super().signature()}:{self.parent.model_path}:{mtime}:{self.positive_label}"
+
+    def clear_caches(self):
+        self.parent.clear_cache()
+
+    def classify(self, image_path):
+        if not self.enabled:
+            raise ValueError("Classifier is not enabled")
+
+        probabilities = self.parent.probabilities(image_path)[self.name]
+
+        if len(self.id2label) == 2:
+            return probabilities[self.label_mapping[self.positive_label]].item() > self.confidence_threshold
+
+        confidence, idx = torch.max(probabilities, dim=0)
+        if confidence.item() >= self.confidence_threshold:
+            return self.id2label[idx.item()]
+        return None
@@ -0,0 +1,219 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+logger = logging.getLogger("preprocess")
+
+# Largest difference from a model's own processor, in normalized units, for the shared path to be used.
+# One uint8 level is 1/255/std, about 0.008 with the usual std of 0.5.
+DEFAULT_TOLERANCE = 0.02
+# Images of the first batch the shared path is checked against each model's own processor on
+VERIFY_IMAGES = 3
+
+
+def decode_images(load_image, image_paths, workers):
+    """
+    Decodes images on a thread pool (PIL releases the GIL while decoding). Returns them in order.
+    """
+    if workers <= 1 or len(image_paths) <= 1:
+        return [load_image(image_path) for image_path in image_paths]
+    with ThreadPoolExecutor(max_workers=min(workers, len(image_paths))) as executor:
+        return list(executor.map(load_image, image_paths))
+
+
+@dataclass(frozen=True)
+class ProcessorConfig:
+    """
+    The parts of a Hugging Face image processor's configuration that determine its output.
+    Processors with equal configs produce the same pixel values, so their models can share them.
+    """
+    height: int
+    width: int
+    resample: int
+    rescale_factor: float
+    mean: Tuple[float, float, float]
+    std: Tuple[float, float, float]
+
+    @classmethod
+    def from_processor(cls, processor) -> Optional["ProcessorConfig"]:
+        """
+        Returns None for processors the BatchPreprocessor can't reproduce, like ones that center crop
+        or resize by the shortest edge.
+        """
+        size = getattr(processor, "size", None) or {}
+        if not getattr(processor, "do_resize", False) or "height" not in size or "width" not in size:
+            return None
+        if getattr(processor, "do_center_crop", False) or not getattr(processor, "do_rescale", False):
+            return None
+        if getattr(processor, "do_normalize", False):
+            mean, std = tuple(processor.image_mean), tuple(processor.image_std)
+        else:
+            mean, std = (0.0, 0.0, 0.0), (1.0, 1.0, 1.0)
+        return cls(size["height"], size["width"], int(processor.resample), float(processor.rescale_factor), mean, std)
+
+
+class BatchPreprocessor:
+    """
+    Resizes and normalizes a batch of images for every model whose processor has the same configuration.
+
+    Images are resized straight into a reusable uint8 buffer, then the whole batch is rescaled and
+    normalized at once into a new float tensor. Models called one after another on the same batch, as
+    PhotoFlagger does, get the same tensor without decoding the images again.
+
+    Decoding happens outside the lock, in a buffer the call has to itself, so a call stuck on a malformed
+    file, and abandoned by the watchdog, doesn't hold up the other models sharing this preprocessor, and
+    never sees its buffer reused by them.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, config: ProcessorConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        self._spare_pixels = None  # uint8 buffer not in use by any call
+        self._scale = config.rescale_factor
+        self._mean = torch.tensor(config.mean).view(1, 3, 1, 1)
+        self._std = torch.tensor(config.std).view(1, 3, 1, 1)
+        self._last_paths = None
+        self._last_result = None
+
+    @classmethod
+    def shared(cls, config: ProcessorConfig):
+        with cls._shared_lock:
+            if config not in cls._shared:
+                cls._shared[config] = cls(config)
+            return cls._shared[config]
+
+    def clear(self):
+        with self._lock:
+            self._last_paths = None
+            self._last_result = None
+
+    def _take_pixels(self, num_images):
+        with self._lock:
+            pixels, self._spare_pixels = self._spare_pixels, None
+        if pixels is None or len(pixels) < num_images:
+            capacity = max(num_images, 2 * len(pixels)) if pixels is not None else num_images
+            pixels = np.empty((capacity, self.config.height, self.config.width, 3), dtype=np.uint8)
+        return pixels
+
+    def _return_pixels(self, pixels):
+        with self._lock:
+            if self._spare_pixels is None or len(pixels) > len(self._spare_pixels):
+                self._spare_pixels = pixels
+
+    def _decode_into(self, pixels, idx, image_path):
+        try:
+            with Image.open(image_path) as image:
+                image = image.convert("RGB").resize((self.config.width, self.config.height), self.config.resample)
+                pixels[idx] = np.asarray(image)
+            return True
+        except Exception as e:
+            print(f"Error loading image {image_path}: {e}")
+            return False
+
+    def preprocess(self, image_paths, workers=1):
+        """
+        :return: (pixel_values, loaded), where pixel_values is a (number loaded, 3, height, width) tensor
+            for the images that could be decoded, in order, and loaded holds a bool per path. The tensor
+            isn't reused by later calls; callers classifying the same batch share it, so it mustn't be
+            modified in place.
+        """
+        key = tuple(image_paths)
+        with self._lock:
+            if key == self._last_paths:
+                return self._last_result
+
+        pixels = self._take_pixels(len(image_paths))
+        loaded = decode_images(
+            lambda item: self._decode_into(pixels, *item), list(enumerate(image_paths)), workers
+        )
+        indices = [idx for idx, ok in enumerate(loaded) if ok]
+        if len(indices) < len(image_paths):
+            # Move the decoded images to the front, so the tensor covers only those
+            pixels[:len(indices)] = pixels[indices]
+
+        pixel_values = torch.from_numpy(pixels[:len(indices)]).permute(0, 3, 1, 2).float()
+        pixel_values.mul_(self._scale).sub_(self._mean).div_(self._std)
+        self._return_pixels(pixels)
+
+        result = (pixel_values, loaded)
+        with self._lock:
+            self._last_paths = key
+            self._last_result = result
+        return result
+
+    def matches(self, processor, image_path, tolerance=DEFAULT_TOLERANCE):
+        """
+        Whether this preprocessor reproduces the processor's output for an image, within tolerance.
+        :raises Exception: If the image can't be decoded, so it can't tell.
+        """
+        with Image.open(image_path) as image:
+            expected = processor(images=image.convert("RGB"), return_tensors="pt")["pixel_values"][0]
+        pixel_values, loaded = self.preprocess([image_path])
+        if not loaded[0]:
+            raise ValueError(f"Couldn't decode {image_path}")
+        difference = (pixel_values[0] - expected).abs().max().item()
+        logger.debug(f"Shared preprocessing differs from {type(processor).__name__} by at most {difference:.4f}")
+        return difference <= tolerance
+
+
+class ProcessorInputs:
+    """
+    Turns image paths into pixel_values for a model: through the shared BatchPreprocessor for its
+    processor's configuration, or through the processor itself when the configuration isn't supported.
+
+    The shared path is checked against the processor on the first few images it sees, and abandoned for
+    this model if they differ by more than the tolerance on any of them.
+    """
+
+    def __init__(self, processor, name):
+        self.processor = processor
+        self.name = name
+        config = ProcessorConfig.from_processor(processor)
+        self.preprocessor = BatchPreprocessor.shared(config) if config is not None else None
+        self._verified = self.preprocessor is None
+
+    def clear(self):
+        if self.preprocessor is not None:
+            self.preprocessor.clear()
+
+    def _verify(self, image_paths):
+        checked = 0
+        for image_path in image_paths[:VERIFY_IMAGES]:
+            try:
+                matches = self.preprocessor.matches(self.processor, image_path)
+            except Exception as e:
+                # Unreadable images can't tell either way; the next batch is checked instead
+                logger.debug(f"{self.name}: couldn't check shared preprocessing on {image_path}: {e}")
+                continue
+            if not matches:
+                logger.warning(f"{self.name}: shared preprocessing doesn't match the model's processor; not using it")
+                self.preprocessor = None
+                break
+            checked += 1
+        self._verified = self.preprocessor is None or checked > 0
+
+    def __call__(self, image_paths, load_image, workers=1):
+        """
+        :param load_image: Loads a PIL image for the fallback path; returns None if it can't.
+        :return: (pixel_values, loaded), as BatchPreprocessor.preprocess.
+        """
+        if not self._verified:
+            self._verify(image_paths)
+        if self.preprocessor is not None:
+            return self.preprocessor.preprocess(image_paths, workers)
+
+        images = decode_images(load_image, image_paths, workers)
+        loaded = [image is not None for image in images]
+        images = [image for image in images if image is not None]
+        if not images:
+            return torch.empty((0,)), loaded
+        return self.processor(images=images, return_tensors="pt")["pixel_values"], loaded
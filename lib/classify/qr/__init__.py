@@ -1,30 +1,90 @@
+import threading
 from typing import List
 
-import Quartz
-import objc
-from Cocoa import NSURL
-from Foundation import NSDictionary
-
 from lib.classify import Classifier
+from lib.classify.codes import CodeDetectionEngine, worker_candidates
+
+QR_BACKENDS = ("cv2", "coreimage")
 
 
 class QRClassifier(Classifier):
-    def __init__(self, confidence_threshold, enabled=True):
+    """
+    Flags images containing QR codes.
+
+    The default "cv2" backend is portable and shares one decode per image with the barcode classifier.
+    The "coreimage" backend uses macOS's CIDetector, which is slower but more accurate on small codes.
+    """
+
+    time_limit = 20
+
+    def __init__(self, confidence_threshold, enabled=True, backend="cv2", engine: CodeDetectionEngine = None):
         super().__init__(confidence_threshold, name="qr", allowed_classes=None, enabled=enabled)
+        if backend not in QR_BACKENDS:
+            raise ValueError(f"Unknown QR backend '{backend}', expected one of {', '.join(QR_BACKENDS)}")
+        self.backend = backend
+        self.engine = engine or CodeDetectionEngine.shared()
+        self.decode_workers = self.engine.workers
+        self._local = threading.local()
+        if enabled and backend == "cv2":
+            self.engine.enable(qr=True)
+
+    def signature(self):
+        return f"{super().signature()}:{self.backend}"
+
+    def tunables(self):
+        return {"decode_workers": worker_candidates()} if self.backend == "cv2" else {}
+
+    def apply_settings(self, settings):
+        super().apply_settings(settings)
+        if self.backend == "cv2":
+            self.engine.set_workers(self.decode_workers)
+
+    def tuning_group(self):
+        return self.engine if self.backend == "cv2" else None
+
+    def clear_caches(self):
+        self.engine.clear_results()
 
     def classify(self, image_path):
-        return self._find_all_qrcodes(image_path) != []
+        return self.classify_batch([image_path])[0]
+
+    def classify_batch(self, image_paths):
+        return self.classify_batch_checked(image_paths)[0]
+
+    def classify_batch_checked(self, image_paths):
+        if self.backend == "coreimage":
+            return [self._find_all_qrcodes(image_path) != [] for image_path in image_paths], [True] * len(image_paths)
+        detections = self.engine.detect_many(image_paths)
+        return (
+            [detection is not None and detection.qr for detection in detections],
+            [detection is not None for detection in detections]
+        )
+
+    def _coreimage_detector(self):
+        """
+        Returns this thread's CIDetector, creating it (and its CIContext) on first use.
+        """
+        if not hasattr(self._local, "detector"):
+            import Quartz
+            from Foundation import NSDictionary
 
-    def _find_all_qrcodes(self, image_path: str) -> List[str]:
-        """Detect QR Codes in images using CIDetector and return text of the found QR Codes"""
-        with objc.autorelease_pool():
             context = Quartz.CIContext.contextWithOptions_(None)
             options = NSDictionary.dictionaryWithDictionary_(
                 {"CIDetectorAccuracy": Quartz.CIDetectorAccuracyHigh}
             )
-            detector = Quartz.CIDetector.detectorOfType_context_options_(
+            self._local.detector = Quartz.CIDetector.detectorOfType_context_options_(
                 Quartz.CIDetectorTypeQRCode, context, options
             )
+        return self._local.detector
+
+    def _find_all_qrcodes(self, image_path: str) -> List[str]:
+        """Detect QR Codes in images using CIDetector and return text of the found QR Codes"""
+        import Quartz
+        import objc
+        from Cocoa import NSURL
+
+        with objc.autorelease_pool():
+            detector = self._coreimage_detector()
 
             results = []
             input_url = NSURL.fileURLWithPath_(image_path)
@@ -0,0 +1,235 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import time
+
+import torch
+from osxphotos.cli.common import get_data_dir
+from torch import nn
+from torch.ao.quantization import QuantWrapper, convert, get_default_qconfig, prepare, quantize_dynamic
+
+logger = logging.getLogger("quantize")
+
+QUANTIZATION_MODES = ("dynamic", "static")
+# Fraction of sample photos, and of the ones the fp32 model flags, on which a variant has to give the same result
+DEFAULT_MIN_AGREEMENT = 0.99
+# Photos the fp32 model has to flag in the check sample for agreement on flagged photos to mean anything
+MIN_FLAGGED_PHOTOS = 5
+WEIGHTS_FILENAME = "model.pt"
+REPORT_FILENAME = "report.json"
+
+
+def quantization_engine():
+    """
+    fbgemm on x86; qnnpack on ARM, e.g. Apple silicon.
+    """
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    raise RuntimeError("This build of torch has no quantized CPU engine")
+
+
+def _wrap_modules(module, module_types, qconfig):
+    """
+    Wraps each module of the given types in a QuantWrapper: its input is quantized with a scale observed
+    during calibration, and its output is dequantized, so the modules in between stay in fp32.
+    """
+    for name, child in module.named_children():
+        if type(child) in module_types:
+            wrapper = QuantWrapper(child)
+            wrapper.qconfig = qconfig
+            setattr(module, name, wrapper)
+        else:
+            _wrap_modules(child, module_types, qconfig)
+
+
+def quantize_model(model, mode, module_types, calibrate=None):
+    """
+    Quantizes a fp32 model to int8 in place, and returns it.
+
+    :param mode: "dynamic" quantizes weights ahead of time and activations on the fly; only Linear layers are
+        supported. "static" also quantizes activations, with scales observed while calibrate(model) runs.
+    :param module_types: Layer types to quantize, e.g. (nn.Linear,) or (nn.Linear, nn.Conv2d).
+    :param calibrate: Runs the prepared model over representative inputs; static mode only. Without it the
+        scales are placeholders, which is only useful for loading saved weights into the structure.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}', expected one of {', '.join(QUANTIZATION_MODES)}")
+    torch.backends.quantized.engine = quantization_engine()
+    model = model.cpu().float().eval()
+
+    if mode == "dynamic":
+        return quantize_dynamic(model, {module_type for module_type in module_types if module_type is nn.Linear},
+                                dtype=torch.qint8, inplace=True)
+
+    _wrap_modules(model, tuple(module_types), get_default_qconfig(torch.backends.quantized.engine))
+    prepare(model, inplace=True)
+    if calibrate is not None:
+        with torch.no_grad():
+            calibrate(model)
+    return convert(model, inplace=True)
+
+
+class VariantStore:
+    """
+    Quantized variants on disk, with the agreement report each was accepted or rejected with. A variant is
+    keyed by its classifier's signature, so it's rebuilt when the model or confidence threshold changes.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+
+    @classmethod
+    def default(cls):
+        return cls(os.path.join(get_data_dir(), "quantized"))
+
+    def _dir(self, classifier, mode):
+        key = f"{classifier.signature()}:{mode}:{torch.__version__}:{quantization_engine()}"
+        return os.path.join(self.path, f"{classifier.name}-{mode}-{hashlib.sha1(key.encode()).hexdigest()[:12]}")
+
+    def report(self, classifier, mode):
+        path = os.path.join(self._dir(classifier, mode), REPORT_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def state_dict(self, classifier, mode):
+        return torch.load(os.path.join(self._dir(classifier, mode), WEIGHTS_FILENAME), map_location="cpu")
+
+    def save(self, classifier, mode, model, report):
+        directory = self._dir(classifier, mode)
+        os.makedirs(directory, exist_ok=True)
+        torch.save(model.state_dict(), os.path.join(directory, WEIGHTS_FILENAME))
+        # The report is written last; a variant without one is never loaded
+        tmp_path = os.path.join(directory, f"{REPORT_FILENAME}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, os.path.join(directory, REPORT_FILENAME))
+
+
+def rejection_reason(report, min_agreement):
+    """
+    Why a variant can't be used, or None if it can. Agreement over all sample photos isn't enough on its
+    own: most photos aren't flagged, so a variant that never flags anything would pass. The variant also
+    has to agree on the photos the fp32 model flags. A min_agreement of 0 accepts any built variant.
+    """
+    if min_agreement <= 0:
+        return None
+    if "flagged_agreement" not in report:
+        return "it was built before flagged photos were checked; rebuild it with bin/quantize.py"
+    if report["flagged_photos"] < MIN_FLAGGED_PHOTOS:
+        return (f"the fp32 model flagged only {report['flagged_photos']} of the check photos, too few to compare on; "
+                f"raise check_samples")
+    if report["agreement"] < min_agreement:
+        return f"it agreed with fp32 on only {report['agreement'] * 100:.1f}% of sample photos"
+    if report["flagged_agreement"] < min_agreement:
+        return (f"it agreed with fp32 on only {report['flagged_agreement'] * 100:.1f}% of the photos fp32 flags "
+                f"({report['lost']} no longer flagged, {report['changed']} flagged differently)")
+    return None
+
+
+def load_variant(classifier, store=None):
+    """
+    Replaces a loaded classifier's fp32 model with its cached variant for classifier.quantization, if one
+    was built and agreed with the fp32 model on at least classifier.min_agreement of the sample photos,
+    and of the sample photos the fp32 model flags.
+    :return: True if the variant is in use.
+    """
+    store = store or VariantStore.default()
+    mode = classifier.quantization
+    report = store.report(classifier, mode)
+    if report is None:
+        logger.warning(f"No {mode} int8 variant of {classifier.name} built yet; using fp32. Run bin/quantize.py")
+        return False
+    reason = rejection_reason(report, classifier.min_agreement)
+    if reason is not None:
+        logger.warning(f"Not using the {mode} int8 variant of {classifier.name}: {reason}. Using fp32")
+        return False
+
+    model = quantize_model(classifier.model, mode, classifier.quantizable_modules())
+    model.load_state_dict(store.state_dict(classifier, mode))
+    classifier.model = model
+    logger.debug(f"Using the {mode} int8 variant of {classifier.name}")
+    return True
+
+
+def apply_quantization(classifiers, config):
+    """
+    Selects the int8 variant each classifier uses, from a lib.config QuantizationConfig. The variants
+    themselves are built by bin/quantize.py, and swapped in when the classifiers load.
+    """
+    for classifier in classifiers:
+        mode = config.classifiers.get(classifier.name)
+        if mode is None:
+            continue
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode '{mode}' for {classifier.name}, "
+                             f"expected one of {', '.join(QUANTIZATION_MODES)}")
+        if not classifier.quantizable_modules():
+            logger.warning(f"{classifier.name} has no torch model to quantize; ignoring its quantization setting")
+            continue
+        classifier.quantization = mode
+        classifier.min_agreement = config.min_agreement
+
+
+def _timed_results(classifier, image_paths):
+    classifier.clear_caches()
+    start = time.perf_counter()
+    results = classifier.classify_batch(image_paths)
+    return results, time.perf_counter() - start
+
+
+def build_variant(classifier, mode, calibration_paths, check_paths, store=None):
+    """
+    Quantizes a classifier's model, checks how often it gives the same result as the fp32 model on
+    check_paths, overall and on the photos the fp32 model flags, and counts the photos it flags that the
+    fp32 model doesn't and the other way around. The variant is cached with that report. Static mode
+    calibrates on calibration_paths.
+    The classifier is left unloaded.
+    :return: The report.
+    """
+    store = store or VariantStore.default()
+    # Classifiers run their model on the CPU in fp32 when it's going to be quantized
+    classifier.quantization = mode
+    classifier.unload()
+    # The fp32 reference, without any previously cached variant
+    classifier.load(quantized=False)
+    fp32_results, fp32_seconds = _timed_results(classifier, check_paths)
+    fp32_bytes = classifier.memory_footprint()
+
+    def calibrate(prepared):
+        classifier.model = prepared
+        classifier.clear_caches()
+        classifier.classify_batch(calibration_paths)
+
+    classifier.model = quantize_model(classifier.model, mode, classifier.quantizable_modules(), calibrate)
+    int8_results, int8_seconds = _timed_results(classifier, check_paths)
+
+    pairs = list(zip(fp32_results, int8_results))
+    flagged = [(fp32, int8) for fp32, int8 in pairs if fp32]
+    report = {
+        "classifier": classifier.signature(),
+        "mode": mode,
+        "engine": torch.backends.quantized.engine,
+        "agreement": sum(fp32 == int8 for fp32, int8 in pairs) / len(check_paths),
+        # None when the fp32 model flagged none of the check photos
+        "flagged_agreement": sum(fp32 == int8 for fp32, int8 in flagged) / len(flagged) if flagged else None,
+        "flagged_photos": len(flagged),
+        "gained": sum(1 for fp32, int8 in pairs if int8 and not fp32),  # Flagged only by the variant
+        "lost": sum(1 for fp32, int8 in flagged if not int8),  # Flagged only by fp32
+        "changed": sum(1 for fp32, int8 in flagged if int8 and int8 != fp32),  # Flagged differently, e.g. another angle
+        "check_photos": len(check_paths),
+        "calibration_photos": len(calibration_paths) if mode == "static" else 0,
+        "fp32_seconds": fp32_seconds,
+        "int8_seconds": int8_seconds,
+        "fp32_bytes": fp32_bytes,
+        "int8_bytes": classifier.memory_footprint(),
+        "built_at": datetime.datetime.now().isoformat(),
+    }
+    store.save(classifier, mode, classifier.model, report)
+    classifier.unload()
+    return report
@@ -0,0 +1,70 @@
+import logging
+from collections import OrderedDict
+
+from lib.classify import Classifier
+
+logger = logging.getLogger("photoflagger")
+
+
+class ResidencyManager:
+    """
+    Keeps classifier models resident within a memory budget.
+
+    Models are loaded on demand and the least recently used ones are unloaded when loading another
+    would go over budget. A model bigger than the whole budget is still loaded, on its own.
+    """
+
+    def __init__(self, memory_budget: int):
+        """
+        :param memory_budget: Bytes of model weights allowed to be resident at once.
+        """
+        self.memory_budget = memory_budget
+        self._resident = OrderedDict()
+        # Footprints measured on previous loads, so a model's room can be made before loading it again
+        self._footprints = {}
+
+    @property
+    def resident_bytes(self):
+        return sum(self._footprints.get(name, 0) for name in self._resident)
+
+    def is_resident(self, classifier: Classifier):
+        return classifier.name in self._resident
+
+    def resident_order(self):
+        """
+        Names of resident classifiers, most recently used first.
+        """
+        return list(reversed(self._resident))
+
+    def acquire(self, classifier: Classifier):
+        """
+        Make sure a classifier's model is loaded, evicting others as needed.
+        """
+        if classifier.name in self._resident:
+            self._resident.move_to_end(classifier.name)
+            return
+
+        self._evict(self._footprints.get(classifier.name, 0))
+        classifier.load()
+        self._footprints[classifier.name] = classifier.memory_footprint()
+        self._resident[classifier.name] = classifier
+        logger.debug(
+            f"Loaded {classifier.name} ({self._footprints[classifier.name] / 2 ** 20:.0f} MiB); "
+            f"{self.resident_bytes / 2 ** 20:.0f} MiB resident"
+        )
+        # The first load of a model only reveals its size afterwards
+        self._evict(0, keep=classifier.name)
+
+    def _evict(self, incoming_bytes, keep=None):
+        while self._resident and self.resident_bytes + incoming_bytes > self.memory_budget:
+            name = next(iter(self._resident))
+            if name == keep:
+                break
+            victim = self._resident.pop(name)
+            victim.unload()
+            logger.debug(f"Evicted {name} to stay within the memory budget")
+
+    def release_all(self):
+        for classifier in self._resident.values():
+            classifier.unload()
+        self._resident.clear()
@@ -1,6 +1,6 @@
 import logging
 
-from lib.classify import Classifier
+from lib.classify import Classifier, module_footprint, thread_candidates, decode_images
 
 # Set the logging level for timm to WARNING or ERROR
 logging.getLogger("timm").setLevel(logging.WARNING)
@@ -22,7 +22,11 @@ from iglovikov_helper_functions.dl.pytorch.utils import tensor_from_rgb_image
 from iglovikov_helper_functions.utils.image_utils import load_rgb
 from torch import nn
 
+from lib.publish.huggingface import download_state_dict
+
 class RotatedClassifier(Classifier):
+    flags_at_threshold = True
+
     def __init__(
         self,
         confidence_threshold,
@@ -34,30 +38,55 @@ class RotatedClassifier(Classifier):
             allowed_classes=None,
             enabled=enabled
         )
+        self.fp16 = True
+        self.device = None
+        self.transform = None
+        self.model = None
+
+    def _unload(self):
+        self.transform = None
+        self.model = None
+
+    def memory_footprint(self):
+        return module_footprint(self.model)
+
+    def quantizable_modules(self):
+        # Static variants quantize the convolutions too; dynamic ones only the classifier head
+        return (nn.Linear, nn.Conv2d)
 
-        if not enabled:
-            pass
+    def tunables(self):
+        return {
+            "batch_size": [1, 2, 4, 8, 16, 32],
+            "threads": thread_candidates(),
+            "decode_workers": [1, 2, 4, 8],
+        }
 
+    def _load(self):
         repo_id = "davidmerrick/detect_rotated"  # Your Hugging Face repository ID
         config_path = hf_hub_download(repo_id=repo_id, filename="config.yaml")
-        weight_path = hf_hub_download(repo_id=repo_id, filename="model.pth")
 
-        self.fp16 = True
         with open(config_path) as f:
             hparams = yaml.safe_load(f)
 
+        # int8 variants are quantized from fp32 weights and run on the CPU
+        if self.quantization is not None:
+            self.fp16 = False
+
         hparams.update({"fp16": self.fp16})
 
         # Select device: MPS or CPU
-        self.device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
+        if self.quantization is not None:
+            self.device = torch.device("cpu")
+        else:
+            self.device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
 
         # Initialize and load the model
         model = object_from_dict(hparams["model"])
 
-        # Load the state dictionary
-        state_dict = torch.load(weight_path, map_location="cpu")
+        # Load the state dictionary, as published by bin/push_model_to_huggingface.py
+        state_dict = download_state_dict(repo_id)
 
-        # Extract "state_dict" if it's nested
+        # Extract "state_dict" if it's nested, as in checkpoints published before safetensors
         if "state_dict" in state_dict:
             state_dict = state_dict["state_dict"]
 
@@ -76,6 +105,8 @@ class RotatedClassifier(Classifier):
         self.model = model
 
     def classify(self, image_path):
+        self.load()
+
         # Load and preprocess the single image
         image_path = image_path
 
@@ -94,6 +125,62 @@ class RotatedClassifier(Classifier):
             # Return the angle with the highest confidence
             return self._get_highest_confidence_angle(prediction)
 
+    def _prepare(self, image_path):
+        try:
+            return tensor_from_rgb_image(self.transform(image=load_rgb(image_path))["image"])
+        except Exception as e:
+            logging.debug(f"Error loading image {image_path}: {e}")
+            return None
+
+    def classify_batch(self, image_paths):
+        # None means "not rotated" here, so an unreadable image raises instead, and is retried on its own
+        results, readable = self.classify_batch_checked(image_paths)
+        unreadable = [image_path for image_path, ok in zip(image_paths, readable) if not ok]
+        if unreadable:
+            raise ValueError(f"Couldn't read {', '.join(unreadable)}")
+        return results
+
+    def classify_batch_checked(self, image_paths):
+        predictions = self._predictions_batch(image_paths)
+        return (
+            [self._get_highest_confidence_angle(row) if row is not None else None for row in predictions],
+            [row is not None for row in predictions]
+        )
+
+    def score_batch(self, image_paths):
+        # Flagged when the most confident angle isn't 0º and clears the threshold
+        return [
+            None if prediction is None else float(np.max(prediction)) if np.argmax(prediction) != 0 else 0.0
+            for prediction in self._predictions_batch(image_paths)
+        ]
+
+    def _predictions_batch(self, image_paths):
+        """
+        Returns the confidences for [0º, 90º, 180º, 270º] per image, or None for images that couldn't be read.
+        """
+        self.load()
+        tensors = decode_images(self._prepare, image_paths, self.decode_workers)
+
+        # The test transform may keep aspect ratios, so only images of the same shape are stacked together
+        by_shape = {}
+        for idx, tensor in enumerate(tensors):
+            if tensor is not None:
+                by_shape.setdefault(tuple(tensor.shape), []).append(idx)
+
+        results = [None] * len(image_paths)
+        self.model.eval()
+        with torch.no_grad():
+            for indices in by_shape.values():
+                for start in range(0, len(indices), self.batch_size):
+                    batch_indices = indices[start:start + self.batch_size]
+                    batch = torch.stack([tensors[idx] for idx in batch_indices]).to(self.device)
+                    if self.fp16:
+                        batch = batch.half()
+                    predictions = self.model(batch).cpu().numpy()
+                    for idx, prediction in zip(batch_indices, predictions):
+                        results[idx] = prediction
+        return results
+
     def _get_highest_confidence_angle(self, prediction):
         """
         Given a numpy array of confidence values for rotation angles [0º, 90º, 180º, 270º],
@@ -1,4 +1,7 @@
 import click
+from pytimeparse2 import parse as parse_duration
+
+from lib.schedule import PRIORITIES
 
 DEFAULT_CONFIG_PATH = "~/.config/harmonia/config.yml"
 DEFAULT_LIBRARY_PATH = "/Volumes/T9/Pictures/Photos Library.photoslibrary"
@@ -66,6 +69,74 @@ def confidence(func):
         help="Confidence threshold for models.",
     )(func)
 
+def _parse_size(ctx, param, value):
+    """
+    Parses sizes like "4G", "512M" or a plain number of bytes.
+    """
+    if value is None:
+        return None
+    units = {"K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30}
+    value = value.strip().upper().removesuffix("B")
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise click.BadParameter(f"Expected a size like 4G or 512M, got '{value}'")
+
+def memory_budget(func):
+    return click.option(
+        "--memory-budget",
+        "-M",
+        "memory_budget",
+        default=None,
+        callback=_parse_size,
+        help="Maximum memory for resident models, e.g. 4G. Models are loaded on demand and evicted when over budget.",
+    )(func)
+
+def _parse_time_budget(ctx, param, value):
+    if value is None:
+        return None
+    seconds = parse_duration(value)
+    if seconds is None:
+        raise click.BadParameter(f"Expected a duration like 90m or 2h30m, got '{value}'")
+    return seconds
+
+def time_budget(func):
+    return click.option(
+        "--time-budget",
+        "-T",
+        "time_budget",
+        default=None,
+        callback=_parse_time_budget,
+        help="Stop cleanly after this long, e.g. 2h30m. The next run continues where this one stopped.",
+    )(func)
+
+def movies(func):
+    return click.option(
+        "--movies",
+        is_flag=True,
+        help="Also classify videos, from a few frames sampled from each.",
+    )(func)
+
+def time_limit(func):
+    return click.option(
+        "--time-limit",
+        "time_limit",
+        type=float,
+        default=None,
+        help="Seconds each classifier may spend on one photo before it's abandoned and the photo quarantined.",
+    )(func)
+
+def priority(func):
+    return click.option(
+        "--priority",
+        "-P",
+        type=click.Choice(PRIORITIES),
+        default="library",
+        help="Order to process photos in. 'albums' processes the config's priority_albums first.",
+    )(func)
+
 def config_path(func):
     return click.option(
         "--config_path",
@@ -85,3 +156,37 @@ def common_options(func):
     selected(func)
     confidence(func)
     return func
+
+def work_queue(func):
+    return click.option(
+        "--work-queue",
+        "work_queue",
+        default=None,
+        help="SQLite file of a work queue shared by several workers, e.g. on a network volume. "
+             "Workers lease chunks of photos from it, so none is processed twice.",
+    )(func)
+
+def worker_id(func):
+    return click.option(
+        "--worker-id",
+        default=None,
+        help="Name this worker holds work queue leases under. Defaults to hostname:pid.",
+    )(func)
+
+def staging_size(func):
+    return click.option(
+        "--staging-size",
+        "staging_size",
+        default=None,
+        callback=_parse_size,
+        help="Copy previews ahead of classification into a local staging cache of this size, e.g. 2G. "
+             "Speeds up libraries on slow external drives.",
+    )(func)
+
+def staging_dir(func):
+    return click.option(
+        "--staging-dir",
+        "staging_dir",
+        default=None,
+        help="Where to keep the staging cache, e.g. a RAM disk. Defaults to the system temp directory.",
+    )(func)
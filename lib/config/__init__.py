@@ -1,6 +1,6 @@
 import os
 from dataclasses import dataclass, field
-from typing import List
+from typing import Dict, List, Optional
 
 import yaml
 
@@ -21,6 +21,56 @@ class ModelConfig:
     epochs: int = 5
     base_model: str = "google/vit-base-patch16-224"
     label_album_mapping: List[tuple] = field(default_factory=list)
+    cache_dir: Optional[str] = None  # Defaults to the osxphotos data dir
+    num_workers: int = 0  # DataLoader worker processes; 0 loads in the main process
+    pin_memory: bool = False
+    mode: str = "finetune"  # "finetune", or "linear_probe" to train only a logistic head on frozen features
+    compare_model: Optional[str] = None  # Fine-tuned model to compare a linear probe's accuracy against
+    checkpoint_every: int = 1  # Epochs between resumable checkpoints; 0 disables them
+    resume: bool = True  # Resume an interrupted run from its last checkpoint
+    early_stopping_patience: Optional[int] = None  # Stop after this many epochs without a better validation accuracy
+    mixed_precision: bool = True  # bf16 autocast on CPUs that support it
+    incremental: bool = False  # Warm-start from output_path and train only on photos it hasn't seen
+    replay_ratio: float = 1.0  # Previously seen photos replayed per new photo in an incremental run
+    incremental_tolerance: float = 0.02  # Validation accuracy drop that triggers a full retrain
+    processes: int = 1  # Data-parallel training processes on this host; each uses its share of the cores
+
+
+@dataclass
+class QuantizationConfig:
+    classifiers: Dict[str, str] = field(default_factory=dict)  # Classifier name -> "dynamic" or "static"
+    min_agreement: float = 0.99  # Fraction of sample photos, and of those fp32 flags, a variant must classify like fp32
+    calibration_samples: int = 64  # Previews static variants are calibrated on
+    check_samples: int = 1000  # Previews variants are checked on; enough for the fp32 model to flag several
+
+
+@dataclass
+class GovernorConfig:
+    max_share: float = 1.0  # Fraction of the machine's cores a run may use
+    min_free_memory: float = 0.1  # Pause while less than this fraction of memory is available
+    quiet_hours: List[str] = field(default_factory=list)  # "HH:MM-HH:MM" windows when quiet_share applies
+    quiet_share: float = 0.0  # Fraction of the cores a run may use during quiet hours; 0 pauses it
+    min_cores: float = 1.0  # Pause while fewer cores than this are left after other processes' load
+    check_interval: float = 10.0  # Seconds between load checks
+
+
+@dataclass
+class EvaluationVariant:
+    name: str
+    classifier: Optional[str] = None  # Built-in classifier, like "meme"; with student, the head to use
+    model: Optional[str] = None  # Image-classification model path or Hugging Face id, scored on the positive label
+    student: Optional[str] = None  # Distilled student from bin/distill.py
+    quantization: Optional[str] = None  # "dynamic" or "static" int8 variant, built by bin/quantize.py
+    confidence_threshold: float = 0.8
+    settings: Dict[str, int] = field(default_factory=dict)  # batch_size, threads and decode_workers overrides
+
+
+@dataclass
+class EvaluationConfig:
+    name: str
+    # Like ModelConfig's; the first label is the one the classifiers should flag, the rest shouldn't be
+    label_album_mapping: List[tuple] = field(default_factory=list)
+    variants: List[EvaluationVariant] = field(default_factory=list)
 
 
 def _get_config(config_path: str):
@@ -47,3 +97,46 @@ def parse_managed_albums(config_path: str) -> List[ManagedAlbum]:
 def parse_training_config(config_path: str) -> List[ModelConfig]:
     training_data = _get_config(config_path).get('training', [])
     return [ModelConfig(**config) for config in training_data]
+
+
+def parse_priority_albums(config_path: str) -> List[str]:
+    """
+    Albums to process first when flagging with the "albums" priority.
+    """
+    sanitized_path = os.path.expanduser(config_path)
+    if not os.path.exists(sanitized_path):
+        return []
+    return _get_config(config_path).get('priority_albums', [])
+
+
+def parse_quantization(config_path: str) -> QuantizationConfig:
+    """
+    Which classifiers run int8 variants of their models, from the config's quantization section.
+    """
+    sanitized_path = os.path.expanduser(config_path)
+    if not os.path.exists(sanitized_path):
+        return QuantizationConfig()
+    return QuantizationConfig(**(_get_config(config_path).get('quantization') or {}))
+
+
+def parse_governor(config_path: str) -> Optional[GovernorConfig]:
+    """
+    Resource limits for flagging runs, from the config's governor section; None if it has none.
+    """
+    sanitized_path = os.path.expanduser(config_path)
+    if not os.path.exists(sanitized_path):
+        return None
+    governor = _get_config(config_path).get('governor')
+    return GovernorConfig(**governor) if governor is not None else None
+
+
+def parse_evaluations(config_path: str) -> List[EvaluationConfig]:
+    evaluations = _get_config(config_path).get('evaluation', [])
+    return [
+        EvaluationConfig(
+            name=evaluation['name'],
+            label_album_mapping=evaluation.get('label_album_mapping', []),
+            variants=[EvaluationVariant(**variant) for variant in evaluation.get('variants', [])]
+        )
+        for evaluation in evaluations
+    ]
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional
+
+from osxphotos.cli.common import get_data_dir
+
+from lib.classify import Classifier
+from lib.osxphotos_utils import construct_query_options
+from lib.staging import DirectoryIndex
+
+try:
+    import psutil
+except ImportError:
+    # Without it, peak memory is the process's high-water mark so far rather than per variant
+    psutil = None
+
+# Thresholds the precision/recall curves are traced at
+DEFAULT_THRESHOLDS = [round(0.05 * step, 2) for step in range(1, 20)]
+# Photos scored per call; classifiers still split them into their own batch size
+EVALUATION_CHUNK_SIZE = 64
+# Images scored, untimed, before timing starts, so lazy initialization isn't counted
+WARMUP_IMAGES = 8
+READ_BUFFER_BYTES = 4 * 1024 ** 2
+MEMORY_SAMPLE_SECONDS = 0.05
+REPORT_FILENAME = "report.json"
+
+
+def default_results_dir(evaluation_name):
+    return os.path.join(get_data_dir(), "evaluations", evaluation_name)
+
+
+@dataclass
+class LabeledPhoto:
+    uuid: str
+    preview_path: str
+    positive: bool  # In the album of the label the classifier should flag
+
+
+def collect_labeled_photos(flagger, label_album_mapping) -> List[LabeledPhoto]:
+    """
+    Returns the photos of the labeled albums. The first label is the positive one; a photo in several
+    albums counts as positive if any of them is the positive album.
+    """
+    positive_label = label_album_mapping[0][0]
+    photos = {}
+    for label, album_name in label_album_mapping:
+        for uuid, preview_path in flagger.get_preview_records(construct_query_options(album=[album_name])):
+            positive = label == positive_label or (uuid in photos and photos[uuid].positive)
+            photos[uuid] = LabeledPhoto(uuid, preview_path, positive)
+    return list(photos.values())
+
+
+def preview_stamp(path):
+    """
+    Identifies the version of a preview; a photo is scored again when its preview changes.
+    """
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def read_ahead(paths):
+    """
+    Reads files once, in on-disk order, so every variant is timed against the same warm page cache
+    rather than the first one paying for cold reads.
+    """
+    index = DirectoryIndex()
+    for path in sorted(paths, key=index.locality_key):
+        try:
+            with open(path, "rb") as f:
+                while f.read(READ_BUFFER_BYTES):
+                    pass
+        except OSError:
+            pass
+
+
+def _max_rss():
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PeakMemory:
+    """
+    Measures the process's peak resident memory while the context is active.
+    """
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        process = psutil.Process()
+        while not self._stop.is_set():
+            self.peak = max(self.peak, process.memory_info().rss)
+            self._stop.wait(MEMORY_SAMPLE_SECONDS)
+
+    def __enter__(self):
+        if psutil is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        else:
+            self.peak = _max_rss()
+        return False
+
+
+class VariantResults:
+    """
+    The scores and timings of one variant, kept on disk. The file is keyed by the variant's description
+    and classifier signature, so changing either starts over, while an unchanged variant only scores
+    photos that are new or whose preview changed.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self._state = {"key": key, "scores": {}, "photos_timed": 0, "seconds": 0.0, "peak_memory": 0, "model_bytes": 0}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                state = json.load(f)
+            if state.get("key") == key:
+                self._state = state
+
+    @classmethod
+    def for_variant(cls, results_dir, name, description, classifier: Classifier):
+        key = hashlib.sha1(
+            json.dumps({"variant": description, "signature": classifier.signature()}, sort_keys=True).encode()
+        ).hexdigest()
+        return cls(os.path.join(results_dir, f"{name}-{key[:12]}.json"), key)
+
+    def score(self, uuid, stamp):
+        """
+        The stored score for a photo, or False if it hasn't been scored at this stamp. None means unreadable.
+        """
+        stored = self._state["scores"].get(uuid)
+        if stored is None or stored[0] != stamp:
+            return False
+        return stored[1]
+
+    def record(self, scored, seconds, peak_memory, model_bytes):
+        """
+        :param scored: (uuid, stamp, score) tuples.
+        """
+        for uuid, stamp, score in scored:
+            self._state["scores"][uuid] = [stamp, score]
+        self._state["photos_timed"] += len(scored)
+        self._state["seconds"] += seconds
+        self._state["peak_memory"] = max(self._state["peak_memory"], peak_memory)
+        self._state["model_bytes"] = model_bytes or self._state["model_bytes"]
+
+    @property
+    def photos_per_second(self):
+        return self._state["photos_timed"] / self._state["seconds"] if self._state["seconds"] else None
+
+    @property
+    def peak_memory(self):
+        return self._state["peak_memory"]
+
+    @property
+    def model_bytes(self):
+        return self._state["model_bytes"]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.path)
+
+
+def precision_recall(scores, labels, threshold, at_threshold=False):
+    """
+    Precision, recall and F1 of flagging the photos whose score is above the threshold, or at it too if
+    at_threshold, matching the classifier's flags_at_threshold.
+    """
+    flagged = [score >= threshold if at_threshold else score > threshold for score in scores]
+    true_positives = sum(1 for flag, label in zip(flagged, labels) if flag and label)
+    flagged_count = sum(flagged)
+    positives = sum(labels)
+    precision = true_positives / flagged_count if flagged_count else 1.0
+    recall = true_positives / positives if positives else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+@dataclass
+class VariantReport:
+    name: str
+    photos: int
+    unreadable: int
+    threshold: float
+    precision: float
+    recall: float
+    f1: float
+    best_threshold: float  # Threshold with the highest F1 on the curve
+    best_f1: float
+    photos_per_second: Optional[float]
+    peak_memory: int
+    model_bytes: int
+    curve: List[dict] = field(default_factory=list)  # {"threshold", "precision", "recall", "f1"} per threshold
+
+
+def evaluate_variant(name, description, classifier: Classifier, photos: List[LabeledPhoto], results_dir,
+                     thresholds=DEFAULT_THRESHOLDS, log=print) -> VariantReport:
+    """
+    Scores the photos with a classifier variant, reusing saved scores where possible, and reports its
+    precision and recall at its own threshold and across thresholds, with its throughput and memory.
+
+    :param description: What distinguishes the variant, e.g. its config; saved scores are only reused for the same one.
+    """
+    results = VariantResults.for_variant(results_dir, name, description, classifier)
+    stamps = {}
+    for photo in photos:
+        try:
+            stamps[photo.uuid] = preview_stamp(photo.preview_path)
+        except OSError:
+            stamps[photo.uuid] = None
+    todo = [photo for photo in photos if stamps[photo.uuid] is not None
+            and results.score(photo.uuid, stamps[photo.uuid]) is False]
+
+    if todo:
+        log(f"{name}: scoring {len(todo)} of {len(photos)} photos")
+        with PeakMemory() as memory:
+            classifier.load()
+            model_bytes = classifier.memory_footprint()
+            classifier.apply_threads()
+            classifier.score_batch([photo.preview_path for photo in todo[:WARMUP_IMAGES]])
+            for start in range(0, len(todo), EVALUATION_CHUNK_SIZE):
+                chunk = todo[start:start + EVALUATION_CHUNK_SIZE]
+                classifier.clear_caches()
+                chunk_start = time.perf_counter()
+                scores = classifier.score_batch([photo.preview_path for photo in chunk])
+                seconds = time.perf_counter() - chunk_start
+                results.record(
+                    [(photo.uuid, stamps[photo.uuid], score) for photo, score in zip(chunk, scores)],
+                    seconds,
+                    memory.peak,
+                    model_bytes
+                )
+                # Saved as it goes, so an interrupted evaluation resumes where it stopped
+                results.save()
+        results.record([], 0.0, memory.peak, model_bytes)
+        results.save()
+        classifier.unload()
+    else:
+        log(f"{name}: all {len(photos)} photos already scored")
+
+    scored = [(results.score(photo.uuid, stamps[photo.uuid]), photo.positive) for photo in photos
+              if stamps[photo.uuid] is not None]
+    scored = [(score, positive) for score, positive in scored if score is not None and score is not False]
+    scores = [score for score, _ in scored]
+    labels = [positive for _, positive in scored]
+
+    # Classifiers without a confidence threshold, like distilled heads, score 0 or 1
+    threshold = classifier.confidence_threshold if classifier.confidence_threshold is not None else 0.5
+    precision, recall, f1 = precision_recall(scores, labels, threshold, classifier.flags_at_threshold)
+    curve = []
+    for curve_threshold in thresholds:
+        curve_precision, curve_recall, curve_f1 = precision_recall(scores, labels, curve_threshold, classifier.flags_at_threshold)
+        curve.append({"threshold": curve_threshold, "precision": curve_precision, "recall": curve_recall, "f1": curve_f1})
+    best = max(curve, key=lambda point: point["f1"])
+
+    return VariantReport(
+        name=name,
+        photos=len(photos),
+        unreadable=len(photos) - len(scored),
+        threshold=threshold,
+        precision=precision,
+        recall=recall,
+        f1=f1,
+        best_threshold=best["threshold"],
+        best_f1=best["f1"],
+        photos_per_second=results.photos_per_second,
+        peak_memory=results.peak_memory,
+        model_bytes=results.model_bytes,
+        curve=curve
+    )
+
+
+def save_report(results_dir, reports: List[VariantReport]):
+    path = os.path.join(results_dir, REPORT_FILENAME)
+    os.makedirs(results_dir, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump([asdict(report) for report in reports], f, indent=2)
+    return path
@@ -0,0 +1,128 @@
+import hashlib
+import json
+
+from osxphotos.sqlitekvstore import SQLiteKVStore
+
+# JPEG markers without a length field
+_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xDA)}
+# APP0-APP15 (EXIF, XMP, ICC, ...) and COM segments carry metadata, not pixels
+_METADATA_MARKERS = {*range(0xE0, 0xF0), 0xFE}
+_SOS = 0xDA
+
+
+def _jpeg_image_data(data: bytes):
+    """
+    Yields the segments of a JPEG that determine its pixels: quantization and Huffman tables, the frame
+    header and the entropy-coded scans. Returns None if the data doesn't parse as a JPEG.
+    """
+    if not data.startswith(b"\xff\xd8"):
+        return None
+    segments = []
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+        if marker in _STANDALONE_MARKERS:
+            pos += 2
+            continue
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        if marker == _SOS:
+            # Scan header plus everything after it: the compressed pixels through EOI
+            segments.append(data[pos:])
+            return segments
+        if marker not in _METADATA_MARKERS:
+            segments.append(data[pos:pos + 2 + length])
+        pos += 2 + length
+    return None
+
+
+def fingerprint(path):
+    """
+    Returns a content fingerprint of an image file, computed without decoding it.
+
+    For JPEGs only the coded image data is hashed, so copies that differ only in metadata (EXIF, XMP,
+    a re-import's edits to dates or keywords) share a fingerprint. Other formats hash the whole file.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.blake2b(digest_size=20)
+    segments = _jpeg_image_data(data)
+    if segments is None:
+        digest.update(b"raw:")
+        digest.update(data)
+    else:
+        digest.update(b"jpeg:")
+        for segment in segments:
+            digest.update(segment)
+    return digest.hexdigest()
+
+
+class FingerprintIndex:
+    """
+    Stores classifier results per image fingerprint, so exact duplicates are only classified once.
+    Results are keyed by each classifier's signature, so changing a model or threshold invalidates them.
+    """
+
+    def __init__(self, db_path):
+        self._kvstore = SQLiteKVStore(
+            db_path,
+            wal=True,
+            serialize=json.dumps,
+            deserialize=json.loads
+        )
+
+    def get(self, fingerprint):
+        """
+        Returns a dict of classifier signature -> classification.
+        """
+        return self._kvstore.get(fingerprint) or {}
+
+    def update(self, fingerprint, results):
+        record = self.get(fingerprint)
+        record.update(results)
+        self._kvstore.set(fingerprint, record)
+
+    def close(self):
+        self._kvstore.close()
+
+
+class DedupStats:
+    """
+    Tracks how much inference the fingerprint index saved during a run.
+    """
+
+    def __init__(self):
+        self.lookups = 0
+        self.hits = {}
+        self.inference_seconds = {}
+        self.inference_count = {}
+        self.photos_skipped = 0
+
+    def record_hit(self, classifier_name):
+        self.lookups += 1
+        self.hits[classifier_name] = self.hits.get(classifier_name, 0) + 1
+
+    def record_inference(self, classifier_name, seconds, count):
+        self.lookups += count
+        self.inference_seconds[classifier_name] = self.inference_seconds.get(classifier_name, 0) + seconds
+        self.inference_count[classifier_name] = self.inference_count.get(classifier_name, 0) + count
+
+    @property
+    def hit_rate(self):
+        return sum(self.hits.values()) / self.lookups if self.lookups else 0.0
+
+    @property
+    def seconds_saved(self):
+        """
+        Estimated from each classifier's measured seconds per photo.
+        """
+        return sum(
+            hits * self.inference_seconds[name] / self.inference_count[name]
+            for name, hits in self.hits.items()
+            if self.inference_count.get(name)
+        )
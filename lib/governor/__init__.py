@@ -0,0 +1,244 @@
+import datetime
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import torch
+
+from lib.classify import Classifier
+
+try:
+    import psutil
+except ImportError:
+    # In requirements.txt; without it, load and quiet hours still work but free memory isn't watched
+    psutil = None
+
+logger = logging.getLogger("photoflagger")
+
+# Time constant of the kernel's 1-minute load average, which our own CPU use is smoothed with to match
+LOAD_AVERAGE_SECONDS = 60
+# Below this multiple of min_free_memory, classifier batches are halved
+LOW_MEMORY_MULTIPLE = 2
+
+
+@dataclass
+class ResourceSample:
+    load: float  # 1-minute load average, in cores
+    own_load: float  # Our share of it, in cores, smoothed the same way
+    free_memory: Optional[float]  # Fraction of physical memory available, or None without psutil
+    quiet: bool  # Within quiet hours
+
+    @property
+    def other_load(self):
+        return max(0.0, self.load - self.own_load)
+
+
+def _parse_window(window):
+    start, end = (datetime.datetime.strptime(part.strip(), "%H:%M").time() for part in window.split("-"))
+    return start, end
+
+
+def in_windows(windows, now: datetime.time):
+    """
+    Whether a time of day falls in any "HH:MM-HH:MM" window. Windows may wrap past midnight, like "22:00-06:00".
+    """
+    for start, end in windows:
+        if start <= end and start <= now < end:
+            return True
+        if start > end and (now >= start or now < end):
+            return True
+    return False
+
+
+class ResourceGovernor:
+    """
+    Keeps a run within a share of the machine, so it yields to whatever else is running.
+
+    The cores left for the run are its share of the machine, minus the load from other processes. Torch
+    threads and decode workers are capped to those cores, and classifier batches are halved when free memory
+    runs low. When fewer than min_cores are left, memory is below min_free_memory, or quiet hours allow no
+    share at all, the run pauses until things recover. Settings go back up as load drops.
+    """
+
+    def __init__(
+        self,
+        max_share=1.0,
+        min_free_memory=0.1,
+        quiet_hours: List[str] = (),
+        quiet_share=0.0,
+        min_cores=1.0,
+        check_interval=10.0
+    ):
+        """
+        :param max_share: Fraction of the machine's cores the run may use.
+        :param min_free_memory: Pause while less than this fraction of memory is available. Needs psutil.
+        :param quiet_hours: "HH:MM-HH:MM" windows, e.g. working hours, when quiet_share applies instead.
+        :param quiet_share: Fraction of the cores the run may use during quiet hours; 0 pauses it.
+        :param min_cores: Pause while fewer cores than this are left for the run.
+        :param check_interval: Seconds between checks, and between samples while paused.
+        """
+        self.max_share = max_share
+        self.min_free_memory = min_free_memory
+        self.quiet_hours = [_parse_window(window) for window in quiet_hours]
+        self.quiet_share = quiet_share
+        self.min_cores = min_cores
+        self.check_interval = check_interval
+        self.cores = os.cpu_count() or 1
+        self.thread_cap = None  # None while the run isn't throttled
+        self.batch_scale = 1.0
+        self.paused_seconds = 0.0
+        self.adjustments = 0
+        self._baselines = {}
+        self._last_check = None
+        self._own_load = 0.0
+        self._cpu_time = None
+        self._sample_time = None
+
+        if min_free_memory and psutil is None:
+            logger.warning(
+                "psutil isn't installed, so the resource governor won't pause or shrink batches when memory runs low; "
+                "pip install -r requirements.txt"
+            )
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_share=config.max_share,
+            min_free_memory=config.min_free_memory,
+            quiet_hours=config.quiet_hours,
+            quiet_share=config.quiet_share,
+            min_cores=config.min_cores,
+            check_interval=config.check_interval
+        )
+
+    @property
+    def throttled(self):
+        return self.thread_cap is not None or self.batch_scale < 1
+
+    def sample(self) -> ResourceSample:
+        now = time.monotonic()
+        times = os.times()
+        cpu_time = times.user + times.system
+        if self._sample_time is not None and now > self._sample_time:
+            elapsed = now - self._sample_time
+            decay = math.exp(-elapsed / LOAD_AVERAGE_SECONDS)
+            instant = (cpu_time - self._cpu_time) / elapsed
+            self._own_load = decay * self._own_load + (1 - decay) * instant
+        self._cpu_time = cpu_time
+        self._sample_time = now
+
+        free_memory = None
+        if psutil is not None:
+            memory = psutil.virtual_memory()
+            free_memory = memory.available / memory.total
+        return ResourceSample(
+            load=os.getloadavg()[0],
+            own_load=self._own_load,
+            free_memory=free_memory,
+            quiet=in_windows(self.quiet_hours, datetime.datetime.now().time())
+        )
+
+    def allowed_cores(self, sample: ResourceSample):
+        share = self.quiet_share if sample.quiet else self.max_share
+        return max(0.0, min(share * self.cores, self.cores - sample.other_load))
+
+    def pause_reason(self, sample: ResourceSample):
+        """
+        Why the run should pause, or None if it can go on.
+        """
+        if sample.quiet and self.quiet_share <= 0:
+            return "quiet hours"
+        if sample.free_memory is not None and sample.free_memory < self.min_free_memory:
+            return f"{sample.free_memory * 100:.0f}% of memory free, below {self.min_free_memory * 100:.0f}%"
+        cores = self.allowed_cores(sample)
+        if cores < self.min_cores:
+            return f"other processes are using {sample.other_load:.1f} of {self.cores} cores, leaving {cores:.1f}"
+        return None
+
+    def wait(self, deadline=None):
+        """
+        Blocks while the machine is over the limits, or until the monotonic deadline passes.
+        :return: Seconds paused.
+        """
+        sample = self.sample()
+        reason = self.pause_reason(sample)
+        if reason is None:
+            return 0.0
+
+        logger.info(f"Pausing: {reason}")
+        start = time.monotonic()
+        while reason is not None:
+            remaining = deadline - time.monotonic() if deadline is not None else self.check_interval
+            if remaining <= 0:
+                break
+            time.sleep(min(self.check_interval, remaining))
+            reason = self.pause_reason(self.sample())
+        paused = time.monotonic() - start
+        self.paused_seconds += paused
+        logger.info(f"Resuming after {paused:.0f}s")
+        return paused
+
+    def regulate(self, classifiers: List[Classifier]):
+        """
+        Caps the classifiers' threads, decode workers and batch sizes to what the machine can spare, or
+        restores their own settings when it can spare everything. Checks at most once per check_interval.
+        """
+        now = time.monotonic()
+        if self._last_check is not None and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+
+        sample = self.sample()
+        cores = self.allowed_cores(sample)
+        # Rounded, so a little background load doesn't take a whole thread away
+        thread_cap = max(1, round(cores))
+        if thread_cap >= self.cores:
+            thread_cap = None
+        batch_scale = 1.0
+        if sample.free_memory is not None and sample.free_memory < LOW_MEMORY_MULTIPLE * self.min_free_memory:
+            batch_scale = 0.5
+        if (thread_cap, batch_scale) == (self.thread_cap, self.batch_scale):
+            return
+
+        self.thread_cap = thread_cap
+        self.batch_scale = batch_scale
+        self.adjustments += 1
+        for classifier in classifiers:
+            if not self.throttled:
+                baseline = self._baselines.pop(classifier.name, None)
+                if baseline is not None:
+                    classifier.apply_settings(baseline)
+                continue
+            baseline = self._baselines.setdefault(classifier.name, self._baseline(classifier))
+            classifier.apply_settings(self._capped(baseline))
+
+        if self.throttled:
+            logger.info(
+                f"Load {sample.load:.1f} ({sample.own_load:.1f} ours) on {self.cores} cores"
+                + (f", {sample.free_memory * 100:.0f}% memory free" if sample.free_memory is not None else "")
+                + f": capping threads and decode workers at {thread_cap or 'their tuned values'}"
+                + (", halving batch sizes" if batch_scale < 1 else "")
+            )
+        else:
+            logger.info(f"Load {sample.load:.1f} on {self.cores} cores: restoring full settings")
+
+    @staticmethod
+    def _baseline(classifier: Classifier):
+        settings = classifier.settings()
+        # Threads left at torch's default are restored explicitly, or the cap would stay in effect
+        if "threads" in settings and settings["threads"] is None:
+            settings["threads"] = torch.get_num_threads()
+        return settings
+
+    def _capped(self, baseline):
+        capped = dict(baseline)
+        if self.thread_cap is not None:
+            for name in ("threads", "decode_workers"):
+                if capped.get(name) is not None:
+                    capped[name] = min(capped[name], self.thread_cap)
+        if capped.get("batch_size") is not None:
+            capped["batch_size"] = max(1, int(capped["batch_size"] * self.batch_scale))
+        return capped
@@ -0,0 +1,164 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+INDEX_FILENAME = "index.json"
+IMAGES_FILENAME = "images.u8"
+MIN_CAPACITY = 256
+
+
+class ImageCache:
+    """
+    A memory-mapped cache of decoded, resized uint8 RGB images keyed by photo UUID.
+
+    Every transform signature (output size + resample filter) gets its own directory, so changing the
+    input resolution never mixes images of different shapes. An entry is invalidated when the size or
+    modification time of its source file changes.
+    """
+
+    def __init__(self, cache_dir, size=224, resample=Image.BILINEAR, decode_workers=None):
+        self.size = size
+        self.resample = resample
+        self.signature = f"{size}x{size}_rgb_u8_resample{int(resample)}"
+        self.path = os.path.join(os.path.expanduser(cache_dir), self.signature)
+        self.images_path = os.path.join(self.path, IMAGES_FILENAME)
+        self._index_path = os.path.join(self.path, INDEX_FILENAME)
+        self._decode_workers = decode_workers or os.cpu_count()
+        self._images = None
+
+        os.makedirs(self.path, exist_ok=True)
+        self._index = self._load_index()
+
+    def __getstate__(self):
+        # Other processes map the backing file themselves rather than receiving a copy of it
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    @property
+    def capacity(self):
+        return self._index["capacity"]
+
+    @property
+    def item_shape(self):
+        return self.size, self.size, 3
+
+    def _load_index(self):
+        if os.path.exists(self._index_path) and os.path.exists(self.images_path):
+            with open(self._index_path, "r") as f:
+                return json.load(f)
+        return {"capacity": 0, "next_slot": 0, "entries": {}}
+
+    def _save_index(self):
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _reserve(self, num_slots):
+        """
+        Grow the backing file so it can hold at least num_slots images.
+        """
+        if num_slots <= self.capacity:
+            return
+        capacity = max(num_slots, self.capacity * 2, MIN_CAPACITY)
+        self._close()
+        open(self.images_path, "ab").close()
+        os.truncate(self.images_path, capacity * int(np.prod(self.item_shape)))
+        self._index["capacity"] = capacity
+
+    def _close(self):
+        if self._images is not None:
+            self._images.flush()
+            self._images = None
+
+    def images(self):
+        """
+        Returns the writable memory-mapped array of cached images, shaped (capacity, size, size, 3).
+        """
+        if self._images is None:
+            self._images = np.memmap(
+                self.images_path,
+                dtype=np.uint8,
+                mode="r+",
+                shape=(self.capacity, *self.item_shape)
+            )
+        return self._images
+
+    @staticmethod
+    def _source_stat(path):
+        stat = os.stat(path)
+        return {"source": path, "mtime_ns": stat.st_mtime_ns, "bytes": stat.st_size}
+
+    def _is_fresh(self, uuid, stat):
+        entry = self._index["entries"].get(uuid)
+        return entry is not None and all(entry[key] == value for key, value in stat.items())
+
+    def stamp(self, uuid):
+        """
+        Returns a string identifying the cached version of an image, for keying data derived from it.
+        """
+        entry = self._index["entries"][uuid]
+        return f"{entry['mtime_ns']}:{entry['bytes']}"
+
+    def _decode(self, path):
+        try:
+            with Image.open(path) as image:
+                # Let the JPEG decoder downscale in the DCT domain before the (more expensive) resize
+                image.draft("RGB", (self.size, self.size))
+                image = image.convert("RGB").resize((self.size, self.size), self.resample)
+                return np.asarray(image, dtype=np.uint8)
+        except Exception as e:
+            print(f"Error loading image {path}: {e}")
+            return None
+
+    def add(self, records):
+        """
+        Ensure every (uuid, path) record is decoded into the cache.
+
+        :param records: Iterable of (uuid, path) tuples.
+        :return: A list of cache slots in the same order as records; None for images that failed to decode.
+        """
+        records = list(records)
+        stats = {}
+        stale = []
+        for uuid, path in records:
+            try:
+                stats[uuid] = self._source_stat(path)
+            except OSError:
+                continue
+            if not self._is_fresh(uuid, stats[uuid]):
+                stale.append((uuid, path))
+
+        if stale:
+            entries = self._index["entries"]
+            slots = {}
+            for uuid, _ in stale:
+                if uuid in entries:
+                    slots[uuid] = entries[uuid]["slot"]
+                else:
+                    slots[uuid] = self._index["next_slot"]
+                    self._index["next_slot"] += 1
+            self._reserve(self._index["next_slot"])
+
+            images = self.images()
+            with ThreadPoolExecutor(max_workers=self._decode_workers) as executor:
+                decoded = executor.map(lambda record: self._decode(record[1]), stale)
+                for (uuid, _), array in zip(stale, decoded):
+                    if array is None:
+                        # Keep the slot reserved, but make sure the entry is treated as stale
+                        entries[uuid] = {"slot": slots[uuid], "source": None, "mtime_ns": None, "bytes": None}
+                        continue
+                    images[slots[uuid]] = array
+                    entries[uuid] = {"slot": slots[uuid], **stats[uuid]}
+            images.flush()
+            self._save_index()
+
+        entries = self._index["entries"]
+        return [
+            entries[uuid]["slot"] if uuid in stats and self._is_fresh(uuid, stats[uuid]) else None
+            for uuid, _ in records
+        ]
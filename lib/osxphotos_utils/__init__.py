@@ -1,4 +1,6 @@
 import datetime
+import os
+import random
 from dataclasses import dataclass, field
 from typing import List, Optional
 
@@ -20,6 +22,7 @@ class EnhancedQueryOptions:
     selected: Optional[bool] = None
     from_date: Optional[str] = None
     to_date: Optional[str] = None
+    movies: bool = False
 
     def to_query_options(self):
         exclude_keywords_sql = (
@@ -42,7 +45,7 @@ class EnhancedQueryOptions:
         query_eval = f"not ({exclude_keywords_sql}) and not ({exclude_extensions_sql}) and ({include_extensions_sql})"
 
         return QueryOptions(
-            movies=False,
+            movies=self.movies,
             query_eval=[query_eval],
             **({"selected": self.selected} if self.selected else {}),
             **({"keyword": self.keywords} if self.keywords else {}),
@@ -60,7 +63,8 @@ def construct_query_options(
     exclude_keywords=[],
     album=None,
     favorite=None,
-    person=None
+    person=None,
+    movies=False
 ):
     return EnhancedQueryOptions(
         selected=selected,
@@ -68,10 +72,96 @@ def construct_query_options(
         exclude_keywords=exclude_keywords,
         album=album,
         favorite=favorite,
-        person=person
+        person=person,
+        movies=movies
     )
 
 
+@dataclass
+class PhotoRecord:
+    """
+    A detached snapshot of the PhotoInfo fields used when processing a photo, so PhotoInfo objects
+    don't have to stay alive for a whole run.
+    """
+    uuid: str
+    filename: str
+    original_filename: str
+    path: Optional[str]
+    path_derivatives: List[str] = field(default_factory=list)
+    keywords: List[str] = field(default_factory=list)
+    ismovie: bool = False
+
+    @classmethod
+    def from_photo(cls, photo):
+        return cls(
+            uuid=photo.uuid,
+            filename=photo.filename,
+            original_filename=photo.original_filename,
+            path=photo.path,
+            path_derivatives=list(photo.path_derivatives),
+            keywords=list(photo.keywords),
+            ismovie=photo.ismovie
+        )
+
+    @property
+    def preview_path(self):
+        return self.path_derivatives[0] if self.path_derivatives else None
+
+
+class PhotoStream:
+    """
+    Iterates over the results of a query in chunks of PhotoRecords.
+
+    The query runs once up front, to count and order the results, and then only the UUIDs are kept;
+    each chunk's PhotoInfo objects are looked up, converted and released as the chunk is consumed,
+    so memory use stays flat however large the library is.
+    """
+
+    def __init__(self, photosdb, query_options: QueryOptions, order=None):
+        """
+        :param order: Optional function that takes the list of PhotoInfo results and returns them reordered.
+        """
+        self.photosdb = photosdb
+        photos = photosdb.query(query_options)
+        if order is not None:
+            photos = order(photos)
+        self.uuids = [photo.uuid for photo in photos]
+
+    def __len__(self):
+        return len(self.uuids)
+
+    def chunk(self, start, size):
+        """
+        Returns the PhotoRecords for uuids[start:start + size], skipping any deleted since the query ran.
+        """
+        return self.records(self.uuids[start:start + size])
+
+    def records(self, uuids):
+        """
+        Returns the PhotoRecords for the given uuids, in order, skipping any deleted since the query ran.
+        """
+        records = {photo.uuid: PhotoRecord.from_photo(photo) for photo in self.photosdb.photos(uuid=uuids)}
+        return [records[uuid] for uuid in uuids if uuid in records]
+
+    def chunks(self, size):
+        for start in range(0, len(self.uuids), size):
+            yield self.chunk(start, size)
+
+
+def sample_preview_paths(photosdb, num_samples):
+    """
+    Returns the preview paths of up to num_samples random photos in the library, e.g. to calibrate a classifier on.
+    """
+    stream = PhotoStream(photosdb, construct_query_options().to_query_options())
+    # Oversample, since some photos have no preview on disk
+    uuids = random.sample(stream.uuids, min(2 * num_samples, len(stream)))
+    paths = [
+        record.preview_path for record in stream.records(uuids)
+        if record.preview_path is not None and os.path.exists(record.preview_path)
+    ]
+    return paths[:num_samples]
+
+
 def add_to_album(photos, album_name, prefix="Utils"):
     """
     Adds all photos to an album under "prefix/album_name"
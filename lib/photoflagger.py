@@ -2,8 +2,11 @@ import json
 import logging
 import os.path
 import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import List
+from typing import List, Optional
 
 from loguru import logger
 from osxphotos import PhotosDB
@@ -13,11 +16,30 @@ from photoscript import Photo
 from rich.console import Console
 from rich.progress import Progress
 
+from lib.autotune import TuningProfile, ThroughputMonitor, default_profile_path
 from lib.classify import Classifier
+from lib.classify.residency import ResidencyManager
+from lib.fingerprint import fingerprint, FingerprintIndex, DedupStats
+from lib.governor import ResourceGovernor
+from lib.quarantine import Quarantine
+from lib.schedule import RunSchedule
+from lib.staging import DirectoryIndex, StagingCache
+from lib.video import sample_keyframes, aggregate_frames, DEFAULT_FRAMES_PER_VIDEO
+from lib.watchdog import Watchdog
+from lib.workqueue import WorkQueue, LeaseKeeper, default_worker_id, DEFAULT_LEASE_SECONDS
 from lib.osxphotos_utils import *
 
 logger = logging.getLogger("photoflagger")
 
+# With a memory budget, photos are processed in large chunks, one classifier at a time,
+# so each model is loaded at most once per chunk
+RESIDENCY_CHUNK_SIZE = 512
+# Seconds allowed for opening a video and decoding its sampled frames
+VIDEO_SAMPLING_TIME_LIMIT = 120
+# A batch gets at most this many images' worth of its classifier's time limit, so one hung image can't hold up a
+# large chunk for hours; a batch that times out is retried one photo at a time, each under the per-image limit
+BATCH_TIME_LIMIT_IMAGES = 16
+
 
 class ProcessResultStatus(Enum):
     SKIPPED = "skipped"
@@ -26,22 +48,40 @@ class ProcessResultStatus(Enum):
     ERROR = "error"
 
 
+class ClassifierFailure(Exception):
+    pass
+
+
 @dataclass
 class ProcessResult:
     status: ProcessResultStatus
     add_keywords: List[str] = field(default_factory=list)
+    reason: Optional[str] = None
 
     @classmethod
     def skipped(cls) -> "ProcessResult":
         return cls(status=ProcessResultStatus.SKIPPED)
 
 
+@dataclass
+class RunCounts:
+    processed: int = 0
+    previously_processed: int = 0
+    skipped: int = 0
+    error: int = 0
+    flagged: int = 0
+    quarantined: int = 0
+    still_quarantined: int = 0
+
+
 @dataclass
 class PhotoProcessContext:
     photo: Photo
     preview_path: str
     logger: object
     dry_run: bool
+    fingerprint: Optional[str] = None
+    video_path: Optional[str] = None
 
 
 class PhotoFlagger:
@@ -54,7 +94,19 @@ class PhotoFlagger:
         keystore_name,
         library_path,
         classifiers: list[Classifier] = [],
-        verbose_mode=False
+        verbose_mode=False,
+        batch_size=16,
+        memory_budget=None,
+        reuse_duplicates=True,
+        time_limits: Optional[dict] = None,
+        frames_per_video=DEFAULT_FRAMES_PER_VIDEO,
+        video_flag_fraction=0.25,
+        work_queue: Optional[WorkQueue] = None,
+        worker_id=None,
+        lease_seconds=DEFAULT_LEASE_SECONDS,
+        tuning_profile=None,
+        governor: Optional[ResourceGovernor] = None,
+        staging: Optional[StagingCache] = None
     ):
         # Configure logging first
         self._console = Console(stderr=True)
@@ -66,8 +118,40 @@ class PhotoFlagger:
         self._validate_library_path(library_path)
         self.photosdb = PhotosDB(dbfile=library_path)
         self.classifiers = classifiers
+        self.batch_size = batch_size
+        self.residency = None
+        self.reuse_duplicates = reuse_duplicates
+        self._fingerprints = None
+        self._dedup_stats = DedupStats()
+        self.time_limits = time_limits or {}
+        self._watchdog = Watchdog()
+        self._quarantine = None
+        self.frames_per_video = frames_per_video
+        self.video_flag_fraction = video_flag_fraction
+        self.work_queue = work_queue
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.governor = governor
+        self.staging = staging
+        # Derivatives are checked for in bulk; originals are only read for videos
+        self._derivatives = staging.index if staging is not None else DirectoryIndex()
         self._configure_logging(verbose_mode)
 
+        # Per-host settings from bin/autotune.py, if it has been run
+        self.tuning = TuningProfile(tuning_profile or default_profile_path())
+        tuned = self.tuning.apply(classifiers)
+        if tuned:
+            # Chunks have to be at least as large as the tuned batches to fill them
+            self.batch_size = max(self.batch_size, *(classifier.batch_size for classifier in tuned))
+        self._throughput = ThroughputMonitor(self.tuning)
+
+        if memory_budget:
+            self.residency = ResidencyManager(memory_budget)
+            self.batch_size = max(batch_size, RESIDENCY_CHUNK_SIZE)
+        else:
+            for classifier in classifiers:
+                classifier.load()
+
     def _configure_logging(self, verbose_mode):
         """
         Configure the class-specific logger.
@@ -99,6 +183,41 @@ class PhotoFlagger:
 
     def _reset_kvstore(self):
         self._kvstore = self._get_kv_store(reset=True)
+        self._reset_fingerprints()
+        self._reset_quarantine()
+
+    def _fingerprint_db_path(self):
+        return os.path.join(get_data_dir(), f"{os.path.splitext(self._keystore_name)[0]}_fingerprints.db")
+
+    def _get_fingerprints(self):
+        """
+        The index of classifier results per image fingerprint, opened on first use.
+        """
+        if self._fingerprints is None:
+            self._fingerprints = FingerprintIndex(self._fingerprint_db_path())
+        return self._fingerprints
+
+    def _get_quarantine(self):
+        if self._quarantine is None:
+            self._quarantine = Quarantine(
+                os.path.join(get_data_dir(), f"{os.path.splitext(self._keystore_name)[0]}_quarantine.db")
+            )
+        return self._quarantine
+
+    def _reset_quarantine(self):
+        self._get_quarantine().close()
+        self._quarantine = None
+        db_path = os.path.join(get_data_dir(), f"{os.path.splitext(self._keystore_name)[0]}_quarantine.db")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+    def _reset_fingerprints(self):
+        # Models can be retrained under the same name, so a reset also forgets stored results
+        if self._fingerprints is not None:
+            self._fingerprints.close()
+            self._fingerprints = None
+        if os.path.exists(self._fingerprint_db_path()):
+            os.remove(self._fingerprint_db_path())
 
     def _update_kvstore(self, photo):
         # record that will be stored in the kvstore database
@@ -126,26 +245,55 @@ class PhotoFlagger:
             photo=photo,
             preview_path=preview_path,
             logger=logger,
-            dry_run=dry_run
+            dry_run=dry_run,
+            # Videos are classified from frames of the movie itself; their derivative is only a poster frame
+            video_path=photo.path if photo.ismovie else None
         )
 
+    def iter_preview_records(self, query_options: EnhancedQueryOptions, chunk_size=1000):
+        """
+        Yields (uuid, preview path) tuples for all photos matching the query that have a preview,
+        without keeping the query's PhotoInfo objects alive.
+        :param query_options:
+        :param chunk_size:
+        :return:
+        """
+        for chunk in PhotoStream(self.photosdb, query_options.to_query_options()).chunks(chunk_size):
+            for record in chunk:
+                if record.preview_path is not None:
+                    yield record.uuid, record.preview_path
+
     def get_preview_paths(self, query_options: EnhancedQueryOptions):
         """
         Returns the preview paths for all photos matching the query.
         :param query_options:
         :return:
         """
-        photos = self.photosdb.query(query_options.to_query_options())
-        return [self._build_context(photo, dry_run=True).preview_path for photo in photos]
+        return [preview_path for _, preview_path in self.iter_preview_records(query_options)]
+
+    def get_preview_records(self, query_options: EnhancedQueryOptions):
+        """
+        Returns (uuid, preview path) tuples for all photos matching the query that have a preview.
+        :param query_options:
+        :return:
+        """
+        return list(self.iter_preview_records(query_options))
 
     def _get_exclude_keywords(self):
         return [f"validated_{classifier.name}" for classifier in self.classifiers]
 
+    def _schedule_state_path(self):
+        return os.path.join(get_data_dir(), f"{os.path.splitext(self._keystore_name)[0]}_schedule.json")
+
     def process_photos(
         self,
         dry_run: bool = False,
         reset: bool = False,  # Whether to reset the database of previously processed photos
-        selected: bool = False  # Whether to operate only on selected photos
+        selected: bool = False,  # Whether to operate only on selected photos
+        movies: bool = False,  # Whether to also classify videos, from sampled frames
+        time_budget: Optional[float] = None,  # Seconds the run may take before it stops cleanly
+        priority: str = "library",  # Order to process photos in, one of lib.schedule.PRIORITIES
+        priority_albums: Optional[List[str]] = None  # Albums processed first with the "albums" priority
     ):
         """
         Process a list of photos using the provided function.
@@ -153,75 +301,501 @@ class PhotoFlagger:
         :param selected:
         :param reset:
         :param dry_run:
+        :param movies:
+        :param time_budget:
+        :param priority:
+        :param priority_albums:
         """
         if reset:
             self._reset_kvstore()
-
-        query_options = construct_query_options(selected, exclude_keywords=self._get_exclude_keywords()).to_query_options()
+            if os.path.exists(self._schedule_state_path()):
+                os.remove(self._schedule_state_path())
+            if self.work_queue is not None:
+                self.work_queue.reset()
+        schedule = RunSchedule(self._schedule_state_path(), time_budget)
+
+        query_options = construct_query_options(
+            selected,
+            exclude_keywords=self._get_exclude_keywords(),
+            movies=movies
+        ).to_query_options()
 
         # Track number of photos processed for reporting at the end
-        photos = self.photosdb.query(query_options)
-        num_photos = len(photos)
-        num_previously_processed = 0
-        num_skipped = 0
-        num_error = 0
-        num_flagged = 0
+        stream = PhotoStream(
+            self.photosdb,
+            query_options,
+            order=lambda photos: schedule.order(photos, priority, priority_albums)
+        )
+        num_photos = len(stream)
+        counts = RunCounts()
 
         with (Progress(console=self._console) as progress):
             task = progress.add_task(f"Processing {num_photos} photos", total=num_photos)
-            for photo in photos:
-                logger.debug(f"Processing photo: {photo.filename}")
-                ctx = self._build_context(photo, dry_run)
-
-                if photo.path is None or not os.path.exists(photo.path):
-                    num_skipped += 1
-                    logger.debug("File does not exist. Skipping.")
-                    continue
-                elif self._kvstore.get(photo.uuid):
-                    logger.debug(f"Skipping previously processed photo {photo.original_filename} ({photo.uuid})")
-                    num_previously_processed += 1
+            advance = lambda num: progress.advance(task, num)
+            try:
+                if self.work_queue is None:
+                    remaining = self._process_stream(stream, dry_run, schedule, counts, advance)
+                else:
+                    remaining = self._process_queue(stream, dry_run, schedule, counts, advance)
+            finally:
+                if self.staging is not None:
+                    self.staging.clear()
+
+        print(f"Processed {counts.processed} of {num_photos} photos")
+        print(f"Previously processed {counts.previously_processed} photos")
+        print(f"Skipped {counts.skipped} photos")
+        print(f"Errored on {counts.error} photos")
+        print(f"Quarantined {counts.quarantined} photos; skipped {counts.still_quarantined} still in quarantine")
+        print(f"Flagged {counts.flagged} photos")
+        if self.reuse_duplicates:
+            stats = self._dedup_stats
+            print(
+                f"Reused stored results for {stats.photos_skipped} duplicate photos "
+                f"(hit rate {stats.hit_rate * 100:.1f}%), saving about {stats.seconds_saved:.0f}s of inference"
+            )
+        if self.governor is not None:
+            print(
+                f"Paused for {self.governor.paused_seconds / 60:.0f} minutes to yield to other work; "
+                f"adjusted settings {self.governor.adjustments} times"
+            )
+        if self.staging is not None and self.staging.copy_seconds:
+            staging = self.staging
+            print(
+                f"Staged {staging.staged_files} previews ({staging.staged_bytes / 1024 ** 2:.0f} MB) at "
+                f"{staging.staged_bytes / 1024 ** 2 / staging.copy_seconds:.1f} MB/s"
+            )
+        if remaining is not None:
+            estimate = schedule.estimate_seconds(remaining)
+            estimate_text = f", about {estimate / 60:.0f} minutes of work" if estimate is not None else ""
+            print(f"Time budget reached with {remaining} photos left{estimate_text}; the next run continues from here")
+
+    def _process_stream(self, stream: PhotoStream, dry_run, schedule: RunSchedule, counts: RunCounts, advance):
+        """
+        Works through the query results in order, one chunk at a time.
+        :return: The number of unprocessed photos left if the time budget ran out, otherwise None.
+        """
+        position = 0
+        chunk = stream.chunk(position, self.batch_size) if len(stream) else []
+        try:
+            while position < len(stream):
+                self._govern(schedule)
+                chunk_size = min(self.batch_size, len(stream) - position)
+                next_position = position + chunk_size
+                next_chunk = stream.chunk(next_position, self.batch_size) if next_position < len(stream) else []
+                # The next chunk's previews are staged while this one is classified
+                self._prefetch(next_chunk)
+                if self._process_chunk(chunk, dry_run, schedule, counts) is None:
+                    return sum(1 for uuid in stream.uuids[position:] if not self._kvstore.get(uuid))
+                position += chunk_size
+                counts.processed += chunk_size
+                advance(chunk_size)
+                chunk = next_chunk
+            return None
+        finally:
+            # Whatever wasn't finished, including after an interrupt, goes first next run
+            schedule.save(stream.uuids[position:])
+
+    def _process_queue(self, stream: PhotoStream, dry_run, schedule: RunSchedule, counts: RunCounts, advance):
+        """
+        Works through the shared work queue, so several workers can split one library between them.
+        The query results are added to the queue in priority order; chunks are then claimed with a lease,
+        which is renewed while the chunk is processed, and marked done once their keywords are written.
+        :return: The number of photos left in the queue if the time budget ran out, otherwise None.
+        """
+        queue = self.work_queue
+        queue.enqueue(stream.uuids)
+        out_of_time = False
+
+        # Leases still held on exit (time budget, interrupt or error) are released for other workers
+        with LeaseKeeper(queue, self.worker_id, self.lease_seconds) as keeper:
+            while True:
+                # Paused before claiming, so other workers can take the photos meanwhile
+                self._govern(schedule)
+                uuids = queue.claim(self.worker_id, self.batch_size, self.lease_seconds)
+                if not uuids:
+                    break
+                keeper.hold(uuids)
+                outcome = self._process_chunk(stream.records(uuids), dry_run, schedule, counts)
+                if outcome is None:
+                    out_of_time = True
+                    break
+                errored, quarantined = outcome
+
+                counts.processed += len(uuids)
+                advance(len(uuids))
+                if dry_run:
+                    # Nothing was written, so keep the lease until the run ends rather than marking it done
                     continue
+
+                # Photos still in this host's quarantine weren't tried, so they can't be done. Marked failed,
+                # they're queued again by the next run, and classified once their back-off expires. Released to
+                # pending instead, this worker would claim them straight back.
+                errored = set(errored) | set(quarantined)
+                finished = [uuid for uuid in uuids if uuid not in errored]
+                lost = set(finished) - set(queue.complete(self.worker_id, finished))
+                lost |= errored - set(queue.complete(self.worker_id, list(errored), failed=True))
+                if lost:
+                    logger.warning(f"Lease expired on {len(lost)} photos before they were finished")
+                keeper.drop(uuids)
+
+        if out_of_time:
+            return queue.counts().get("pending", 0)
+        return None
+
+    def _govern(self, schedule: RunSchedule):
+        """
+        Waits out load, memory or quiet-hours limits, then fits the classifiers' settings to the share of
+        the machine that's left.
+        """
+        if self.governor is None:
+            return
+        self.governor.wait(schedule.deadline)
+        self.governor.regulate(self.classifiers)
+
+    def _is_missing(self, photo: PhotoRecord, existing_previews):
+        if photo.ismovie:
+            return photo.path is None or not os.path.exists(photo.path)
+        return photo.preview_path not in existing_previews
+
+    def _prefetch(self, chunk: List[PhotoRecord]):
+        """
+        Starts staging the previews of a chunk's photos that will need classifying.
+        """
+        if self.staging is None:
+            return
+        self.staging.prefetch([
+            photo.preview_path for photo in chunk
+            if photo.preview_path is not None and not photo.ismovie
+            and not self._kvstore.get(photo.uuid) and not self._get_quarantine().is_blocked(photo.uuid)
+        ])
+
+    def _stage(self, ctxs: List[PhotoProcessContext]):
+        """
+        Points the contexts at staged local copies of their previews.
+        :return: The source paths staged, to release once the chunk is done.
+        """
+        if self.staging is None:
+            return []
+        sources = [ctx.preview_path for ctx in ctxs if ctx.preview_path is not None and ctx.video_path is None]
+        staged = self.staging.fetch(sources)
+        for ctx in ctxs:
+            ctx.preview_path = staged.get(ctx.preview_path, ctx.preview_path)
+        return list(staged)
+
+    def _process_chunk(self, chunk: List[PhotoRecord], dry_run, schedule: RunSchedule, counts: RunCounts):
+        """
+        Classifies a chunk of photos and writes their flags, skipping photos that are missing,
+        already processed or in quarantine.
+        :return: The UUIDs of photos that errored and of those skipped as still in quarantine, or None if the
+            time budget doesn't cover the chunk, in which case nothing was processed.
+        """
+        ctxs = []
+        chunk_skipped = 0
+        chunk_previously_processed = 0
+        still_quarantined = []
+        existing_previews = self._derivatives.existing(
+            [photo.preview_path for photo in chunk if photo.preview_path is not None]
+        )
+        for photo in chunk:
+            logger.debug(f"Processing photo: {photo.filename}")
+            if self._is_missing(photo, existing_previews):
+                chunk_skipped += 1
+                logger.debug("File does not exist. Skipping.")
+            elif self._kvstore.get(photo.uuid):
+                logger.debug(f"Skipping previously processed photo {photo.original_filename} ({photo.uuid})")
+                chunk_previously_processed += 1
+            elif self._get_quarantine().is_blocked(photo.uuid):
+                logger.debug(f"Skipping quarantined photo {photo.original_filename} ({photo.uuid})")
+                still_quarantined.append(photo.uuid)
+            else:
+                ctxs.append(self._build_context(photo, dry_run))
+
+        if not schedule.has_time_for(len(ctxs)):
+            return None
+
+        start = time.perf_counter()
+        staged = self._stage(ctxs)
+        try:
+            results = self._process_batch(ctxs, dry_run)
+        finally:
+            if staged:
+                self.staging.release(staged)
+        schedule.record(len(ctxs), time.perf_counter() - start)
+
+        writes = []
+        errored = []
+        for ctx, result in zip(ctxs, results):
+            photo = ctx.photo
+            add_keywords = []
+            if result.status == ProcessResultStatus.FLAGGED:
+                logger.debug(f"Flagged photo {photo.filename}")
+                add_keywords = result.add_keywords
+                counts.flagged += 1
+            elif result.status == ProcessResultStatus.SKIPPED:
+                logger.debug(f"Skipped photo {photo.filename}")
+                chunk_skipped += 1
+            elif result.status == ProcessResultStatus.ERROR:
+                # Not marked as processed: it's retried once its quarantine backs off
+                logger.warning(f"Errored on photo {photo.filename} ({photo.uuid}): {result.reason}")
+                counts.error += 1
+                errored.append(photo.uuid)
+                if not dry_run:
+                    self._get_quarantine().record_failure(photo.uuid, result.reason)
+                    counts.quarantined += 1
+                continue
+            writes.append((photo, add_keywords))
+        if not dry_run:
+            self._flush_writes(writes)
+
+        counts.skipped += chunk_skipped
+        counts.previously_processed += chunk_previously_processed
+        counts.still_quarantined += len(still_quarantined)
+        return errored, still_quarantined
+
+    def _flush_writes(self, writes):
+        """
+        Writes a chunk's keywords to the Photos library, then marks its photos as processed.
+        Keywords go first, so a photo is never marked processed without its flags.
+        """
+        for photo, keywords in writes:
+            if keywords:
+                self._add_keywords(photo, keywords)
+        for photo, _ in writes:
+            self._update_kvstore(photo)
+            self._get_quarantine().release(photo.uuid)
+
+    def _process_batch(self, ctxs: List[PhotoProcessContext], dry_run=False) -> List[ProcessResult]:
+        """
+        Runs the classifiers over a batch of photos, one classifier at a time, so each classifier can
+        vectorize or parallelize across the batch. If the batch fails, photos are retried one at a time
+        so a single bad photo only errors itself.
+        """
+        results = [None] * len(ctxs)
+        pending = []
+        for idx, ctx in enumerate(ctxs):
+            if ctx.video_path is not None:
+                results[idx] = self._process_video(ctx)
+            elif ctx.preview_path is None:
+                results[idx] = self._process_photo_isolated(ctx)
+            else:
+                pending.append(idx)
+
+        try:
+            flags = {idx: [] for idx in pending}
+            for classifier, classifications in self._classify_batch(ctxs, pending, dry_run):
+                for idx in pending:
+                    flag = self._flag_for(classifier, classifications[idx])
+                    if flag:
+                        flags[idx].append(flag)
+        except Exception as e:
+            logger.debug(f"Batch failed ({e}); retrying its photos one at a time")
+            for idx in pending:
+                results[idx] = self._process_photo_isolated(ctxs[idx])
+            return results
+
+        for idx in pending:
+            results[idx] = self._result_for(ctxs[idx], flags[idx])
+        return results
+
+    def _process_video(self, ctx: PhotoProcessContext) -> ProcessResult:
+        """
+        Classifies a video from a fixed number of sampled frames, passed to each classifier as one batch,
+        and aggregates the per-frame results into one flag per classifier.
+        """
+        with tempfile.TemporaryDirectory(prefix="photoflagger-frames-") as frames_dir:
+            try:
+                frame_paths = self._watchdog.run(
+                    sample_keyframes,
+                    ctx.video_path,
+                    frames_dir,
+                    self.frames_per_video,
+                    timeout=VIDEO_SAMPLING_TIME_LIMIT
+                )
+            except Exception as e:
+                return ProcessResult(ProcessResultStatus.ERROR, reason=f"frame sampling: {type(e).__name__}: {e}")
+            if not frame_paths:
+                ctx.logger.debug(f"Skipping {ctx.photo.original_filename}; could not decode any frames")
+                return ProcessResult(status=ProcessResultStatus.SKIPPED)
+
+            flags = []
+            for classifier in self._classifier_order():
                 try:
-                    result = self._process_photo(ctx)
-                    if result.status == ProcessResultStatus.FLAGGED:
-                        logger.debug(f"Flagged photo {photo.filename}")
-                        if not dry_run and result.add_keywords:
-                            self._add_keywords(photo, result.add_keywords)
-                        num_flagged += 1
-                    elif result.status == ProcessResultStatus.SKIPPED:
-                        logger.debug(f"Skipped photo {photo.filename}")
-                        num_skipped += 1
-                    elif result.status == ProcessResultStatus.ERROR:
-                        logger.debug(f"Errored on photo {photo.filename}")
-                        num_error += 1
+                    self._acquire(classifier)
+                    classifications = self._run_classifier(classifier, frame_paths)
+                except ClassifierFailure as e:
+                    return ProcessResult(ProcessResultStatus.ERROR, reason=str(e))
                 except Exception as e:
-                    logger.debug(f"Errored on photo {photo.filename}: {e}")
-                    num_error += 1
-                if not dry_run:
-                    self._update_kvstore(photo)
-                progress.advance(task)
+                    return ProcessResult(ProcessResultStatus.ERROR, reason=f"{type(e).__name__}: {e}")
+                flag = self._flag_for(classifier, aggregate_frames(classifications, self.video_flag_fraction))
+                if flag:
+                    flags.append(flag)
+            return self._result_for(ctx, flags)
+
+    def _fingerprint_batch(self, ctxs: List[PhotoProcessContext]):
+        if not ctxs:
+            return
+
+        def safe_fingerprint(ctx):
+            try:
+                return fingerprint(ctx.preview_path)
+            except OSError as e:
+                logger.debug(f"Could not fingerprint {ctx.preview_path}: {e}")
+                return None
+
+        # hashlib and file reads release the GIL
+        with ThreadPoolExecutor(max_workers=min(8, len(ctxs))) as executor:
+            for ctx, ctx_fingerprint in zip(ctxs, executor.map(safe_fingerprint, ctxs)):
+                ctx.fingerprint = ctx_fingerprint
+
+    def _classify_batch(self, ctxs: List[PhotoProcessContext], pending: List[int], dry_run=False):
+        """
+        Yields (classifier, {ctx index: classification}) for each classifier. Photos whose fingerprint
+        already has a stored result for the classifier, from an earlier run or an earlier copy in this
+        batch, reuse it instead of running inference. New results are stored unless it's a dry run.
+        """
+        if not self.reuse_duplicates:
+            preview_paths = [ctxs[idx].preview_path for idx in pending]
+            for classifier in self._classifier_order():
+                self._acquire(classifier)
+                yield classifier, dict(zip(pending, self._run_classifier(classifier, preview_paths)))
+            return
+
+        self._fingerprint_batch([ctxs[idx] for idx in pending])
+        index = self._get_fingerprints()
+        stored = {
+            ctxs[idx].fingerprint: index.get(ctxs[idx].fingerprint)
+            for idx in pending if ctxs[idx].fingerprint is not None
+        }
+        ran_inference = set()
+
+        for classifier in self._classifier_order():
+            signature = classifier.signature()
+            run = []
+            run_fingerprints = set()
+            for idx in pending:
+                ctx_fingerprint = ctxs[idx].fingerprint
+                if ctx_fingerprint is None:
+                    run.append(idx)
+                elif signature not in stored[ctx_fingerprint] and ctx_fingerprint not in run_fingerprints:
+                    run.append(idx)
+                    run_fingerprints.add(ctx_fingerprint)
+
+            classifications = {}
+            if run:
+                self._acquire(classifier)
+                start = time.perf_counter()
+                results = self._run_classifier(classifier, [ctxs[idx].preview_path for idx in run])
+                self._dedup_stats.record_inference(classifier.name, time.perf_counter() - start, len(run))
+                for idx, classification in zip(run, results):
+                    classifications[idx] = classification
+                    ran_inference.add(idx)
+                    if ctxs[idx].fingerprint is not None:
+                        stored[ctxs[idx].fingerprint][signature] = classification
+
+            for idx in pending:
+                if idx not in classifications:
+                    classifications[idx] = stored[ctxs[idx].fingerprint][signature]
+                    self._dedup_stats.record_hit(classifier.name)
+            yield classifier, classifications
+
+        if not dry_run:
+            for ctx_fingerprint, results in stored.items():
+                index.update(ctx_fingerprint, results)
+        self._dedup_stats.photos_skipped += len(pending) - len(ran_inference)
+
+    def _classifier_order(self):
+        """
+        Runs classifiers whose models are already resident first, most recently used first, so a chunk
+        starts with the model the previous chunk ended with instead of evicting it.
+        """
+        if self.residency is None:
+            return self.classifiers
+        resident = self.residency.resident_order()
+        return sorted(
+            self.classifiers,
+            key=lambda classifier: resident.index(classifier.name) if classifier.name in resident else len(resident)
+        )
 
-        print(f"Processed {num_photos} photos")
-        print(f"Previously processed {num_previously_processed} photos")
-        print(f"Skipped {num_skipped} photos")
-        print(f"Errored on {num_error} photos")
-        print(f"Flagged {num_flagged} photos")
+    def _run_classifier(self, classifier: Classifier, image_paths: List[str]):
+        """
+        Classifies a batch under the watchdog, allowing the classifier's time limit per image, up to
+        BATCH_TIME_LIMIT_IMAGES images.
+
+        A call that times out is abandoned, not stopped: it goes on running on its own thread, on the same
+        model, while later calls run. Inference doesn't modify the model, and shared preprocessing hands
+        each call its own tensors, so the two don't interfere; the abandoned call's results are discarded.
+        If the model is unloaded meanwhile, the abandoned call fails on its own and that is discarded too.
+        :raises ClassifierFailure: If the classifier raised or timed out.
+        """
+        time_limit = self.time_limits.get(classifier.name, classifier.time_limit)
+        start = time.perf_counter()
+        try:
+            results = self._watchdog.run(
+                self._classify_batch_threaded,
+                classifier,
+                image_paths,
+                timeout=time_limit * min(len(image_paths), BATCH_TIME_LIMIT_IMAGES) if time_limit else None
+            )
+        except Exception as e:
+            raise ClassifierFailure(f"{classifier.name}: {type(e).__name__}: {e}") from e
+        # Throughput under the governor's caps says nothing about the tuned settings
+        if self.governor is None or not self.governor.throttled:
+            self._throughput.record(classifier, len(image_paths), time.perf_counter() - start)
+        return results
+
+    @staticmethod
+    def _classify_batch_threaded(classifier: Classifier, image_paths: List[str]):
+        """
+        Sets the classifier's thread count on the thread that runs it: torch keeps a thread count per
+        calling thread, so setting it on the main thread wouldn't reach the watchdog's worker.
+        """
+        classifier.apply_threads()
+        return classifier.classify_batch(image_paths)
+
+    def _acquire(self, classifier: Classifier):
+        """
+        :raises ClassifierFailure: If the classifier's model couldn't be loaded, e.g. a failed download.
+        """
+        if self.residency is not None:
+            try:
+                self.residency.acquire(classifier)
+            except Exception as e:
+                raise ClassifierFailure(f"{classifier.name}: loading: {type(e).__name__}: {e}") from e
+
+    @staticmethod
+    def _flag_for(classifier: Classifier, classification):
+        if not classification:
+            return None
+        if isinstance(classification, bool):
+            return f"flagged_{classifier.name}"
+        return f"flagged_{classifier.name}_{classification}"
+
+    def _process_photo_isolated(self, ctx: PhotoProcessContext) -> ProcessResult:
+        """
+        Processes one photo, turning any failure into an error result for that photo alone.
+        """
+        try:
+            return self._process_photo(ctx)
+        except ClassifierFailure as e:
+            return ProcessResult(ProcessResultStatus.ERROR, reason=str(e))
+        except Exception as e:
+            return ProcessResult(ProcessResultStatus.ERROR, reason=f"{type(e).__name__}: {e}")
 
     def _process_photo(self, ctx: PhotoProcessContext) -> ProcessResult:
         if not ctx.photo.path_derivatives:
-            ctx.logger.debug(f"Skipping {ctx.original_filename}; could not find photo path")
+            ctx.logger.debug(f"Skipping {ctx.photo.original_filename}; could not find photo path")
             return ProcessResult(status=ProcessResultStatus.SKIPPED)
 
         # Use all classifiers to process the photo
         flags = []
-        for classifier in self.classifiers:
-            classification = classifier.classify(ctx.photo.path_derivatives[0])
-            if classification:
-                if isinstance(classification, bool):
-                    flags.append(f"flagged_{classifier.name}")
-                else:
-                    flags.append(f"flagged_{classifier.name}_{classification}")
-
+        for classifier in self._classifier_order():
+            self._acquire(classifier)
+            flag = self._flag_for(classifier, self._run_classifier(classifier, [ctx.preview_path])[0])
+            if flag:
+                flags.append(flag)
+        return self._result_for(ctx, flags)
+
+    def _result_for(self, ctx: PhotoProcessContext, flags: List[str]) -> ProcessResult:
         if len(flags) > 0:
             ctx.logger.debug(f"Image flagged with keywords: {', '.join(flags)}")
             return ProcessResult(ProcessResultStatus.FLAGGED, flags)
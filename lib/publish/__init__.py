@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List
+
+MANIFEST_FILENAME = "publish_manifest.json"
+
+
+def file_sha256(path, block_size=2 ** 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_manifest(staging_dir):
+    """
+    Returns {filename: {"sha256", "bytes"}} for every file in the staging directory.
+    """
+    manifest = {}
+    for name in sorted(os.listdir(staging_dir)):
+        path = os.path.join(staging_dir, name)
+        if name != MANIFEST_FILENAME and os.path.isfile(path):
+            manifest[name] = {"sha256": file_sha256(path), "bytes": os.path.getsize(path)}
+    return manifest
+
+
+class Remote(ABC):
+    """
+    Where models are published. Used as a context manager, so remotes can clean up local state.
+    """
+
+    @abstractmethod
+    def read_manifest(self) -> dict:
+        """
+        Returns the manifest of the last publish, or an empty dict if there isn't one.
+        """
+
+    @abstractmethod
+    def exists(self, name) -> bool:
+        """
+        Whether the remote has a file, published or not.
+        """
+
+    @abstractmethod
+    def commit(self, uploads: Dict[str, str], deletions: List[str], message: str):
+        """
+        Adds or replaces files (remote name -> local path) and deletes others, in a single commit.
+        """
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class GitRemote(Remote):
+    """
+    A plain git repository, such as a local bare repository standing in for the Hub.
+
+    Only the tip of the branch is fetched, without blobs where the server supports partial clones and
+    without a checkout, so the files already on the remote are never downloaded; the manifest blob is
+    fetched on demand.
+    """
+
+    def __init__(self, url, branch="main"):
+        # Plain local paths ignore --depth and --filter; file:// URLs honor them
+        if os.path.isdir(url):
+            url = Path(url).resolve().as_uri()
+        self.branch = branch
+        self.path = tempfile.mkdtemp(prefix="harmonia-publish-")
+        self._git("init", "--quiet")
+        self._git("symbolic-ref", "HEAD", f"refs/heads/{branch}")
+        self._git("remote", "add", "origin", url)
+        self._has_head = bool(self._git("ls-remote", "--heads", "origin", branch).strip())
+        if self._has_head:
+            self._git("fetch", "--quiet", "--depth", "1", "--filter=blob:none", "origin", branch)
+            self._git("update-ref", f"refs/heads/{branch}", "FETCH_HEAD")
+            self._git("read-tree", "HEAD")
+
+    def _git(self, *args):
+        process = subprocess.run(["git", *args], cwd=self.path, capture_output=True, text=True)
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, ["git", *args], process.stdout, process.stderr)
+        return process.stdout
+
+    def read_manifest(self):
+        if not self._has_head:
+            return {}
+        try:
+            return json.loads(self._git("show", f"HEAD:{MANIFEST_FILENAME}"))
+        except subprocess.CalledProcessError:
+            return {}
+
+    def exists(self, name):
+        # ls-tree only reads trees, which the blobless fetch has
+        return self._has_head and bool(self._git("ls-tree", "--name-only", "HEAD", "--", name).strip())
+
+    def commit(self, uploads, deletions, message):
+        for name, local_path in uploads.items():
+            target = os.path.join(self.path, name)
+            try:
+                os.link(local_path, target)
+            except OSError:
+                shutil.copyfile(local_path, target)
+        if uploads:
+            self._git("add", "--", *uploads)
+        if deletions:
+            self._git("rm", "--cached", "--quiet", "--ignore-unmatch", "--", *deletions)
+        try:
+            self._git("commit", "--quiet", "-m", message)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"git commit failed: {e.stderr.strip()}") from e
+        self._git("push", "--quiet", "origin", f"HEAD:refs/heads/{self.branch}")
+        self._has_head = True
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@dataclass
+class PublishResult:
+    uploaded: List[str] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    bytes_uploaded: int = 0
+
+    @property
+    def changed(self):
+        return bool(self.uploaded or self.deleted)
+
+
+def publish(staging_dir, remote: Remote, message, replaces=()) -> PublishResult:
+    """
+    Publishes the files in staging_dir. Only files whose content hash differs from the remote manifest
+    are uploaded, files that are gone from staging_dir are deleted, and nothing is committed when the
+    remote is already up to date.
+
+    :param replaces: Files the published ones supersede, like a legacy model.pth. They're deleted if the
+        remote has them, even though no manifest lists them.
+    """
+    manifest = build_manifest(staging_dir)
+    remote_manifest = remote.read_manifest()
+
+    result = PublishResult(
+        uploaded=[name for name, entry in manifest.items() if remote_manifest.get(name) != entry],
+        deleted=[name for name in remote_manifest if name not in manifest],
+    )
+    result.deleted += [
+        name for name in replaces
+        if name not in manifest and name not in result.deleted and remote.exists(name)
+    ]
+    result.unchanged = [name for name in manifest if name not in result.uploaded]
+    if not result.changed:
+        return result
+
+    with open(os.path.join(staging_dir, MANIFEST_FILENAME), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    uploads = {name: os.path.join(staging_dir, name) for name in [*result.uploaded, MANIFEST_FILENAME]}
+    remote.commit(uploads, result.deleted, message)
+    result.bytes_uploaded = sum(manifest[name]["bytes"] for name in result.uploaded)
+    return result
@@ -0,0 +1,89 @@
+import json
+import os
+
+import torch
+from safetensors.torch import load_file, save_file
+
+DEFAULT_SHARD_SIZE = 2 ** 30
+SINGLE_FILENAME = "model.safetensors"
+INDEX_FILENAME = "model.safetensors.index.json"
+# What models were published as before safetensors; publishing deletes it so consumers can't load a stale copy
+LEGACY_FILENAME = "model.pth"
+
+
+def load_state_dict(model_path):
+    """
+    Memory-maps a torch checkpoint, so tensors are paged in from the file as they're written out
+    instead of being loaded up front. Checkpoints that nest the weights under "state_dict", like
+    Lightning's, are unwrapped.
+    """
+    state_dict = torch.load(model_path, map_location="cpu", mmap=True, weights_only=True)
+    if isinstance(state_dict, dict) and isinstance(state_dict.get("state_dict"), dict):
+        state_dict = state_dict["state_dict"]
+    if not isinstance(state_dict, dict) or not all(isinstance(value, torch.Tensor) for value in state_dict.values()):
+        raise ValueError(f"{model_path} is not a state dict of tensors")
+    return state_dict
+
+
+def _shards(state_dict, shard_size):
+    shard = {}
+    shard_bytes = 0
+    for name, tensor in state_dict.items():
+        tensor_bytes = tensor.numel() * tensor.element_size()
+        if shard and shard_bytes + tensor_bytes > shard_size:
+            yield shard
+            shard = {}
+            shard_bytes = 0
+        shard[name] = tensor
+        shard_bytes += tensor_bytes
+    if shard:
+        yield shard
+
+
+def write_safetensors(state_dict, output_dir, shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Writes a state dict as safetensors shards, one shard at a time, so besides the memory-mapped
+    checkpoint at most one shard is in memory. Tensors fill shards in order, so retraining the same
+    architecture gives the same layout, and shards whose tensors didn't change hash the same.
+
+    :return: The filenames written, including the shard index when there's more than one shard.
+    """
+    shards = list(_shards(state_dict, shard_size))
+    if len(shards) == 1:
+        filenames = [SINGLE_FILENAME]
+    else:
+        filenames = [f"model-{idx + 1:05d}-of-{len(shards):05d}.safetensors" for idx in range(len(shards))]
+
+    weight_map = {}
+    total_size = 0
+    for filename, shard in zip(filenames, shards):
+        tensors = {}
+        storages = set()
+        for name, tensor in shard.items():
+            # safetensors refuses tensors that share memory, like tied weights; give repeats their own copy
+            storage = tensor.untyped_storage().data_ptr()
+            if storage in storages:
+                tensor = tensor.clone()
+            storages.add(storage)
+            tensors[name] = tensor.contiguous()
+            weight_map[name] = filename
+            total_size += tensor.numel() * tensor.element_size()
+        save_file(tensors, os.path.join(output_dir, filename), metadata={"format": "pt"})
+        del tensors
+
+    if len(filenames) > 1:
+        with open(os.path.join(output_dir, INDEX_FILENAME), "w") as f:
+            json.dump({"metadata": {"total_size": total_size}, "weight_map": weight_map}, f, indent=2)
+        filenames.append(INDEX_FILENAME)
+    return filenames
+
+
+def read_safetensors(paths):
+    """
+    Loads a state dict written by write_safetensors from its shard files. The index isn't needed;
+    every tensor lives in exactly one shard.
+    """
+    state_dict = {}
+    for path in paths:
+        state_dict.update(load_file(path, device="cpu"))
+    return state_dict
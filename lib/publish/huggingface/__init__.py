@@ -0,0 +1,61 @@
+import json
+
+import torch
+from huggingface_hub import HfApi, CommitOperationAdd, CommitOperationDelete, hf_hub_download
+from huggingface_hub.utils import EntryNotFoundError
+
+from lib.publish import Remote, MANIFEST_FILENAME
+from lib.publish.convert import INDEX_FILENAME, LEGACY_FILENAME, SINGLE_FILENAME, read_safetensors
+
+
+class HuggingFaceRemote(Remote):
+    """
+    A Hugging Face Hub model repository. Changes go up as one commit over the Hub's HTTP API,
+    so nothing is cloned and only the changed files are transferred.
+    """
+
+    def __init__(self, repo_id, token=None, revision="main"):
+        self.repo_id = repo_id
+        self.token = token
+        self.revision = revision
+        self.api = HfApi(token=token)
+        self.api.create_repo(repo_id, exist_ok=True)
+
+    def read_manifest(self):
+        try:
+            path = hf_hub_download(self.repo_id, MANIFEST_FILENAME, revision=self.revision, token=self.token)
+        except EntryNotFoundError:
+            return {}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def exists(self, name):
+        return self.api.file_exists(self.repo_id, name, revision=self.revision)
+
+    def commit(self, uploads, deletions, message):
+        operations = [
+            CommitOperationAdd(path_in_repo=name, path_or_fileobj=local_path) for name, local_path in uploads.items()
+        ]
+        operations += [CommitOperationDelete(path_in_repo=name) for name in deletions]
+        self.api.create_commit(self.repo_id, operations, commit_message=message, revision=self.revision)
+
+
+def download_state_dict(repo_id, revision=None):
+    """
+    Downloads the state dict of a model published with lib.publish, single-file or sharded. Repos last
+    published before safetensors fall back to their model.pth.
+    """
+    try:
+        index_path = hf_hub_download(repo_id, INDEX_FILENAME, revision=revision)
+    except EntryNotFoundError:
+        index_path = None
+    if index_path is not None:
+        with open(index_path, "r") as f:
+            filenames = sorted(set(json.load(f)["weight_map"].values()))
+        return read_safetensors([hf_hub_download(repo_id, filename, revision=revision) for filename in filenames])
+
+    try:
+        return read_safetensors([hf_hub_download(repo_id, SINGLE_FILENAME, revision=revision)])
+    except EntryNotFoundError:
+        pass
+    return torch.load(hf_hub_download(repo_id, LEGACY_FILENAME, revision=revision), map_location="cpu")
@@ -0,0 +1,62 @@
+import datetime
+import json
+
+from osxphotos.sqlitekvstore import SQLiteKVStore
+
+BASE_BACKOFF = datetime.timedelta(hours=6)
+MAX_BACKOFF = datetime.timedelta(days=30)
+# After this many failures a photo stays quarantined until it's released by hand (or --reset)
+MAX_FAILURES = 5
+
+
+class Quarantine:
+    """
+    Tracks photos that failed or timed out during classification, with the reason.
+
+    A quarantined photo is skipped until its retry time, which backs off exponentially with each
+    failure; after MAX_FAILURES it's no longer retried.
+    """
+
+    def __init__(self, db_path):
+        self._kvstore = SQLiteKVStore(
+            db_path,
+            wal=True,
+            serialize=json.dumps,
+            deserialize=json.loads
+        )
+
+    def get(self, uuid):
+        return self._kvstore.get(uuid)
+
+    def is_blocked(self, uuid, now=None):
+        """
+        Whether a photo is quarantined and not yet due for a retry.
+        """
+        record = self._kvstore.get(uuid)
+        if record is None:
+            return False
+        if record["retry_after"] is None:
+            return True
+        now = now or datetime.datetime.now()
+        return datetime.datetime.fromisoformat(record["retry_after"]) > now
+
+    def record_failure(self, uuid, reason):
+        record = self._kvstore.get(uuid) or {"uuid": uuid, "failures": 0}
+        now = datetime.datetime.now()
+        record["failures"] += 1
+        record["reason"] = reason
+        record["last_failure"] = now.isoformat()
+        if record["failures"] >= MAX_FAILURES:
+            record["retry_after"] = None
+        else:
+            backoff = min(BASE_BACKOFF * 2 ** (record["failures"] - 1), MAX_BACKOFF)
+            record["retry_after"] = (now + backoff).isoformat()
+        self._kvstore.set(uuid, record)
+        return record
+
+    def release(self, uuid):
+        if self._kvstore.get(uuid) is not None:
+            self._kvstore.delete(uuid)
+
+    def close(self):
+        self._kvstore.close()
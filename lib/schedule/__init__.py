@@ -0,0 +1,92 @@
+import json
+import os
+import time
+
+PRIORITIES = ("library", "newest", "favorites", "albums")
+
+# Weight of the latest chunk in the running throughput estimate
+THROUGHPUT_SMOOTHING = 0.3
+
+
+def _priority_key(priority, priority_albums):
+    if priority == "newest":
+        return lambda photo: -photo.date.timestamp()
+    if priority == "favorites":
+        return lambda photo: (not photo.favorite, -photo.date.timestamp())
+    if priority == "albums":
+        rank = {album: idx for idx, album in enumerate(priority_albums or [])}
+        return lambda photo: min((rank[album] for album in photo.albums if album in rank), default=len(rank))
+    return None
+
+
+class RunSchedule:
+    """
+    Orders a run's photos by priority and stops it cleanly when its time budget runs out.
+
+    Photos left over when a run stops are saved and go first in the next run. Throughput is measured
+    per chunk and kept across runs, to decide whether another chunk fits in the budget and to estimate
+    how long the remaining work will take.
+    """
+
+    def __init__(self, state_path, time_budget=None):
+        """
+        :param state_path: JSON file the remaining queue and measured throughput are kept in.
+        :param time_budget: Seconds the run may take, or None for no limit.
+        """
+        self.state_path = state_path
+        self.deadline = time.monotonic() + time_budget if time_budget else None
+        self._state = {}
+        if os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                self._state = json.load(f)
+
+    @property
+    def photos_per_second(self):
+        return self._state.get("photos_per_second")
+
+    def order(self, photos, priority="library", priority_albums=None):
+        """
+        Returns the photos with the previous run's remaining queue first, then the rest by priority.
+        """
+        key = _priority_key(priority, priority_albums)
+        if key is not None:
+            photos = sorted(photos, key=key)
+
+        queue = {uuid: idx for idx, uuid in enumerate(self._state.get("remaining", []))}
+        if not queue:
+            return list(photos)
+        return sorted(photos, key=lambda photo: queue.get(photo.uuid, len(queue)))
+
+    def record(self, num_photos, seconds):
+        """
+        Record how long a chunk of classified photos took.
+        """
+        if num_photos == 0 or seconds <= 0:
+            return
+        measured = num_photos / seconds
+        previous = self.photos_per_second
+        self._state["photos_per_second"] = (
+            measured if previous is None
+            else THROUGHPUT_SMOOTHING * measured + (1 - THROUGHPUT_SMOOTHING) * previous
+        )
+
+    def has_time_for(self, num_photos):
+        """
+        Whether the given number of photos is expected to finish before the deadline.
+        """
+        if self.deadline is None:
+            return True
+        remaining = self.deadline - time.monotonic()
+        if self.photos_per_second is None:
+            return remaining > 0
+        return remaining >= num_photos / self.photos_per_second
+
+    def estimate_seconds(self, num_photos):
+        return num_photos / self.photos_per_second if self.photos_per_second else None
+
+    def save(self, remaining_uuids):
+        self._state["remaining"] = list(remaining_uuids)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.state_path)
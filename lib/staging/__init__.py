@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_STAGING_BYTES = 2 * 1024 ** 3
+COPY_BUFFER_BYTES = 4 * 1024 ** 2
+
+
+class DirectoryIndex:
+    """
+    Answers existence checks for many files from one listing per directory, instead of a stat per file.
+
+    Photos keeps derivatives in a handful of directories, so a whole library's worth of previews is checked
+    with a few reads. Listings are kept for the run; a path missing from its listing is stat'ed, since Photos
+    may have written it after the listing was taken.
+    """
+
+    def __init__(self):
+        self._listings = {}
+
+    def _listing(self, directory):
+        if directory not in self._listings:
+            try:
+                with os.scandir(directory) as entries:
+                    # inode() comes from the directory entry itself, without a stat
+                    self._listings[directory] = {entry.name: entry.inode() for entry in entries}
+            except OSError:
+                self._listings[directory] = {}
+        return self._listings[directory]
+
+    def existing(self, paths):
+        """
+        Returns {path: inode} for the paths that exist.
+        """
+        found = {}
+        for path in paths:
+            directory, name = os.path.split(path)
+            listing = self._listing(directory)
+            if name not in listing:
+                try:
+                    listing[name] = os.stat(path).st_ino
+                except OSError:
+                    continue
+            found[path] = listing[name]
+        return found
+
+    def locality_key(self, path):
+        """
+        Sort key approximating on-disk order: by directory, then by inode, which file systems like APFS
+        and HFS+ allocate roughly in creation order.
+        """
+        directory, name = os.path.split(path)
+        return directory, self._listing(directory).get(name, 0)
+
+
+class StagingCache:
+    """
+    Copies previews from a slow volume, like a library on an external USB drive, to a size-bounded local
+    directory ahead of classification, so classifiers read them from fast local storage.
+
+    Files are copied by one background thread, in locality order, so the slow volume sees long runs of
+    sequential reads instead of random ones. Staged copies are deleted once released. A file that doesn't
+    fit in the budget isn't staged; it's read from its original location instead.
+    """
+
+    def __init__(self, staging_dir=None, max_bytes=DEFAULT_STAGING_BYTES):
+        """
+        :param staging_dir: Where to keep copies, e.g. a RAM disk. Defaults to the system temp directory.
+        :param max_bytes: Most bytes staged at once.
+        """
+        self.path = tempfile.mkdtemp(
+            prefix="harmonia-staging-",
+            dir=os.path.expanduser(staging_dir) if staging_dir else None
+        )
+        self.max_bytes = max_bytes
+        self.index = DirectoryIndex()
+        self.staged_files = 0
+        self.staged_bytes = 0
+        self.copy_seconds = 0.0
+        self._staged = {}  # source path -> (local path, size)
+        self._pending = {}  # source path -> Future of the batch staging it
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counter = 0
+        # One copier keeps reads from the slow volume sequential
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="staging")
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, ignore_errors=True)
+
+    def _copy(self, source):
+        with open(source, "rb") as src:
+            size = os.fstat(src.fileno()).st_size
+            with self._lock:
+                if self._bytes + size > self.max_bytes:
+                    return
+                self._bytes += size
+                self._counter += 1
+                local_path = os.path.join(self.path, f"{self._counter}-{os.path.basename(source)}")
+            try:
+                with open(local_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, COPY_BUFFER_BYTES)
+            except OSError:
+                with self._lock:
+                    self._bytes -= size
+                if os.path.exists(local_path):
+                    os.remove(local_path)
+                raise
+        with self._lock:
+            self._staged[source] = (local_path, size)
+            self.staged_files += 1
+            self.staged_bytes += size
+
+    def _copy_batch(self, sources):
+        start = time.perf_counter()
+        for source in sources:
+            try:
+                self._copy(source)
+            except OSError:
+                # The classifiers read it from the source instead, and report it there if it's unreadable
+                pass
+        with self._lock:
+            self.copy_seconds += time.perf_counter() - start
+
+    def prefetch(self, paths):
+        """
+        Starts staging paths in the background, in locality order.
+        """
+        with self._lock:
+            sources = [path for path in dict.fromkeys(paths) if path not in self._staged and path not in self._pending]
+        if not sources:
+            return
+        sources.sort(key=self.index.locality_key)
+        future = self._executor.submit(self._copy_batch, sources)
+        with self._lock:
+            for source in sources:
+                self._pending[source] = future
+
+    def fetch(self, paths):
+        """
+        Stages the paths that aren't already, waiting for any being staged in the background.
+        :return: {source path: local copy} for the paths that were staged.
+        """
+        self.prefetch(paths)
+        with self._lock:
+            futures = {self._pending.pop(path) for path in paths if path in self._pending}
+        for future in futures:
+            future.result()
+        with self._lock:
+            return {path: self._staged[path][0] for path in paths if path in self._staged}
+
+    def release(self, paths):
+        """
+        Deletes the local copies of paths, making room for more.
+        """
+        for path in paths:
+            with self._lock:
+                staged = self._staged.pop(path, None)
+                if staged is None:
+                    continue
+                self._bytes -= staged[1]
+            try:
+                os.remove(staged[0])
+            except OSError:
+                pass
+
+    def clear(self):
+        """
+        Waits for background copies and deletes every staged file.
+        """
+        with self._lock:
+            futures = set(self._pending.values())
+            self._pending.clear()
+        for future in futures:
+            future.result()
+        with self._lock:
+            paths = list(self._staged)
+        self.release(paths)
@@ -1,32 +1,87 @@
+import hashlib
+import json
 import os
 import random
+import shutil
+import tempfile
+import time
+from contextlib import nullcontext
 
+import numpy as np
 import torch
-from PIL import Image
-from sklearn.model_selection import train_test_split
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from osxphotos.cli.common import get_data_dir
 from torch.nn import CrossEntropyLoss
-from torch.utils.data import Dataset, DataLoader
-from torchvision import transforms
-from transformers import ViTForImageClassification, AdamW, AutoImageProcessor
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Dataset, DataLoader, DistributedSampler
+from transformers import ViTForImageClassification, ViTModel, AdamW, AutoImageProcessor
 
+from lib.classify.preprocess import ProcessorConfig
+from lib.image_cache import ImageCache
 from lib.osxphotos_utils import construct_query_options
 from lib.photoflagger import PhotoFlagger
+from lib.train.probe import FeatureCache, fit_logistic_head, export_probe
 
+TRAINING_MODES = ("finetune", "linear_probe")
+VALIDATION_FRACTION = 0.2
+MANIFEST_FILENAME = "training_manifest.json"
+SCALING_REPORT_FILENAME = "scaling_report.json"
+BATCH_SIZE = 32
+# Batches timed when measuring single-process throughput for the scaling report
+CALIBRATION_BATCHES = 5
 
-class CustomDataset(Dataset):
-    def __init__(self, data, transform=None):
+
+def _bf16_autocast_supported():
+    """
+    Whether this CPU has native bf16 kernels (e.g. AVX512-BF16 or AMX); elsewhere autocast would
+    only add conversion overhead.
+    """
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def _save_atomic(obj, path):
+    tmp_path = f"{path}.tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class CachedImageDataset(Dataset):
+    """
+    Serves (image tensor, label) pairs from an ImageCache.
+
+    Only the path of the memory-mapped cache is pickled, so each DataLoader worker opens its own
+    read-only view instead of copying the images into every process.
+    """
+    def __init__(self, cache: ImageCache, data, mean, std):
+        # data is a list of (uuid, cache slot, label) tuples
         self.data = data
-        self.transform = transform
+        self.images_path = cache.images_path
+        self.shape = (cache.capacity, *cache.item_shape)
+        self.mean = torch.tensor(mean).view(3, 1, 1)
+        self.std = torch.tensor(std).view(3, 1, 1)
+        self._images = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
 
     def __len__(self):
         return len(self.data)
 
     def __getitem__(self, idx):
-        image_path, label = self.data[idx]
-        image = Image.open(image_path).convert("RGB")
-        if self.transform:
-            image = self.transform(image)
-        return image, label
+        if self._images is None:
+            self._images = np.memmap(self.images_path, dtype=np.uint8, mode="r", shape=self.shape)
+        _, slot, label = self.data[idx]
+        if isinstance(label, tuple):
+            # One label per task for multi-task training
+            label = torch.tensor(label)
+        image = torch.from_numpy(np.array(self._images[slot])).permute(2, 0, 1).float().div_(255)
+        return (image - self.mean) / self.std, label
 
 
 class ModelTuner:
@@ -34,13 +89,30 @@ class ModelTuner:
     A very osxphotos-specific model fine-tuner.
     Allows you to create albums for training in Apple Photos directly and pass a mapping of labels to these albums.
     """
+    learning_rate = 5e-5
+
     def __init__(
         self,
         verbose_mode,
         library_path,
         output_path="/tmp/classifier",
-        base_model="google/vit-base-patch16-224"
+        base_model="google/vit-base-patch16-224",
+        cache_dir=None,
+        num_workers=0,
+        pin_memory=False,
+        mode="finetune",
+        compare_model=None,
+        checkpoint_every=1,
+        resume=True,
+        early_stopping_patience=None,
+        mixed_precision=True,
+        incremental=False,
+        replay_ratio=1.0,
+        incremental_tolerance=0.02,
+        processes=1
     ):
+        if mode not in TRAINING_MODES:
+            raise ValueError(f"Unknown training mode '{mode}', expected one of {', '.join(TRAINING_MODES)}")
         self.processor = PhotoFlagger(
             keystore_name="training",
             verbose_mode=verbose_mode,
@@ -53,9 +125,71 @@ class ModelTuner:
         self.optimizer = None
         self.criterion = CrossEntropyLoss()
         self.base_model = base_model
+        self.cache_dir = cache_dir or os.path.join(get_data_dir(), "image_cache")
+        self._configure_inputs(base_model)
+        self.num_workers = num_workers
+        self.pin_memory = pin_memory
+        self.mode = mode
+        self.compare_model = os.path.expanduser(compare_model) if compare_model else None
+        self.checkpoint_dir = os.path.join(self.output_path, "checkpoints")
+        self.checkpoint_every = checkpoint_every
+        self.resume = resume
+        self.early_stopping_patience = early_stopping_patience
+        self.use_bf16 = mixed_precision and self.device.type == "cpu" and _bf16_autocast_supported()
+        self.incremental = incremental
+        self.replay_ratio = replay_ratio
+        self.incremental_tolerance = incremental_tolerance
+        self.processes = processes
+        # Set in each process of a distributed run
+        self._rank = 0
+        self._world_size = 1
+        self._train_samples = 0
+        self._train_seconds = 0.0
+
+    def __getstate__(self):
+        # Sent to the processes of a distributed run, which don't need the Photos library or a model yet
+        state = self.__dict__.copy()
+        state["processor"] = None
+        state["model"] = None
+        state["optimizer"] = None
+        return state
+
+    @property
+    def _is_main(self):
+        return self._rank == 0
+
+    def _unwrapped(self):
+        return self.model.module if isinstance(self.model, DistributedDataParallel) else self.model
 
-    def _get_preview_paths(self, album_name: str):
-        return self.processor.get_preview_paths(construct_query_options(album=[album_name]))
+    def _configure_inputs(self, base_model):
+        """
+        Sets up the image cache and normalization to match the base model's processor, so training sees
+        the same inputs as inference.
+        """
+        processor = AutoImageProcessor.from_pretrained(base_model)
+        self.image_mean, self.image_std = processor.image_mean, processor.image_std
+        processor_config = ProcessorConfig.from_processor(processor)
+        if processor_config is not None and processor_config.height == processor_config.width:
+            self.image_cache = ImageCache(self.cache_dir, size=processor_config.height, resample=processor_config.resample)
+        else:
+            self.image_cache = ImageCache(self.cache_dir)
+
+    def _get_preview_records(self, album_name: str):
+        return self.processor.get_preview_records(construct_query_options(album=[album_name]))
+
+    def _dataset(self, data):
+        return CachedImageDataset(self.image_cache, data, self.image_mean, self.image_std)
+
+    def _make_loader(self, dataset, shuffle=False, sampler=None):
+        return DataLoader(
+            dataset,
+            batch_size=BATCH_SIZE,
+            shuffle=shuffle and sampler is None,
+            sampler=sampler,
+            num_workers=self.num_workers,
+            pin_memory=self.pin_memory,
+            persistent_workers=self.num_workers > 0
+        )
 
     def _validate_model(self, val_loader):
         self.model.eval()
@@ -63,70 +197,317 @@ class ModelTuner:
         total = 0
         with torch.no_grad():
             for images, labels in val_loader:
-                images = images.to(self.device)
-                labels = labels.to(self.device)
-                outputs = self.model(images).logits
+                images = images.to(self.device, non_blocking=self.pin_memory)
+                labels = labels.to(self.device, non_blocking=self.pin_memory)
+                with self._autocast():
+                    outputs = self.model(images).logits
                 predictions = torch.argmax(outputs, dim=1)
                 correct += (predictions == labels).sum().item()
                 total += labels.size(0)
 
-        print(f"Validation Accuracy: {correct / total * 100:.2f}%")
+        accuracy = correct / total if total else 0.0
+        print(f"Validation Accuracy: {accuracy * 100:.2f}%")
+        return accuracy
 
-    def _prepare_datasets(self, label_album_mapping):
+    def _validate_on_main(self, val_loader):
+        """
+        Validates in the first process only, with the model unwrapped so no collective runs during the
+        forward passes, and shares the accuracy so every process takes the same early-stopping decision.
+        """
+        if self._world_size == 1:
+            return self._validate_model(val_loader)
+        accuracy = torch.zeros(1, dtype=torch.float64)
+        if self._is_main:
+            wrapped, self.model = self.model, self._unwrapped()
+            try:
+                accuracy[0] = self._validate_model(val_loader)
+            finally:
+                self.model = wrapped
+        dist.broadcast(accuracy, src=0)
+        return accuracy.item()
+
+    def _collect_labeled_data(self, label_album_mapping):
+        """
+        Returns a list of (uuid, cache slot, label) tuples for every photo in the training albums,
+        and the label -> id mapping.
+        """
         labeled_data = []
         label_mapping = {label: idx for idx, (label, _) in enumerate(label_album_mapping)}
 
-        # Collect and label data
+        # Images are decoded and resized once into the cache, and only re-decoded when the preview on disk changes.
         for label, album_name in label_album_mapping:
-            paths = self._get_preview_paths(album_name)
-            labeled_data.extend([(path, label_mapping[label]) for path in paths])
+            records = self._get_preview_records(album_name)
+            slots = self.image_cache.add(records)
+            labeled_data.extend([
+                (uuid, slot, label_mapping[label]) for (uuid, _), slot in zip(records, slots) if slot is not None
+            ])
 
-        random.shuffle(labeled_data)
+        return labeled_data, label_mapping
 
-        # Define transformations for the dataset
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),  # Resize to match model input size
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ])
+    @staticmethod
+    def _split_hash(uuid):
+        return int(hashlib.sha1(uuid.encode()).hexdigest()[:8], 16)
+
+    @classmethod
+    def _is_validation(cls, uuid):
+        return cls._split_hash(uuid) < VALIDATION_FRACTION * 0x100000000
+
+    def _split(self, labeled_data):
+        # Split the data into training and validation sets by a hash of the photo UUID, so each photo lands
+        # on the same side on every run: a resumed or incremental run never validates on photos it trained on.
+        if len(labeled_data) < 2:
+            raise ValueError(f"Found {len(labeled_data)} labeled photos; at least 2 are needed to train and validate")
+        train_data = [item for item in labeled_data if not self._is_validation(item[0])]
+        val_data = [item for item in labeled_data if self._is_validation(item[0])]
+        if not val_data:
+            # Small albums can hash entirely to the training side; the photo closest to the cut validates
+            closest = min(train_data, key=lambda item: self._split_hash(item[0]))
+            train_data.remove(closest)
+            val_data.append(closest)
+        random.shuffle(train_data)
+        return train_data, val_data
+
+    def _autocast(self):
+        if self.use_bf16:
+            return torch.autocast(device_type="cpu", dtype=torch.bfloat16)
+        return nullcontext()
+
+    def _save_checkpoint(self, epoch, label_mapping, best_accuracy, epochs_without_improvement):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        _save_atomic({
+            "epoch": epoch,
+            "label_mapping": label_mapping,
+            "model": self._unwrapped().state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "best_accuracy": best_accuracy,
+            "epochs_without_improvement": epochs_without_improvement,
+        }, os.path.join(self.checkpoint_dir, "last.pt"))
+
+    def _load_checkpoint(self, label_mapping):
+        """
+        Restores model and optimizer state from the last checkpoint of an interrupted run.
+        :return: The checkpoint, or None if there is nothing to resume.
+        """
+        path = os.path.join(self.checkpoint_dir, "last.pt")
+        if not self.resume or not os.path.exists(path):
+            return None
+        checkpoint = torch.load(path, map_location=self.device)
+        if checkpoint["label_mapping"] != label_mapping:
+            print(f"Ignoring checkpoint {path}: it was trained on different labels")
+            return None
+        self._unwrapped().load_state_dict(checkpoint["model"])
+        self.optimizer.load_state_dict(checkpoint["optimizer"])
+        print(f"Resuming from epoch {checkpoint['epoch'] + 1}")
+        return checkpoint
+
+    def _load_manifest(self):
+        path = os.path.join(self.output_path, MANIFEST_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _save_manifest(self, train_data, label_mapping, accuracy):
+        """
+        Records which photos (and with which labels) the saved model has been trained on.
+        """
+        with open(os.path.join(self.output_path, MANIFEST_FILENAME), "w") as f:
+            json.dump({
+                "base_model": self.base_model,
+                "label_mapping": label_mapping,
+                "validation_accuracy": accuracy,
+                "seen": {uuid: label for uuid, _, label in train_data},
+            }, f)
 
-        # Split the data into training and validation sets
-        train_data, val_data = train_test_split(labeled_data, test_size=0.2, random_state=42)
-        train_dataset = CustomDataset(train_data, transform=transform)
-        val_dataset = CustomDataset(val_data, transform=transform)
+    def _train_incremental(self, train_data, val_loader, label_mapping, epochs):
+        """
+        Warm-starts from the model already at output_path and trains on the photos it hasn't seen,
+        plus a replay sample of ones it has, so it doesn't forget them.
+        :return: True if the saved model is up to date; False if a full retrain is needed.
+        """
+        manifest = self._load_manifest()
+        if manifest is None or manifest["label_mapping"] != label_mapping or manifest["base_model"] != self.base_model:
+            print("No compatible previously trained model; running a full training run")
+            return False
 
-        train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
-        val_loader = DataLoader(val_dataset, batch_size=32)
+        seen = manifest["seen"]
+        new_data = [item for item in train_data if seen.get(item[0]) != item[2]]
+        if not new_data:
+            print(f"No new training photos; {self.output_path} is up to date")
+            return True
 
-        return train_loader, val_loader, label_mapping
+        old_data = [item for item in train_data if seen.get(item[0]) == item[2]]
+        replay_data = random.sample(old_data, min(len(old_data), int(len(new_data) * self.replay_ratio)))
+        print(f"Training on {len(new_data)} new photos and {len(replay_data)} previously seen photos")
+
+        self.model = ViTForImageClassification.from_pretrained(self.output_path).to(self.device)
+        previous_accuracy = self._validate_model(val_loader)
+
+        train_loader = self._make_loader(self._dataset(new_data + replay_data), shuffle=True)
+        accuracy = self._fit(train_loader, val_loader, label_mapping, epochs)
+        if accuracy < previous_accuracy - self.incremental_tolerance:
+            print(
+                f"Validation accuracy dropped from {previous_accuracy * 100:.2f}% to {accuracy * 100:.2f}%; "
+                f"falling back to a full training run"
+            )
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+            return False
+
+        self._save_model()
+        self._save_manifest(train_data, label_mapping, accuracy)
+        return True
 
     def train(self, label_album_mapping, epochs=5):
-        train_loader, val_loader, label_mapping = self._prepare_datasets(label_album_mapping)
+        if self.mode == "linear_probe":
+            return self._train_linear_probe(label_album_mapping)
+
+        labeled_data, label_mapping = self._collect_labeled_data(label_album_mapping)
+        train_data, val_data = self._split(labeled_data)
+        val_loader = self._make_loader(self._dataset(val_data))
+
+        if self.incremental and self._train_incremental(train_data, val_loader, label_mapping, epochs):
+            return
 
-        num_labels = len(label_mapping)
+        if self.processes > 1:
+            return self._train_distributed(train_data, val_data, label_mapping, epochs)
 
+        train_loader = self._make_loader(self._dataset(train_data), shuffle=True)
+        self.model = self._new_model(label_mapping).to(self.device)
+
+        accuracy = self._fit(train_loader, val_loader, label_mapping, epochs)
+        self._save_model()
+        self._save_manifest(train_data, label_mapping, accuracy)
+
+    def _new_model(self, label_mapping):
         # Initialize model with the correct number of labels
-        self.model = ViTForImageClassification.from_pretrained(
+        return ViTForImageClassification.from_pretrained(
             self.base_model,
-            num_labels=num_labels,
+            num_labels=len(label_mapping),
             id2label={v: k for k, v in label_mapping.items()},
             label2id=label_mapping,
             ignore_mismatched_sizes=True
-        ).to(self.device)
+        )
 
-        self.optimizer = AdamW(self.model.parameters(), lr=5e-5)
+    def _threads_per_process(self):
+        return max(1, (os.cpu_count() or 1) // self.processes)
+
+    def _calibrate(self, train_data, label_mapping, threads):
+        """
+        Measures single-process training throughput, in samples per second, with the given number of threads.
+        """
+        sample = train_data[:(CALIBRATION_BATCHES + 1) * BATCH_SIZE]
+        previous_threads = torch.get_num_threads()
+        torch.set_num_threads(threads)
+        self.model = self._new_model(label_mapping)
+        self.model.train()
+        optimizer = AdamW(self.model.parameters(), lr=self.learning_rate)
+        try:
+            samples = 0
+            start = None
+            for batch, (images, labels) in enumerate(self._make_loader(self._dataset(sample))):
+                # The first batch pays for allocator and kernel warm-up
+                if batch == 1:
+                    start = time.perf_counter()
+                if batch >= 1:
+                    samples += images.size(0)
+                loss = self._loss(images, labels)
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+            return samples / (time.perf_counter() - start) if start is not None else None
+        finally:
+            self.model = None
+            torch.set_num_threads(previous_threads)
+
+    def _train_distributed(self, train_data, val_data, label_mapping, epochs):
+        """
+        Data-parallel training on this host: one process per shard of the training data, with gradients
+        averaged across processes by DistributedDataParallel over gloo. Only the first process validates,
+        writes checkpoints and saves the model. Reports scaling efficiency against single-process training.
+        """
+        # gloo is CPU-only
+        self.device = torch.device("cpu")
+        threads = self._threads_per_process()
+        print("Calibrating single-process throughput")
+        single_all_threads = self._calibrate(train_data, label_mapping, os.cpu_count() or 1)
+        single_per_process = self._calibrate(train_data, label_mapping, threads)
+
+        print(f"Training with {self.processes} processes of {threads} threads each")
+        context = mp.get_context("spawn")
+        results = context.SimpleQueue()
+        with tempfile.TemporaryDirectory(prefix="harmonia-ddp-") as rendezvous_dir:
+            mp.spawn(
+                _distributed_worker,
+                args=(self, os.path.join(rendezvous_dir, "init"), train_data, val_data, label_mapping, epochs, results),
+                nprocs=self.processes,
+                join=True
+            )
+        train_samples, train_seconds = results.get()
+        if train_seconds:
+            self._report_scaling(train_samples / train_seconds, single_all_threads, single_per_process, threads)
+
+    def _report_scaling(self, distributed, single_all_threads, single_per_process, threads):
+        report = {
+            "processes": self.processes,
+            "threads_per_process": threads,
+            "distributed_samples_per_second": distributed,
+            "single_process_samples_per_second": single_all_threads,
+            "speedup": distributed / single_all_threads if single_all_threads else None,
+            # 1.0 means N processes train N times as fast as one process with the same threads
+            "scaling_efficiency": distributed / (self.processes * single_per_process) if single_per_process else None,
+        }
+        with open(os.path.join(self.output_path, SCALING_REPORT_FILENAME), "w") as f:
+            json.dump(report, f, indent=2)
+
+        print(f"Distributed training: {distributed:.1f} samples/s")
+        if report["speedup"] is not None:
+            print(f"Speedup over one process using every core: {report['speedup']:.2f}x")
+        if report["scaling_efficiency"] is not None:
+            print(f"Scaling efficiency: {report['scaling_efficiency'] * 100:.0f}%")
+
+    def _loss(self, images, labels):
+        with self._autocast():
+            outputs = self.model(images).logits
+        return self.criterion(outputs.float(), labels)
+
+    def _fit(self, train_loader, val_loader, label_mapping, epochs):
+        """
+        Runs the training loop with checkpointing and early stopping, leaving the best weights in self.model.
+        :return: The validation accuracy of those weights.
+        """
+        self.optimizer = AdamW(self.model.parameters(), lr=self.learning_rate)
+
+        start_epoch = 0
+        best_accuracy = -1.0
+        epochs_without_improvement = 0
+        checkpoint = self._load_checkpoint(label_mapping)
+        if checkpoint is not None:
+            start_epoch = checkpoint["epoch"] + 1
+            best_accuracy = checkpoint["best_accuracy"]
+            epochs_without_improvement = checkpoint["epochs_without_improvement"]
+        if self._world_size > 1:
+            # Every process has read the checkpoint before the first one replaces it
+            dist.barrier()
+        if checkpoint is None and self._is_main:
+            # Don't let best weights from an abandoned run leak into this one
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        best_path = os.path.join(self.checkpoint_dir, "best.pt")
+        sampler = train_loader.sampler
 
         # Training loop
-        for epoch in range(epochs):
+        for epoch in range(start_epoch, epochs):
+            if isinstance(sampler, DistributedSampler):
+                # Reshuffle the shards differently every epoch
+                sampler.set_epoch(epoch)
             self.model.train()
             total_loss = 0
+            epoch_start = time.perf_counter()
             for images, labels in train_loader:
-                images = images.to(self.device)
-                labels = labels.to(self.device)
+                images = images.to(self.device, non_blocking=self.pin_memory)
+                labels = labels.to(self.device, non_blocking=self.pin_memory)
 
                 # Forward pass
-                outputs = self.model(images).logits
-                loss = self.criterion(outputs, labels)
+                loss = self._loss(images, labels)
 
                 # Backward pass
                 self.optimizer.zero_grad()
@@ -134,15 +515,166 @@ class ModelTuner:
                 self.optimizer.step()
 
                 total_loss += loss.item()
+                self._train_samples += images.size(0)
+            self._train_seconds += time.perf_counter() - epoch_start
+
+            if self._is_main:
+                print(f"Epoch {epoch + 1}/{epochs}, Loss: {total_loss / len(train_loader)}")
 
-            print(f"Epoch {epoch + 1}/{epochs}, Loss: {total_loss / len(train_loader)}")
+            # Validate the model, keeping the weights from the best epoch
+            accuracy = self._validate_on_main(val_loader)
+            if accuracy > best_accuracy:
+                best_accuracy = accuracy
+                epochs_without_improvement = 0
+                if self._is_main:
+                    os.makedirs(self.checkpoint_dir, exist_ok=True)
+                    _save_atomic(self._unwrapped().state_dict(), best_path)
+            else:
+                epochs_without_improvement += 1
 
-            # Validate the model
-            self._validate_model(val_loader)
+            stop_early = (
+                self.early_stopping_patience is not None
+                and epochs_without_improvement >= self.early_stopping_patience
+            )
+            checkpoint_due = stop_early or (self.checkpoint_every and (epoch + 1) % self.checkpoint_every == 0)
+            if checkpoint_due and self._is_main:
+                self._save_checkpoint(epoch, label_mapping, best_accuracy, epochs_without_improvement)
+            if stop_early:
+                if self._is_main:
+                    print(f"No improvement for {epochs_without_improvement} epochs; stopping early")
+                break
 
+        # Only the first process keeps the best weights; it's the one that saves the model
+        if self._is_main and os.path.exists(best_path):
+            print(f"Restoring best weights (Validation Accuracy: {best_accuracy * 100:.2f}%)")
+            self._unwrapped().load_state_dict(torch.load(best_path, map_location=self.device))
+        return best_accuracy
+
+    def _save_model(self):
         # Save the model and processor
         self.model.save_pretrained(self.output_path)
         processor = AutoImageProcessor.from_pretrained(self.base_model)
         processor.save_pretrained(self.output_path)
 
+        # The run finished, so there's nothing left to resume
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+        print(f"Model and processor saved to {self.output_path}")
+
+    def _processor_stats(self, model_name):
+        processor = AutoImageProcessor.from_pretrained(model_name)
+        return processor.image_mean, processor.image_std
+
+    def _extract_features(self, data):
+        """
+        Runs the frozen backbone over cached images and returns the final-layer [CLS] embeddings, which
+        is what ViTForImageClassification feeds into its classifier.
+        """
+        backbone = ViTModel.from_pretrained(self.base_model, add_pooling_layer=False).to(self.device)
+        backbone.eval()
+        loader = self._make_loader(self._dataset(data))
+
+        features = []
+        with torch.no_grad():
+            for images, _ in loader:
+                outputs = backbone(pixel_values=images.to(self.device, non_blocking=self.pin_memory))
+                features.append(outputs.last_hidden_state[:, 0].float().cpu().numpy())
+        return np.concatenate(features)
+
+    def _evaluate_reference(self, val_data, label_mapping):
+        """
+        Returns the validation accuracy of the fully fine-tuned compare_model, matching its labels by name.
+        """
+        model = ViTForImageClassification.from_pretrained(self.compare_model).to(self.device)
+        model.eval()
+        mean, std = self._processor_stats(self.compare_model)
+        loader = self._make_loader(CachedImageDataset(self.image_cache, val_data, mean=mean, std=std))
+        id_map = torch.tensor([
+            label_mapping.get(model.config.id2label[idx], -1) for idx in range(model.config.num_labels)
+        ])
+
+        correct = 0
+        with torch.no_grad():
+            for images, labels in loader:
+                predictions = torch.argmax(model(images.to(self.device)).logits, dim=1).cpu()
+                correct += (id_map[predictions] == labels).sum().item()
+        return correct / len(val_data) if val_data else 0.0
+
+    def _train_linear_probe(self, label_album_mapping):
+        labeled_data, label_mapping = self._collect_labeled_data(label_album_mapping)
+        train_data, val_data = self._split(labeled_data)
+        data = train_data + val_data
+
+        # Only images that are new, or whose preview changed, go through the backbone
+        start = time.perf_counter()
+        feature_cache = FeatureCache(self.cache_dir, self.base_model, self.image_cache.signature)
+        features = feature_cache.get(
+            [(uuid, self.image_cache.stamp(uuid)) for uuid, _, _ in data],
+            lambda missing: self._extract_features([data[idx] for idx in missing])
+        )
+        feature_seconds = time.perf_counter() - start
+
+        labels = np.array([label for _, _, label in data])
+        train_features, val_features = features[:len(train_data)], features[len(train_data):]
+        train_labels, val_labels = labels[:len(train_data)], labels[len(train_data):]
+
+        start = time.perf_counter()
+        estimator, weight, bias = fit_logistic_head(train_features, train_labels, len(label_mapping))
+        head_seconds = time.perf_counter() - start
+
+        accuracy = estimator.score(val_features, val_labels)
+        print(f"Linear probe validation Accuracy: {accuracy * 100:.2f}%")
+
+        os.makedirs(self.output_path, exist_ok=True)
+        export_probe(self.base_model, label_mapping, weight, bias, self.output_path)
         print(f"Model and processor saved to {self.output_path}")
+
+        report = {
+            "base_model": self.base_model,
+            "train_examples": len(train_data),
+            "validation_examples": len(val_data),
+            "feature_seconds": round(feature_seconds, 2),
+            "head_seconds": round(head_seconds, 2),
+            "linear_probe_accuracy": accuracy,
+        }
+        if self.compare_model:
+            report["compare_model"] = self.compare_model
+            report["compare_model_accuracy"] = self._evaluate_reference(val_data, label_mapping)
+            print(
+                f"Accuracy: linear probe {accuracy * 100:.2f}% vs. "
+                f"fine-tuned {report['compare_model_accuracy'] * 100:.2f}% ({self.compare_model})"
+            )
+        with open(os.path.join(self.output_path, "linear_probe_report.json"), "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def _distributed_worker(rank, tuner, init_file, train_data, val_data, label_mapping, epochs, results):
+    """
+    Entry point of each process of ModelTuner._train_distributed. The first process saves the model and
+    sends back the number of samples trained on, across all processes, and the time it took.
+    """
+    world_size = tuner.processes
+    dist.init_process_group("gloo", init_method=f"file://{init_file}", rank=rank, world_size=world_size)
+    try:
+        torch.set_num_threads(tuner._threads_per_process())
+        tuner._rank = rank
+        tuner._world_size = world_size
+
+        train_dataset = tuner._dataset(train_data)
+        sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True)
+        train_loader = tuner._make_loader(train_dataset, sampler=sampler)
+        val_loader = tuner._make_loader(tuner._dataset(val_data))
+
+        # DDP starts every process from the first one's weights, including the freshly initialized head
+        tuner.model = DistributedDataParallel(tuner._new_model(label_mapping))
+        accuracy = tuner._fit(train_loader, val_loader, label_mapping, epochs)
+
+        if tuner._is_main:
+            tuner.model = tuner._unwrapped()
+            tuner._save_model()
+            tuner._save_manifest(train_data, label_mapping, accuracy)
+            # Every process trains on an equally sized shard
+            results.put((tuner._train_samples * world_size, tuner._train_seconds))
+        dist.barrier()
+    finally:
+        dist.destroy_process_group()
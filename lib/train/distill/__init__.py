@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import List
+
+from lib.classify import Classifier
+from lib.classify.distilled import StudentModel, DistilledClassifier, input_config, DEFAULT_BACKBONE
+from lib.image_cache import ImageCache
+from lib.osxphotos_utils import PhotoStream, construct_query_options
+from lib.train.multitask import MultiTaskModelTuner, MISSING_LABEL
+
+TEACHER_OUTPUTS_FILENAME = "teacher_outputs.json"
+REPORT_FILENAME = "distillation_report.json"
+# Photos per teacher classify_batch call while labeling
+TEACHER_BATCH_SIZE = 64
+# Photos the student is timed on for the report
+BENCHMARK_PHOTOS = 256
+
+
+class DistillationTuner(MultiTaskModelTuner):
+    """
+    Trains one small student network, with a head per classifier, to reproduce the decisions of existing
+    classifiers ("teachers") on unlabeled previews from the library.
+
+    The teachers' results are the labels: each head learns to choose between the outputs its teacher gave,
+    thresholds included, so the student's heads are drop-in replacements. Teacher results are kept per
+    photo version in the output directory, so only new or changed previews are run through the teachers
+    on later runs.
+    """
+
+    learning_rate = 1e-3
+
+    def __init__(self, verbose_mode, library_path, output_path, backbone=DEFAULT_BACKBONE, **kwargs):
+        super().__init__(
+            verbose_mode=verbose_mode,
+            library_path=library_path,
+            output_path=output_path,
+            base_model=backbone,
+            **kwargs
+        )
+
+    def _configure_inputs(self, base_model):
+        config = input_config(base_model)
+        self.image_mean, self.image_std = list(config.mean), list(config.std)
+        self.image_cache = ImageCache(self.cache_dir, size=config.height, resample=config.resample)
+
+    def _sample_records(self, num_samples):
+        """
+        Returns (uuid, preview path) records for up to num_samples photos. Photos are picked by a hash of
+        their UUID, so the sample is the same on every run and grows consistently with num_samples.
+        """
+        stream = PhotoStream(self.processor.photosdb, construct_query_options().to_query_options())
+        uuids = sorted(stream.uuids, key=lambda uuid: hashlib.sha1(uuid.encode()).hexdigest())
+        records = []
+        for start in range(0, len(uuids), num_samples):
+            records.extend(
+                (record.uuid, record.preview_path) for record in stream.records(uuids[start:start + num_samples])
+                if record.preview_path is not None and os.path.exists(record.preview_path)
+            )
+            if len(records) >= num_samples:
+                break
+        return records[:num_samples]
+
+    def _load_teacher_outputs(self):
+        path = os.path.join(self.output_path, TEACHER_OUTPUTS_FILENAME)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return json.load(f)
+        return {"outputs": {}, "seconds_per_photo": {}}
+
+    def _save_teacher_outputs(self, state):
+        os.makedirs(self.output_path, exist_ok=True)
+        path = os.path.join(self.output_path, TEACHER_OUTPUTS_FILENAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def _teacher_outputs(self, teachers: List[Classifier], records):
+        """
+        Runs every teacher over the records' previews, skipping photos it already labeled.
+        :return: {teacher name: {uuid: output}}, without the photos the teacher couldn't read, and
+            {teacher name: seconds per photo}.
+        """
+        state = self._load_teacher_outputs()
+        outputs = {}
+        for teacher in teachers:
+            signature = teacher.signature()
+            entries = state["outputs"].setdefault(signature, {})
+            missing = [
+                (uuid, path) for uuid, path in records
+                if entries.get(uuid, [None])[0] != self.image_cache.stamp(uuid)
+            ]
+            if missing:
+                print(f"Labeling {len(missing)} photos with {teacher.name}")
+                teacher.load()
+                start = time.perf_counter()
+                for chunk_start in range(0, len(missing), TEACHER_BATCH_SIZE):
+                    chunk = missing[chunk_start:chunk_start + TEACHER_BATCH_SIZE]
+                    results, readable = self._label_chunk(teacher, [path for _, path in chunk])
+                    for (uuid, _), result, ok in zip(chunk, results, readable):
+                        # Unreadable photos are remembered too, so they aren't retried until their preview changes
+                        entries[uuid] = [self.image_cache.stamp(uuid), result, ok]
+                    self._save_teacher_outputs(state)
+                state["seconds_per_photo"][signature] = (time.perf_counter() - start) / len(missing)
+                self._save_teacher_outputs(state)
+                teacher.unload()
+            outputs[teacher.name] = {
+                uuid: entries[uuid][1] for uuid, _ in records
+                if len(entries[uuid]) < 3 or entries[uuid][2]
+            }
+        seconds_per_photo = {teacher.name: state["seconds_per_photo"].get(teacher.signature()) for teacher in teachers}
+        return outputs, seconds_per_photo
+
+    @staticmethod
+    def _label_chunk(teacher: Classifier, image_paths):
+        """
+        Runs a teacher over a chunk of previews. If the chunk fails, e.g. on a preview the teacher can't
+        decode, its previews are retried one at a time and the ones that still fail count as unreadable.
+        :return: (results, readable)
+        """
+        try:
+            return teacher.classify_batch_checked(image_paths)
+        except Exception as e:
+            print(f"{teacher.name} failed on a chunk ({e}); retrying its photos one at a time")
+        results, readable = [], []
+        for image_path in image_paths:
+            try:
+                (result,), (ok,) = teacher.classify_batch_checked([image_path])
+            except Exception as e:
+                print(f"{teacher.name} couldn't label {image_path}: {type(e).__name__}: {e}")
+                result, ok = None, False
+            results.append(result)
+            readable.append(ok)
+        return results, readable
+
+    def _save_model(self):
+        self.model.save_pretrained(self.output_path)
+
+        # The run finished, so there's nothing left to resume
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+        print(f"Student saved to {self.output_path}")
+
+    def _benchmark_student(self, image_paths):
+        """
+        Photos per second of the saved student on the CPU, including decoding, for all heads together.
+        """
+        student = DistilledClassifier(self.output_path)
+        head = student.classifiers()[0]
+        head.classify_batch(image_paths[:head.batch_size])
+        student.clear_cache()
+        start = time.perf_counter()
+        for chunk_start in range(0, len(image_paths), head.batch_size):
+            head.classify_batch(image_paths[chunk_start:chunk_start + head.batch_size])
+        return len(image_paths) / (time.perf_counter() - start)
+
+    def distill(self, teachers: List[Classifier], num_samples=5000, epochs=10):
+        records = self._sample_records(num_samples)
+        slots = self.image_cache.add(records)
+        records = [record for record, slot in zip(records, slots) if slot is not None]
+        slots = [slot for slot in slots if slot is not None]
+        print(f"Distilling {', '.join(teacher.name for teacher in teachers)} over {len(records)} photos")
+
+        outputs, seconds_per_photo = self._teacher_outputs(teachers, records)
+
+        # Each head chooses between the distinct outputs its teacher gave, e.g. [false, true] or [null, 90, 180, 270].
+        # Photos a teacher couldn't read aren't labeled for its head, rather than teaching it a "null" class.
+        # A teacher that gave only one output on the sample is left out: its head would always give that output
+        # and still agree 100%, and flag_multi.py --student would swap it in for the real classifier.
+        self.tasks = {}
+        excluded = {}
+        for teacher in teachers:
+            distinct = {json.dumps(output, sort_keys=True) for output in outputs[teacher.name].values()}
+            if len(distinct) < 2:
+                excluded[teacher.name] = f"gave {len(distinct)} distinct outputs on {len(outputs[teacher.name])} photos"
+                print(f"Leaving out {teacher.name}: it {excluded[teacher.name]}, so its head couldn't learn anything")
+                continue
+            self.tasks[teacher.name] = [json.loads(output) for output in sorted(distinct)]
+        if not self.tasks:
+            raise ValueError("No teacher gave more than one distinct output on the sample; try more --samples")
+        class_index = {
+            task: {json.dumps(output, sort_keys=True): idx for idx, output in enumerate(task_outputs)}
+            for task, task_outputs in self.tasks.items()
+        }
+        labeled_data = [
+            (uuid, slot, tuple(
+                class_index[task][json.dumps(outputs[task][uuid], sort_keys=True)] if uuid in outputs[task]
+                else MISSING_LABEL
+                for task in self.tasks
+            ))
+            for (uuid, _), slot in zip(records, slots)
+            if any(uuid in outputs[task] for task in self.tasks)
+        ]
+
+        train_data, val_data = self._split(labeled_data)
+        train_loader = self._make_loader(self._dataset(train_data), shuffle=True)
+        val_loader = self._make_loader(self._dataset(val_data))
+
+        self.model = StudentModel(self.base_model, self.tasks, pretrained=True).to(self.device)
+        self._fit(train_loader, val_loader, self.tasks, epochs)
+        self._save_model()
+        self._report(val_loader, val_data, dict(records), seconds_per_photo, excluded)
+
+    def _report(self, val_loader, val_data, preview_paths, seconds_per_photo, excluded):
+        """
+        Compares the student with its teachers: agreement on the validation photos, per head, and
+        throughput, and lists the teachers left out and why. Saved next to the student as distillation_report.json.
+        """
+        agreement = self._task_accuracies(val_loader)
+        benchmark_paths = [preview_paths[uuid] for uuid, _, _ in val_data[:BENCHMARK_PHOTOS]]
+        student_photos_per_second = self._benchmark_student(benchmark_paths) if benchmark_paths else None
+
+        # The teachers run one after another on every photo
+        teacher_seconds = [seconds for seconds in seconds_per_photo.values() if seconds]
+        teacher_photos_per_second = 1 / sum(teacher_seconds) if len(teacher_seconds) == len(seconds_per_photo) else None
+
+        report = {
+            "backbone": self.base_model,
+            "validation_photos": len(val_data),
+            "agreement": agreement,
+            "excluded_teachers": excluded,
+            "teacher_seconds_per_photo": seconds_per_photo,
+            "teacher_photos_per_second": teacher_photos_per_second,
+            "student_photos_per_second": student_photos_per_second,
+        }
+        with open(os.path.join(self.output_path, REPORT_FILENAME), "w") as f:
+            json.dump(report, f, indent=2)
+
+        for task, task_agreement in agreement.items():
+            print(f"Agreement with {task}: {task_agreement * 100:.2f}%")
+        if student_photos_per_second is not None:
+            print(f"Student: {student_photos_per_second:.1f} photos/s on CPU")
+        if teacher_photos_per_second is not None:
+            print(f"Teachers: {teacher_photos_per_second:.1f} photos/s")
+        return report
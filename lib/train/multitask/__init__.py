@@ -0,0 +1,106 @@
+from typing import List
+
+import torch
+from torch.nn import CrossEntropyLoss
+
+from lib.classify.multitask import MultiTaskViT
+from lib.config import ModelConfig
+from lib.train import ModelTuner
+
+# Label for photos that aren't in any of a task's training albums; excluded from that task's loss
+MISSING_LABEL = -100
+
+
+class MultiTaskModelTuner(ModelTuner):
+    """
+    Fine-tunes one shared backbone with a classification head per ModelConfig.
+    The library is loaded once and each photo is decoded once, however many tasks it's labeled for.
+    """
+
+    def __init__(self, verbose_mode, library_path, output_path, base_model="google/vit-base-patch16-224", **kwargs):
+        super().__init__(
+            verbose_mode=verbose_mode,
+            library_path=library_path,
+            output_path=output_path,
+            base_model=base_model,
+            **kwargs
+        )
+        self.criterion = CrossEntropyLoss(ignore_index=MISSING_LABEL)
+        self.tasks = None
+
+    def _collect_multitask_data(self, configs: List[ModelConfig]):
+        """
+        Returns (uuid, cache slot, labels) tuples for the union of all training albums, where labels
+        holds one label id per task (MISSING_LABEL where the photo isn't labeled for that task).
+        """
+        tasks = {
+            config.name: {label: idx for idx, (label, _) in enumerate(config.label_album_mapping)}
+            for config in configs
+        }
+        task_index = {task: idx for idx, task in enumerate(tasks)}
+
+        labels_by_uuid = {}
+        slots = {}
+        for config in configs:
+            for label, album_name in config.label_album_mapping:
+                records = self._get_preview_records(album_name)
+                for (uuid, _), slot in zip(records, self.image_cache.add(records)):
+                    if slot is None:
+                        continue
+                    slots[uuid] = slot
+                    labels = labels_by_uuid.setdefault(uuid, [MISSING_LABEL] * len(tasks))
+                    labels[task_index[config.name]] = tasks[config.name][label]
+
+        labeled_data = [(uuid, slots[uuid], tuple(labels)) for uuid, labels in labels_by_uuid.items()]
+        return labeled_data, tasks
+
+    def _loss(self, images, labels):
+        with self._autocast():
+            logits = self.model(images)
+
+        losses = []
+        for idx, task in enumerate(self.tasks):
+            task_labels = labels[:, idx]
+            if (task_labels != MISSING_LABEL).any():
+                losses.append(self.criterion(logits[task].float(), task_labels))
+        return torch.stack(losses).sum()
+
+    def _task_accuracies(self, val_loader):
+        """
+        Returns the validation accuracy of each task, over the photos labeled for it.
+        """
+        self.model.eval()
+        correct = {task: 0 for task in self.tasks}
+        total = {task: 0 for task in self.tasks}
+        with torch.no_grad():
+            for images, labels in val_loader:
+                images = images.to(self.device)
+                labels = labels.to(self.device)
+                with self._autocast():
+                    logits = self.model(images)
+                for idx, task in enumerate(self.tasks):
+                    task_labels = labels[:, idx]
+                    mask = task_labels != MISSING_LABEL
+                    predictions = torch.argmax(logits[task], dim=1)
+                    correct[task] += (predictions[mask] == task_labels[mask]).sum().item()
+                    total[task] += mask.sum().item()
+        return {task: correct[task] / total[task] for task in self.tasks if total[task]}
+
+    def _validate_model(self, val_loader):
+        accuracies = self._task_accuracies(val_loader)
+        for task, accuracy in accuracies.items():
+            print(f"Validation Accuracy ({task}): {accuracy * 100:.2f}%")
+
+        # Early stopping and best-weight selection use the mean over tasks
+        return sum(accuracies.values()) / len(accuracies) if accuracies else 0.0
+
+    def train(self, configs: List[ModelConfig], epochs=5):
+        labeled_data, self.tasks = self._collect_multitask_data(configs)
+        train_data, val_data = self._split(labeled_data)
+
+        train_loader = self._make_loader(self._dataset(train_data), shuffle=True)
+        val_loader = self._make_loader(self._dataset(val_data))
+
+        self.model = MultiTaskViT.from_base_model(self.base_model, self.tasks).to(self.device)
+        self._fit(train_loader, val_loader, self.tasks, epochs)
+        self._save_model()
@@ -0,0 +1,119 @@
+import json
+import os
+
+import numpy as np
+import torch
+from sklearn.linear_model import LogisticRegression
+from transformers import ViTForImageClassification, AutoImageProcessor
+
+FEATURES_FILENAME = "features.npy"
+INDEX_FILENAME = "index.json"
+
+
+class FeatureCache:
+    """
+    Caches frozen-backbone features per photo UUID, so a linear probe only runs the backbone over
+    images it hasn't seen before (or whose preview changed since the features were computed).
+    """
+
+    def __init__(self, cache_dir, base_model, image_signature):
+        self.path = os.path.join(
+            os.path.expanduser(cache_dir),
+            "features",
+            base_model.replace("/", "--"),
+            image_signature
+        )
+        os.makedirs(self.path, exist_ok=True)
+        self._features_path = os.path.join(self.path, FEATURES_FILENAME)
+        self._index_path = os.path.join(self.path, INDEX_FILENAME)
+        self._index = {}
+        self._features = None
+        if os.path.exists(self._index_path) and os.path.exists(self._features_path):
+            with open(self._index_path, "r") as f:
+                self._index = json.load(f)
+            self._features = np.load(self._features_path)
+
+    def _save(self):
+        np.save(self._features_path, self._features)
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def get(self, keys, compute):
+        """
+        Returns features for every (uuid, stamp) key, computing the missing ones.
+
+        :param keys: List of (uuid, stamp) tuples, where stamp identifies the version of the image.
+        :param compute: Called with the indices (into keys) of missing entries; returns their features.
+        :return: Array of shape (len(keys), hidden_size).
+        """
+        missing = [
+            idx for idx, (uuid, stamp) in enumerate(keys)
+            if uuid not in self._index or self._index[uuid][1] != stamp
+        ]
+        if missing:
+            computed = np.asarray(compute(missing), dtype=np.float32)
+            if self._features is None:
+                self._features = np.empty((0, computed.shape[1]), dtype=np.float32)
+            next_row = len(self._features)
+            rows = []
+            for idx in missing:
+                uuid, stamp = keys[idx]
+                if uuid in self._index:
+                    row = self._index[uuid][0]
+                else:
+                    row = next_row
+                    next_row += 1
+                self._index[uuid] = [row, stamp]
+                rows.append(row)
+            if next_row > len(self._features):
+                padding = np.empty((next_row - len(self._features), computed.shape[1]), dtype=np.float32)
+                self._features = np.concatenate([self._features, padding])
+            self._features[rows] = computed
+            self._save()
+
+        return self._features[[self._index[uuid][0] for uuid, _ in keys]]
+
+
+def fit_logistic_head(features, labels, num_labels, regularization=1.0):
+    """
+    Fit a logistic-regression head on frozen features.
+
+    :return: The fitted sklearn estimator, and a (weight, bias) pair shaped like a
+        (hidden_size -> num_labels) torch Linear layer, so it can replace a model's classifier.
+    """
+    if len(set(labels)) != num_labels:
+        raise ValueError("Every label needs at least one training example for a linear probe")
+
+    estimator = LogisticRegression(C=regularization, max_iter=1000)
+    estimator.fit(features, labels)
+    weight, bias = estimator.coef_, estimator.intercept_
+
+    # Binary problems are fit as a single logit; split it symmetrically so softmax over the two
+    # classes gives exactly the same probabilities.
+    if num_labels == 2 and weight.shape[0] == 1:
+        weight = np.concatenate([-weight / 2, weight / 2])
+        bias = np.array([-bias[0] / 2, bias[0] / 2])
+
+    return estimator, weight, bias
+
+
+def export_probe(base_model, label_mapping, weight, bias, output_path):
+    """
+    Save the frozen backbone plus the fitted head as a regular ViTForImageClassification, which the
+    lib.classify PipelineClassifier subclasses can load by path.
+    """
+    model = ViTForImageClassification.from_pretrained(
+        base_model,
+        num_labels=len(label_mapping),
+        id2label={v: k for k, v in label_mapping.items()},
+        label2id=label_mapping,
+        ignore_mismatched_sizes=True
+    )
+    with torch.no_grad():
+        model.classifier.weight.copy_(torch.from_numpy(weight).float())
+        model.classifier.bias.copy_(torch.from_numpy(bias).float())
+
+    model.save_pretrained(output_path)
+    AutoImageProcessor.from_pretrained(base_model).save_pretrained(output_path)
@@ -0,0 +1,70 @@
+import os
+from collections import Counter
+
+import cv2
+
+DEFAULT_FRAMES_PER_VIDEO = 8
+DEFAULT_MAX_DIMENSION = 1024
+# Skip the very start and end, which are often black or a fade
+EDGE_MARGIN = 0.05
+
+
+def sample_keyframes(video_path, output_dir, num_frames=DEFAULT_FRAMES_PER_VIDEO, max_dimension=DEFAULT_MAX_DIMENSION):
+    """
+    Decodes num_frames frames spread evenly through a video and writes them as JPEGs to output_dir.
+
+    The video is streamed from disk and each sample seeks directly to its position, so the decoder only
+    works from the nearest keyframe to each sample. The cost depends on num_frames, not on the video's length.
+
+    :return: Paths of the frames written, in playback order.
+    """
+    capture = cv2.VideoCapture(video_path)
+    try:
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video {video_path}")
+
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count > 0:
+            first = int(frame_count * EDGE_MARGIN)
+            last = max(first, int(frame_count * (1 - EDGE_MARGIN)) - 1)
+            step = (last - first) / max(num_frames - 1, 1)
+            positions = sorted({first + int(step * idx) for idx in range(num_frames)})
+        else:
+            # Some containers don't report a frame count; take the first frame only
+            positions = [0]
+
+        frame_paths = []
+        for position in positions:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, position)
+            ok, frame = capture.read()
+            if not ok:
+                continue
+            height, width = frame.shape[:2]
+            scale = max_dimension / max(height, width)
+            if scale < 1:
+                frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+            frame_path = os.path.join(output_dir, f"frame_{position:08d}.jpg")
+            cv2.imwrite(frame_path, frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            frame_paths.append(frame_path)
+        return frame_paths
+    finally:
+        capture.release()
+
+
+def aggregate_frames(classifications, min_fraction):
+    """
+    Combines per-frame classifications into one video-level classification.
+
+    Boolean classifiers flag the video when at least min_fraction of its frames are flagged. Classifiers
+    returning a label (or angle) give the most common one, if it appears in at least min_fraction of frames.
+    """
+    if not classifications:
+        return None
+    flagged = [classification for classification in classifications if classification]
+    if len(flagged) / len(classifications) < min_fraction:
+        return False if all(isinstance(c, bool) for c in classifications) else None
+    if all(isinstance(classification, bool) for classification in flagged):
+        return True
+
+    label, count = Counter(flagged).most_common(1)[0]
+    return label if count / len(classifications) >= min_fraction else None
@@ -0,0 +1,60 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger("photoflagger")
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+class _Worker(threading.Thread):
+    def __init__(self):
+        # Daemon, so an abandoned task stuck in native code can't keep the process alive at exit
+        super().__init__(name="watchdog-worker", daemon=True)
+        self.tasks = queue.SimpleQueue()
+
+    def run(self):
+        while True:
+            fn, args, future = self.tasks.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class Watchdog:
+    """
+    Runs calls on a worker thread and gives up on the ones that exceed their time limit.
+
+    Python threads can't be killed, so a timed-out call is abandoned: it keeps its (daemon) thread
+    until it returns, and later calls go to a fresh worker.
+    """
+
+    def __init__(self):
+        self._worker = None
+        self.abandoned = 0
+
+    def run(self, fn, *args, timeout=None):
+        """
+        Returns fn(*args), or raises TaskTimeout if it takes longer than timeout seconds.
+        """
+        if timeout is None:
+            return fn(*args)
+
+        if self._worker is None:
+            self._worker = _Worker()
+            self._worker.start()
+        future = Future()
+        self._worker.tasks.put((fn, args, future))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self._worker = None
+            self.abandoned += 1
+            logger.debug(f"Abandoned a task after {timeout:.0f}s ({self.abandoned} abandoned so far)")
+            raise TaskTimeout(f"timed out after {timeout:.0f}s")
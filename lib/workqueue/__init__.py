@@ -0,0 +1,235 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import List
+
+DEFAULT_LEASE_SECONDS = 600
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue(ABC):
+    """
+    A queue of photo UUIDs shared by several workers.
+
+    Workers claim batches with a lease. While a worker holds the lease nobody else gets those photos;
+    if the worker dies, the lease expires and the photos are handed out again.
+    """
+
+    @abstractmethod
+    def enqueue(self, uuids: List[str]):
+        """
+        Add photos to the queue, in order. Photos already in the queue keep their place and state,
+        except failed ones, which go back to pending so a new run retries them.
+        """
+
+    @abstractmethod
+    def claim(self, worker_id: str, max_items: int, lease_seconds: float) -> List[str]:
+        """
+        Atomically lease up to max_items photos that are pending or whose lease has expired.
+        """
+
+    @abstractmethod
+    def renew(self, worker_id: str, uuids: List[str], lease_seconds: float) -> List[str]:
+        """
+        Extend the leases this worker still holds. Returns the UUIDs that were renewed.
+        """
+
+    @abstractmethod
+    def complete(self, worker_id: str, uuids: List[str], failed=False) -> List[str]:
+        """
+        Mark leased photos as finished (or failed). Returns the UUIDs this worker still held the lease on.
+        """
+
+    @abstractmethod
+    def release(self, worker_id: str, uuids: List[str]):
+        """
+        Give up leases without finishing, so the photos go back to pending.
+        """
+
+    @abstractmethod
+    def counts(self) -> dict:
+        """
+        Number of photos per state.
+        """
+
+    @abstractmethod
+    def reset(self):
+        """
+        Forget every photo, finished or not.
+        """
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """
+    A WorkQueue in a single SQLite file.
+
+    Claims run in an IMMEDIATE transaction, so concurrent workers never lease the same photo. Every call
+    opens its own connection, so the queue can be used from several threads and processes. It uses a
+    rollback journal rather than WAL, which needs shared memory and doesn't work across machines; sharing
+    the file between hosts also needs a network filesystem with working POSIX locks.
+    """
+
+    def __init__(self, db_path, busy_timeout=30):
+        self.db_path = os.path.expanduser(db_path)
+        self.busy_timeout = busy_timeout
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS items (
+                    uuid TEXT PRIMARY KEY,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_expires)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        return _Transaction(conn)
+
+    def enqueue(self, uuids):
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                INSERT INTO items (uuid) VALUES (?)
+                ON CONFLICT (uuid) DO UPDATE SET state = 'pending', owner = NULL WHERE state = 'failed'
+                """,
+                ((uuid,) for uuid in uuids)
+            )
+
+    def claim(self, worker_id, max_items, lease_seconds=DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        with self._connect() as conn:
+            uuids = [row[0] for row in conn.execute(
+                """
+                SELECT uuid FROM items
+                WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                ORDER BY rowid LIMIT ?
+                """,
+                (now, max_items)
+            )]
+            conn.executemany(
+                """
+                UPDATE items SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE uuid = ?
+                """,
+                ((worker_id, now + lease_seconds, uuid) for uuid in uuids)
+            )
+        return uuids
+
+    def _held(self, conn, worker_id, uuids):
+        return [
+            uuid for uuid in uuids
+            if conn.execute(
+                "SELECT 1 FROM items WHERE uuid = ? AND state = 'leased' AND owner = ? AND lease_expires >= ?",
+                (uuid, worker_id, time.time())
+            ).fetchone()
+        ]
+
+    def renew(self, worker_id, uuids, lease_seconds=DEFAULT_LEASE_SECONDS):
+        with self._connect() as conn:
+            held = self._held(conn, worker_id, uuids)
+            conn.executemany(
+                "UPDATE items SET lease_expires = ? WHERE uuid = ?",
+                ((time.time() + lease_seconds, uuid) for uuid in held)
+            )
+        return held
+
+    def complete(self, worker_id, uuids, failed=False):
+        with self._connect() as conn:
+            held = self._held(conn, worker_id, uuids)
+            conn.executemany(
+                "UPDATE items SET state = ?, lease_expires = NULL WHERE uuid = ?",
+                (("failed" if failed else "done", uuid) for uuid in held)
+            )
+        return held
+
+    def release(self, worker_id, uuids):
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE items SET state = 'pending', owner = NULL, lease_expires = NULL WHERE uuid = ? AND owner = ?",
+                ((uuid, worker_id) for uuid in uuids)
+            )
+
+    def counts(self):
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall())
+
+    def reset(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM items")
+
+
+class _Transaction:
+    """
+    Wraps a connection in BEGIN IMMEDIATE ... COMMIT, taking the write lock up front so two workers
+    can't both read the same pending rows before either updates them.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
+
+
+class LeaseKeeper:
+    """
+    Renews a worker's leases in the background while it works on them, so a slow batch isn't
+    reclaimed by another worker. Use as a context manager around the processing loop.
+    """
+
+    def __init__(self, queue: WorkQueue, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+
+    def hold(self, uuids):
+        with self._lock:
+            self._held.update(uuids)
+
+    def drop(self, uuids):
+        with self._lock:
+            self._held.difference_update(uuids)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                held = list(self._held)
+            if held:
+                lost = set(held) - set(self.queue.renew(self.worker_id, held, self.lease_seconds))
+                self.drop(lost)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            held = list(self._held)
+        # Anything still held wasn't finished: hand it back rather than waiting for the lease to expire
+        if held:
+            self.queue.release(self.worker_id, held)
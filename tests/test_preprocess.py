@@ -0,0 +1,98 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+Image = pytest.importorskip("PIL.Image")
+
+from lib.classify.preprocess import BatchPreprocessor, ProcessorConfig, DEFAULT_TOLERANCE
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# Configurations of the processors the classifiers load: ViT at its default and a larger resolution, ViT with
+# ImageNet statistics, and DiT's BEiT processor, which resizes bicubically without center cropping
+PROCESSORS = {
+    "vit": lambda: transformers.ViTImageProcessor(),
+    "vit-384": lambda: transformers.ViTImageProcessor(size={"height": 384, "width": 384}),
+    "vit-imagenet": lambda: transformers.ViTImageProcessor(image_mean=IMAGENET_MEAN, image_std=IMAGENET_STD),
+    "dit": lambda: transformers.BeitImageProcessor(
+        size={"height": 224, "width": 224},
+        do_center_crop=False,
+        resample=Image.BICUBIC,
+        image_mean=[0.5, 0.5, 0.5],
+        image_std=[0.5, 0.5, 0.5]
+    ),
+}
+
+
+@pytest.fixture(scope="module")
+def image_paths(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("images")
+    rng = np.random.default_rng(0)
+    paths = []
+    for idx, (width, height, mode, extension) in enumerate([
+        (640, 480, "RGB", "jpg"),
+        (300, 800, "RGB", "png"),
+        (224, 224, "RGB", "png"),
+        (97, 61, "RGBA", "png"),
+        (512, 512, "L", "jpg"),
+    ]):
+        channels = {"RGB": 3, "RGBA": 4, "L": 1}[mode]
+        noise = rng.integers(0, 256, (height, width, channels), dtype=np.uint8)
+        # Smooth gradients as well as noise, since resampling filters differ most on sharp edges
+        gradient = np.linspace(0, 255, width, dtype=np.uint8)[None, :, None]
+        pixels = np.where(np.arange(height)[:, None, None] < height // 2, noise, gradient).astype(np.uint8)
+        image = Image.fromarray(pixels.squeeze(-1) if channels == 1 else pixels)
+        assert image.mode == mode
+        path = directory / f"image-{idx}.{extension}"
+        image.save(path)
+        paths.append(str(path))
+    return paths
+
+
+def _expected(processor, image_path):
+    with Image.open(image_path) as image:
+        return processor(images=image.convert("RGB"), return_tensors="pt")["pixel_values"][0]
+
+
+@pytest.mark.parametrize("name", PROCESSORS)
+def test_batch_preprocessor_matches_processor(name, image_paths):
+    processor = PROCESSORS[name]()
+    config = ProcessorConfig.from_processor(processor)
+    assert config is not None
+    preprocessor = BatchPreprocessor(config)
+
+    pixel_values, loaded = preprocessor.preprocess(image_paths, workers=2)
+    assert all(loaded)
+    assert pixel_values.shape == (len(image_paths), 3, config.height, config.width)
+    for idx, image_path in enumerate(image_paths):
+        difference = (pixel_values[idx] - _expected(processor, image_path)).abs().max().item()
+        assert difference <= DEFAULT_TOLERANCE, f"{name} differs by {difference:.4f} on {image_path}"
+
+
+def test_unsupported_processors_are_not_shared():
+    assert ProcessorConfig.from_processor(transformers.ConvNextImageProcessor()) is None
+    assert ProcessorConfig.from_processor(transformers.ViTImageProcessor(do_resize=False)) is None
+
+
+def test_undecodable_images_are_left_out(image_paths, tmp_path):
+    broken_path = tmp_path / "broken.jpg"
+    broken_path.write_bytes(b"not an image")
+    processor = PROCESSORS["vit"]()
+    preprocessor = BatchPreprocessor(ProcessorConfig.from_processor(processor))
+
+    pixel_values, loaded = preprocessor.preprocess([image_paths[0], str(broken_path), image_paths[1]])
+    assert loaded == [True, False, True]
+    assert len(pixel_values) == 2
+    for row, image_path in zip(pixel_values, [image_paths[0], image_paths[1]]):
+        assert (row - _expected(processor, image_path)).abs().max().item() <= DEFAULT_TOLERANCE
+
+
+def test_results_are_not_overwritten_by_later_batches(image_paths):
+    preprocessor = BatchPreprocessor(ProcessorConfig.from_processor(PROCESSORS["vit"]()))
+    first, _ = preprocessor.preprocess(image_paths[:2])
+    snapshot = first.clone()
+    preprocessor.preprocess(image_paths[2:4])
+    preprocessor.preprocess(image_paths[1:])
+    assert torch.equal(first, snapshot)
@@ -0,0 +1,109 @@
+import subprocess
+
+import pytest
+
+from lib.publish import GitRemote, publish, MANIFEST_FILENAME
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch):
+    for variable in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+        monkeypatch.setenv(variable, "harmonia")
+    for variable in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+        monkeypatch.setenv(variable, "harmonia@localhost")
+
+
+@pytest.fixture
+def bare_repo(tmp_path):
+    path = tmp_path / "remote.git"
+    subprocess.run(["git", "init", "--quiet", "--bare", str(path)], check=True)
+    return str(path)
+
+
+def _git(bare_repo, *args):
+    return subprocess.run(["git", "-C", bare_repo, *args], check=True, capture_output=True, text=True).stdout
+
+
+def _files(bare_repo):
+    return set(_git(bare_repo, "ls-tree", "--name-only", "main").split())
+
+
+def _commits(bare_repo):
+    return int(_git(bare_repo, "rev-list", "--count", "main"))
+
+
+def _publish(staging_dir, bare_repo, replaces=()):
+    with GitRemote(bare_repo) as remote:
+        return publish(str(staging_dir), remote, "Publish", replaces=replaces)
+
+
+def test_publish_uploads_then_skips_unchanged_then_deletes(tmp_path, bare_repo):
+    staging_dir = tmp_path / "staging"
+    staging_dir.mkdir()
+    (staging_dir / "model-00001-of-00002.safetensors").write_bytes(b"first shard")
+    (staging_dir / "model-00002-of-00002.safetensors").write_bytes(b"second shard")
+    (staging_dir / "config.yaml").write_text("fp16: true\n")
+
+    result = _publish(staging_dir, bare_repo)
+    assert sorted(result.uploaded) == ["config.yaml", "model-00001-of-00002.safetensors",
+                                       "model-00002-of-00002.safetensors"]
+    assert _files(bare_repo) == {*result.uploaded, MANIFEST_FILENAME}
+    assert _commits(bare_repo) == 1
+
+    # Nothing changed, so nothing is committed
+    result = _publish(staging_dir, bare_repo)
+    assert not result.changed
+    assert len(result.unchanged) == 3
+    assert _commits(bare_repo) == 1
+
+    # Only the changed shard goes up; a shard that's gone is deleted
+    (staging_dir / "model-00002-of-00002.safetensors").unlink()
+    (staging_dir / "model-00001-of-00002.safetensors").write_bytes(b"retrained shard")
+    result = _publish(staging_dir, bare_repo)
+    assert result.uploaded == ["model-00001-of-00002.safetensors"]
+    assert result.deleted == ["model-00002-of-00002.safetensors"]
+    assert result.unchanged == ["config.yaml"]
+    assert _files(bare_repo) == {"config.yaml", "model-00001-of-00002.safetensors", MANIFEST_FILENAME}
+    assert _git(bare_repo, "show", "main:model-00001-of-00002.safetensors") == "retrained shard"
+    assert _commits(bare_repo) == 2
+
+
+def test_first_publish_deletes_replaced_legacy_files(tmp_path, bare_repo):
+    # A repo published before manifests, with only a model.pth
+    legacy_dir = tmp_path / "legacy"
+    subprocess.run(["git", "clone", "--quiet", bare_repo, str(legacy_dir)], check=True, capture_output=True)
+    (legacy_dir / "model.pth").write_bytes(b"old weights")
+    (legacy_dir / "config.yaml").write_text("fp16: true\n")
+    subprocess.run(["git", "-C", str(legacy_dir), "add", "."], check=True)
+    subprocess.run(["git", "-C", str(legacy_dir), "commit", "--quiet", "-m", "Legacy"], check=True)
+    subprocess.run(["git", "-C", str(legacy_dir), "push", "--quiet", "origin", "HEAD:refs/heads/main"],
+                   check=True, capture_output=True)
+
+    staging_dir = tmp_path / "staging"
+    staging_dir.mkdir()
+    (staging_dir / "model.safetensors").write_bytes(b"new weights")
+    (staging_dir / "config.yaml").write_text("fp16: true\n")
+
+    result = _publish(staging_dir, bare_repo, replaces=["model.pth", "never-published.bin"])
+    assert result.deleted == ["model.pth"]
+    assert _files(bare_repo) == {"config.yaml", "model.safetensors", MANIFEST_FILENAME}
+
+
+def test_nested_checkpoints_are_unwrapped_and_round_trip(tmp_path):
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("safetensors")
+    from lib.publish.convert import load_state_dict, read_safetensors, write_safetensors
+
+    weights = {"model.linear.weight": torch.randn(4, 3), "model.linear.bias": torch.randn(4)}
+    checkpoint_path = tmp_path / "model.pth"
+    torch.save({"state_dict": weights, "epoch": 3}, checkpoint_path)
+
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    filenames = write_safetensors(load_state_dict(str(checkpoint_path)), str(output_dir), shard_size=32)
+    assert len(filenames) == 3  # Two shards and their index
+
+    loaded = read_safetensors([str(output_dir / name) for name in filenames if name.endswith(".safetensors")])
+    assert loaded.keys() == weights.keys()
+    for name, tensor in weights.items():
+        assert torch.equal(loaded[name], tensor)
@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("osxphotos")
+
+from lib.classify.quantize import MIN_FLAGGED_PHOTOS, rejection_reason
+
+
+def report(agreement=1.0, flagged_agreement=1.0, flagged_photos=MIN_FLAGGED_PHOTOS, lost=0, changed=0):
+    return {
+        "agreement": agreement,
+        "flagged_agreement": flagged_agreement,
+        "flagged_photos": flagged_photos,
+        "gained": 0,
+        "lost": lost,
+        "changed": changed,
+    }
+
+
+def test_accepts_a_variant_that_agrees_overall_and_on_flagged_photos():
+    assert rejection_reason(report(agreement=0.995, flagged_agreement=1.0), 0.99) is None
+
+
+def test_rejects_a_variant_that_never_flags_at_a_low_flag_rate():
+    # 1% of photos flagged by fp32, none by the variant: 99% raw agreement
+    reason = rejection_reason(report(agreement=0.99, flagged_agreement=0.0, flagged_photos=10, lost=10), 0.99)
+    assert reason is not None and "10 no longer flagged" in reason
+
+
+def test_rejects_a_variant_that_disagrees_overall():
+    assert rejection_reason(report(agreement=0.9), 0.99) is not None
+
+
+def test_rejects_too_few_flagged_photos_to_compare_on():
+    reason = rejection_reason(report(flagged_agreement=None, flagged_photos=0), 0.99)
+    assert reason is not None and "check_samples" in reason
+
+
+def test_rejects_reports_from_before_flagged_photos_were_checked():
+    assert rejection_reason({"agreement": 1.0}, 0.99) is not None
+
+
+def test_zero_min_agreement_accepts_any_variant():
+    assert rejection_reason({"agreement": 0.0}, 0.0) is None
@@ -0,0 +1,106 @@
+import datetime
+import multiprocessing
+import time
+
+import pytest
+
+from lib.workqueue import SQLiteWorkQueue, LeaseKeeper
+
+WORKERS = 6
+ITEMS = 2000
+
+
+def _drain(db_path, worker_id, results):
+    queue = SQLiteWorkQueue(db_path)
+    processed = []
+    while True:
+        uuids = queue.claim(worker_id, max_items=25, lease_seconds=60)
+        if not uuids:
+            break
+        processed.extend(queue.complete(worker_id, uuids))
+    results.put((worker_id, processed))
+
+
+def test_concurrent_workers_process_every_item_exactly_once(tmp_path):
+    db_path = str(tmp_path / "queue.db")
+    uuids = [f"uuid-{idx}" for idx in range(ITEMS)]
+    SQLiteWorkQueue(db_path).enqueue(uuids)
+
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_drain, args=(db_path, f"worker-{idx}", results))
+        for idx in range(WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    processed = {}
+    for _ in workers:
+        worker_id, worker_processed = results.get(timeout=120)
+        processed[worker_id] = worker_processed
+    for worker in workers:
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+
+    completed = [uuid for worker_processed in processed.values() for uuid in worker_processed]
+    assert sorted(completed) == sorted(uuids)
+    assert SQLiteWorkQueue(db_path).counts() == {"done": ITEMS}
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / "queue.db"))
+    queue.enqueue(["a", "b", "c"])
+
+    assert queue.claim("stalled", max_items=2, lease_seconds=0.2) == ["a", "b"]
+    assert queue.claim("other", max_items=2, lease_seconds=60) == ["c"]
+    time.sleep(0.3)
+
+    assert queue.claim("other", max_items=2, lease_seconds=60) == ["a", "b"]
+    # The stalled worker no longer owns them, so it can neither renew nor finish them
+    assert queue.renew("stalled", ["a", "b"], lease_seconds=60) == []
+    assert queue.complete("stalled", ["a", "b"]) == []
+    assert queue.complete("other", ["a", "b", "c"]) == ["a", "b", "c"]
+    assert queue.counts() == {"done": 3}
+
+
+def test_lease_keeper_renews_and_releases_on_exit(tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / "queue.db"))
+    queue.enqueue(["a", "b"])
+    uuids = queue.claim("worker", max_items=2, lease_seconds=0.3)
+
+    with LeaseKeeper(queue, "worker", lease_seconds=0.3) as keeper:
+        keeper.hold(uuids)
+        time.sleep(0.6)
+        # Renewed in the background, so still leased to this worker
+        assert queue.claim("other", max_items=2, lease_seconds=60) == []
+        assert queue.complete("worker", ["a"]) == ["a"]
+        keeper.drop(["a"])
+
+    # "b" wasn't finished, so it's handed back right away
+    assert queue.counts() == {"done": 1, "pending": 1}
+    assert queue.claim("other", max_items=2, lease_seconds=60) == ["b"]
+
+
+def test_quarantined_photo_is_reclaimed_and_processed_once_its_backoff_expires(tmp_path):
+    pytest.importorskip("osxphotos")
+    from lib.quarantine import Quarantine, BASE_BACKOFF
+
+    queue = SQLiteWorkQueue(str(tmp_path / "queue.db"))
+    quarantine = Quarantine(str(tmp_path / "quarantine.db"))
+    quarantine.record_failure("a", "timed out")
+    queue.enqueue(["a", "b"])
+
+    # First run: "a" is still backing off, so it's skipped and failed back to the queue rather than done
+    uuids = queue.claim("worker", max_items=2, lease_seconds=60)
+    skipped = [uuid for uuid in uuids if quarantine.is_blocked(uuid)]
+    assert skipped == ["a"]
+    assert queue.complete("worker", [uuid for uuid in uuids if uuid not in skipped]) == ["b"]
+    assert queue.complete("worker", skipped, failed=True) == ["a"]
+    assert queue.claim("worker", max_items=2, lease_seconds=60) == []
+
+    # A later run, after the back-off, claims it again and processes it
+    queue.enqueue(["a", "b"])
+    assert queue.claim("other", max_items=2, lease_seconds=60) == ["a"]
+    assert not quarantine.is_blocked("a", now=datetime.datetime.now() + BASE_BACKOFF * 2)
+    assert queue.complete("other", ["a"]) == ["a"]
+    assert queue.counts() == {"done": 2}
+    quarantine.close()